@@ -0,0 +1,304 @@
+"""Load generator in the spirit of redis-benchmark.
+
+    python -m app.bench --clients 50 --pipeline 16 --requests 100000
+    python -m app.bench --port 6379 --tests get,set --output results.json
+    python -m app.bench --mix get=90,set=10
+
+Without --port a server is started in-process on a free port, sharing the
+event loop with the load generator. The report is a JSON document, so the
+results of two versions can be compared by a script.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from app.clients import clients
+from app.formatter import formatter
+from app.parser import parser
+
+CommandFactory = Callable[[int], list[Any]]
+
+
+def gil_enabled() -> bool:
+    """Whether the interpreter runs with the GIL, always on before 3.13"""
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+@dataclass
+class Workload:
+    """The commands of a test, and what has to exist before it runs"""
+
+    commands: CommandFactory
+    setup: Optional[CommandFactory] = None
+    # Commands sent by setup, as many as the test sends when unset
+    setup_count: Optional[int] = None
+
+
+def workloads(keyspace: int, value: str) -> dict[str, Workload]:
+    def key(prefix: str) -> str:
+        return f"{prefix}:{random.randrange(keyspace)}"
+
+    return {
+        "ping": Workload(lambda _: ["PING"]),
+        "set": Workload(lambda _: ["SET", key("key"), value]),
+        "get": Workload(
+            lambda _: ["GET", key("key")],
+            setup=lambda n: ["SET", f"key:{n % keyspace}", value],
+        ),
+        "incr": Workload(lambda _: ["INCR", key("counter")]),
+        "rpush": Workload(lambda _: ["RPUSH", "list", value]),
+        "lpop": Workload(
+            lambda _: ["LPOP", "list"], setup=lambda _: ["RPUSH", "list", value]
+        ),
+        "xadd": Workload(lambda _: ["XADD", "stream", "*", "field", value]),
+        "xrange": Workload(
+            lambda _: ["XRANGE", "small-stream", "-", "+"],
+            setup=lambda _: ["XADD", "small-stream", "*", "field", value],
+            setup_count=10,
+        ),
+        "blpop": Workload(
+            lambda _: ["BLPOP", "blocking-list", "0"],
+            setup=lambda _: ["RPUSH", "blocking-list", value],
+        ),
+    }
+
+
+def mix_workload(spec: str, available: dict[str, Workload], requests: int) -> Workload:
+    """A weighted mix such as get=90,set=10"""
+    names, weights = [], []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in available:
+            raise ValueError(f"Unknown test {name}")
+        names.append(name)
+        weights.append(float(weight or 1))
+
+    def commands(n: int) -> list[Any]:
+        (name,) = random.choices(names, weights)
+        return available[name].commands(n)
+
+    setups = [available[name] for name in names if available[name].setup]
+    if not setups:
+        return Workload(commands)
+    # Every setup runs in full, one after the other
+    steps = [
+        (workload.setup, n)
+        for workload in setups
+        for n in range(workload.setup_count or requests)
+    ]
+
+    def setup(n: int) -> list[Any]:
+        factory, step = steps[n]
+        assert factory is not None
+        return factory(step)
+
+    return Workload(commands, setup, len(steps))
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+@dataclass
+class Connection:
+    reader: asyncio.StreamReader
+    writer: asyncio.StreamWriter
+    buffer: bytearray = field(default_factory=bytearray)
+
+    async def round_trip(self, payload: bytes, count: int) -> list[float]:
+        """Send a pipeline, returns when each of its replies arrived"""
+        self.writer.write(payload)
+        arrivals: list[float] = []
+        while len(arrivals) < count:
+            data = await self.reader.read(65536)
+            if not data:
+                raise RuntimeError("Server closed the connection")
+            self.buffer += data
+            replies, consumed = parser.parse_replies(bytes(self.buffer))
+            del self.buffer[:consumed]
+            now = time.perf_counter()
+            arrivals += [now] * len(replies)
+        return arrivals
+
+
+async def run_test(
+    name: str,
+    workload: Workload,
+    host: str,
+    port: int,
+    clients: int,
+    pipeline: int,
+    requests: int,
+) -> dict[str, Any]:
+    connections = []
+    for _ in range(clients):
+        reader, writer = await asyncio.open_connection(host, port)
+        connections.append(Connection(reader, writer))
+
+    if workload.setup is not None:
+        count = workload.setup_count or requests
+        setup = b"".join(
+            formatter.format_command(workload.setup(n)) for n in range(count)
+        )
+        await connections[0].round_trip(setup, count)
+
+    counter = itertools.count()
+    latencies: list[float] = []
+
+    async def client(connection: Connection) -> None:
+        while True:
+            batch = []
+            for _ in range(pipeline):
+                n = next(counter)
+                if n >= requests:
+                    break
+                batch.append(formatter.format_command(workload.commands(n)))
+            if not batch:
+                return
+            sent = time.perf_counter()
+            arrivals = await connection.round_trip(b"".join(batch), len(batch))
+            latencies.extend(arrival - sent for arrival in arrivals)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(connection) for connection in connections))
+    elapsed = time.perf_counter() - started
+
+    for connection in connections:
+        connection.writer.close()
+        await connection.writer.wait_closed()
+
+    latencies.sort()
+    return {
+        "test": name,
+        "requests": len(latencies),
+        "seconds": round(elapsed, 6),
+        "ops_per_sec": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.5) * 1000, 4),
+            "p99": round(percentile(latencies, 0.99) * 1000, 4),
+            "p999": round(percentile(latencies, 0.999) * 1000, 4),
+            "max": round((latencies[-1] if latencies else 0.0) * 1000, 4),
+        },
+    }
+
+
+async def start_in_process_server(network: str) -> tuple[asyncio.AbstractServer, int]:
+    from app.main import handle_client
+    from app.protocol import serve_protocol
+    from app.storage import storage
+
+    if network == "protocol":
+        server = await serve_protocol(storage, "127.0.0.1", 0)
+    else:
+        server = await asyncio.start_server(handle_client, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    random.seed(args.seed)
+    available = workloads(args.keyspace, "x" * args.data_size)
+    if args.mix:
+        tests = {f"mix({args.mix})": mix_workload(args.mix, available, args.requests)}
+    else:
+        names = args.tests.split(",")
+        for name in names:
+            if name not in available:
+                raise ValueError(f"Unknown test {name}")
+        tests = {name: available[name] for name in names}
+
+    server = None
+    host, port = args.host, args.port
+    if port is None:
+        server, port = await start_in_process_server(args.network)
+        host = "127.0.0.1"
+
+    try:
+        results = [
+            await run_test(
+                name,
+                workload,
+                host,
+                port,
+                args.clients,
+                args.pipeline,
+                args.requests,
+            )
+            for name, workload in tests.items()
+        ]
+    finally:
+        if server is not None:
+            server.close()
+            # Let the handlers see the disconnects before the loop stops
+            while clients.connections:
+                await asyncio.sleep(0.01)
+
+    return {
+        "config": {
+            "server": "in-process" if server is not None else f"{host}:{port}",
+            "network": args.network if server is not None else None,
+            "clients": args.clients,
+            "pipeline": args.pipeline,
+            "requests": args.requests,
+            "data_size": args.data_size,
+            "keyspace": args.keyspace,
+            "python": platform.python_version(),
+            "gil": gil_enabled(),
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(description="Redis clone benchmark")
+    arg_parser.add_argument("--host", default="localhost")
+    arg_parser.add_argument(
+        "--port", type=int, help="server to benchmark, an in-process one if unset"
+    )
+    arg_parser.add_argument(
+        "--network",
+        choices=["streams", "protocol"],
+        default="streams",
+        help="network layer of the in-process server",
+    )
+    arg_parser.add_argument("-c", "--clients", type=int, default=50)
+    arg_parser.add_argument("-P", "--pipeline", type=int, default=1)
+    arg_parser.add_argument("-n", "--requests", type=int, default=100_000)
+    arg_parser.add_argument("-d", "--data-size", type=int, default=3)
+    arg_parser.add_argument("-r", "--keyspace", type=int, default=10_000)
+    arg_parser.add_argument(
+        "-t",
+        "--tests",
+        default="set,get,rpush,lpop,xadd,xrange,blpop",
+        help="comma separated tests, run one after the other",
+    )
+    arg_parser.add_argument(
+        "--mix", help="run a single weighted mix instead, e.g. get=90,set=10"
+    )
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("-o", "--output", help="write the JSON here")
+    return arg_parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Bit operations over string values, for the bitmap commands.
+
+Bit 0 is the most significant bit of the first byte, as in Redis. The
+heavy lifting is left to int.from_bytes: a run of bytes becomes one
+integer, and bit_count, bit_length and the bitwise operators then work a
+machine word at a time in C. Long strings are read in CHUNK_SIZE pieces
+so no temporary integer is larger than that.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+CHUNK_SIZE = 1 << 20
+# SETBIT and BITFIELD offsets address at most 512MB, like Redis
+MAX_BIT_OFFSET = (1 << 32) - 1
+
+
+def byte_range(length: int, start: int, end: int) -> Optional[tuple[int, int]]:
+    """A start..end range with negative indexes resolved, None when empty"""
+    if start < 0:
+        start = max(start + length, 0)
+    if end < 0:
+        end = end + length
+    end = min(end, length - 1)
+    if start > end:
+        return None
+    return start, end + 1
+
+
+def bit_count(data: bytes | bytearray, start: int, stop: int) -> int:
+    """Set bits between the bit offsets start (included) and stop (excluded)"""
+    if start >= stop:
+        return 0
+    first, last = start >> 3, (stop - 1) >> 3
+    if first == last:
+        return _bits(data, start, stop).bit_count()
+    # Partial bytes at both ends, whole ones counted chunk by chunk between
+    count = _bits(data, start, (first + 1) << 3).bit_count()
+    count += _bits(data, last << 3, stop).bit_count()
+    view = memoryview(data)[first + 1 : last]
+    for offset in range(0, len(view), CHUNK_SIZE):
+        chunk = view[offset : offset + CHUNK_SIZE]
+        count += int.from_bytes(chunk, "big").bit_count()
+    return count
+
+
+def bit_position(data: bytes | bytearray, bit: int, start: int, stop: int) -> int:
+    """Offset of the first bit equal to bit in start..stop, -1 if there is none"""
+    if start >= stop:
+        return -1
+    view = memoryview(data)
+    offset = start
+    while offset < stop:
+        # Chunks start on a byte boundary after the first one
+        chunk_stop = min(stop, ((offset >> 3) + CHUNK_SIZE) << 3)
+        width = chunk_stop - offset
+        value = _bits(view, offset, chunk_stop)
+        if not bit:
+            value ^= (1 << width) - 1
+        if value:
+            return offset + width - value.bit_length()
+        offset = chunk_stop
+    return -1
+
+
+def bit_operation(operation: str, values: list[bytes | bytearray]) -> bytearray:
+    """BITOP over values, the shorter ones are padded with zero bytes"""
+    length = max((len(value) for value in values), default=0)
+    views = [memoryview(value) for value in values]
+    result = bytearray(length)
+    for start in range(0, length, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, length - start)
+        chunk = 0
+        for idx, view in enumerate(views):
+            piece = view[start : start + size]
+            number = int.from_bytes(piece, "big") << ((size - len(piece)) << 3)
+            if idx == 0:
+                chunk = number
+            elif operation == "AND":
+                chunk &= number
+            elif operation == "OR":
+                chunk |= number
+            elif operation == "XOR":
+                chunk ^= number
+        if operation == "NOT":
+            chunk ^= (1 << (size << 3)) - 1
+        result[start : start + size] = chunk.to_bytes(size, "big")
+    return result
+
+
+def get_bits(data: bytes | bytearray, offset: int, width: int) -> int:
+    """The width bits at offset as an unsigned integer, zeros past the end"""
+    return _bits(data, offset, offset + width)
+
+
+def set_bits(data: bytearray, offset: int, width: int, value: int) -> None:
+    """Store value in the width bits at offset, data has to be long enough"""
+    first, last = offset >> 3, (offset + width - 1) >> 3
+    span = (last - first + 1) << 3
+    shift = span - (offset - (first << 3)) - width
+    mask = ((1 << width) - 1) << shift
+    current = int.from_bytes(data[first : last + 1], "big")
+    current = (current & ~mask) | ((value << shift) & mask)
+    data[first : last + 1] = current.to_bytes(last - first + 1, "big")
+
+
+def _bits(data, start: int, stop: int) -> int:
+    """The bits start..stop as an integer, the first one the most significant"""
+    first, last = start >> 3, (stop - 1) >> 3
+    chunk = bytes(data[first : last + 1])
+    # Missing bytes past the end of the string read as zeros
+    chunk += bytes(last + 1 - first - len(chunk))
+    value = int.from_bytes(chunk, "big")
+    value >>= ((last + 1) << 3) - stop
+    return value & ((1 << (stop - start)) - 1)
+
+
+@dataclass
+class BitfieldOperation:
+    """One GET, SET or INCRBY of a BITFIELD command"""
+
+    name: str
+    signed: bool
+    width: int
+    offset: int
+    value: int = 0
+    # WRAP, SAT or FAIL, how SET and INCRBY handle values out of range
+    overflow: str = "WRAP"
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.width
+
+
+def parse_bitfield_type(text: str) -> tuple[bool, int]:
+    """i1..i64 or u1..u63 as (signed, width)"""
+    signed = text[:1].lower() == "i"
+    try:
+        width = int(text[1:]) if text[:1].lower() in ("i", "u") else 0
+    except ValueError:
+        width = 0
+    if not 0 < width <= (64 if signed else 63):
+        raise ValueError(
+            "Invalid bitfield type. Use something like i16 u8. "
+            "Note that u64 is not supported but i64 is."
+        )
+    return signed, width
+
+
+def run_bitfield(
+    data: bytes | bytearray, operations: list[BitfieldOperation]
+) -> list[Optional[int]]:
+    """Apply the operations in order, returns a reply each, None for a FAIL.
+
+    SET and INCRBY need data to be a bytearray long enough for them.
+    """
+    results: list[Optional[int]] = []
+    for operation in operations:
+        width = operation.width
+        current = get_bits(data, operation.offset, width)
+        if operation.signed and current >> (width - 1):
+            current -= 1 << width
+        if operation.name == "GET":
+            results.append(current)
+            continue
+        if operation.name == "SET":
+            stored = _fit(operation.value, operation)
+        else:
+            stored = _fit(current + operation.value, operation)
+        if stored is None:
+            results.append(None)
+            continue
+        assert isinstance(data, bytearray)
+        set_bits(data, operation.offset, width, stored & ((1 << width) - 1))
+        results.append(current if operation.name == "SET" else stored)
+    return results
+
+
+def _fit(value: int, operation: BitfieldOperation) -> Optional[int]:
+    width = operation.width
+    if operation.signed:
+        low, high = -(1 << (width - 1)), (1 << (width - 1)) - 1
+    else:
+        low, high = 0, (1 << width) - 1
+    if low <= value <= high:
+        return value
+    if operation.overflow == "FAIL":
+        return None
+    if operation.overflow == "SAT":
+        return high if value > high else low
+    value &= (1 << width) - 1
+    return value - (1 << width) if value > high else value
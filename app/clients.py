@@ -0,0 +1,148 @@
+import socket
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from app.config import config
+from app.pubsub import pubsub
+from app.replication import replication
+from app.tracking import tracking
+
+
+@dataclass
+class ClientInfo:
+    processor: Any
+    writer: Any
+    address: str
+    created: float = field(default_factory=time.monotonic)
+    last_interaction: float = field(default_factory=time.monotonic)
+    last_command: str = "NULL"
+    query_buffer: int = 0
+    # When the output buffer went over the soft limit, None while below it
+    soft_limit_since: Optional[float] = None
+
+
+def tune_socket(sock: Optional[socket.socket]) -> None:
+    """Apply the TCP_NODELAY and keepalive settings to an accepted socket"""
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(config.tcp_nodelay))
+    if not config.tcp_keepalive:
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Not every platform lets the probe timing be set per socket
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, config.tcp_keepalive)
+    if hasattr(socket, "TCP_KEEPINTVL"):
+        interval = max(1, config.tcp_keepalive // 3)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, "TCP_KEEPCNT"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+
+def output_buffer_size(writer: Any) -> int:
+    transport = getattr(writer, "transport", None)
+    if transport is None:
+        return 0
+    return transport.get_write_buffer_size()
+
+
+class Clients:
+    """Connected clients, for maxclients, output buffer limits and CLIENT LIST"""
+
+    def __init__(self):
+        self.connections: dict[int, ClientInfo] = {}
+        self.by_writer: dict[Any, ClientInfo] = {}
+
+    def admit(self) -> bool:
+        return len(self.connections) < config.maxclients
+
+    def register(self, processor: Any, writer: Any) -> ClientInfo:
+        peer = writer.get_extra_info("peername")
+        if isinstance(peer, tuple):
+            address = f"{peer[0]}:{peer[1]}"
+            tune_socket(writer.get_extra_info("socket"))
+        else:
+            # Unix socket peers have no name, Redis reports the socket path
+            address = f"{writer.get_extra_info('sockname') or ''}:0"
+        info = ClientInfo(processor, writer, address)
+        self.connections[processor.id] = info
+        self.by_writer[writer] = info
+        return info
+
+    def unregister(self, info: ClientInfo) -> None:
+        """Forget a closed connection, together with its subscriptions"""
+        self.connections.pop(info.processor.id, None)
+        self.by_writer.pop(info.writer, None)
+        pubsub.remove_subscriber(info.writer)
+        replication.remove_replica(info.writer)
+        tracking.disable(info.writer)
+
+    @staticmethod
+    def touch(info: ClientInfo, command: str, query_buffer: int) -> None:
+        info.last_interaction = time.monotonic()
+        info.last_command = command
+        info.query_buffer = query_buffer
+
+    def output_limit_exceeded(self, writer: Any) -> bool:
+        """Whether the client fell so far behind it has to be disconnected.
+
+        Over the hard limit the client is dropped at once, over the soft
+        limit only once it stayed there for the configured seconds.
+        """
+        info = self.by_writer.get(writer)
+        if info is None:
+            return False
+        hard, soft, seconds = config.client_output_buffer_limit
+        size = output_buffer_size(writer)
+        if hard and size > hard:
+            return True
+        if not soft or size <= soft:
+            info.soft_limit_since = None
+            return False
+        now = time.monotonic()
+        if info.soft_limit_since is None:
+            info.soft_limit_since = now
+        return now - info.soft_limit_since >= seconds
+
+    def describe(self, info: ClientInfo) -> str:
+        now = time.monotonic()
+        return " ".join(
+            [
+                f"id={info.processor.id}",
+                f"addr={info.address}",
+                f"name={info.processor.name}",
+                f"age={int(now - info.created)}",
+                f"idle={int(now - info.last_interaction)}",
+                f"db={info.processor.storage.index}",
+                f"qbuf={info.query_buffer}",
+                f"omem={output_buffer_size(info.writer)}",
+                f"resp={info.processor.protocol}",
+                f"cmd={info.last_command.lower()}",
+            ]
+        )
+
+    def list_response(self, ids: Optional[list[int]] = None) -> str:
+        selected = [
+            info
+            for client_id, info in self.connections.items()
+            if ids is None or client_id in ids
+        ]
+        return "".join(self.describe(info) + "\n" for info in selected)
+
+    def kill(
+        self, client_id: Optional[int] = None, address: Optional[str] = None
+    ) -> int:
+        """Close the matching connections, returns how many there were"""
+        killed = 0
+        for info in list(self.connections.values()):
+            if client_id is not None and info.processor.id != client_id:
+                continue
+            if address is not None and info.address != address:
+                continue
+            info.writer.close()
+            killed += 1
+        return killed
+
+
+clients = Clients()
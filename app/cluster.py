@@ -0,0 +1,355 @@
+import asyncio
+import datetime
+import secrets
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from app.config import config
+from app.formatter import formatter
+from app.parser import Command, ReplyError, parser
+from app.replication import key_commands
+from app.storage import Storage
+
+CLUSTER_SLOTS = 16384
+
+
+def _crc16_table() -> list[int]:
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+        table.append(crc & 0xFFFF)
+    return table
+
+
+CRC16_TABLE = _crc16_table()
+
+
+def crc16(data: bytes) -> int:
+    """CRC16-CCITT (XMODEM), the checksum Redis Cluster hashes keys with"""
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[((crc >> 8) ^ byte) & 0xFF]
+    return crc
+
+
+def key_hash_slot(key: str) -> int:
+    """Slot of a key, only the first non-empty {...} hash tag is hashed"""
+    encoded = key.encode("utf-8", "surrogateescape")
+    start = encoded.find(b"{")
+    if start != -1:
+        end = encoded.find(b"}", start + 1)
+        if end > start + 1:
+            encoded = encoded[start + 1 : end]
+    return crc16(encoded) % CLUSTER_SLOTS
+
+
+def valid_num_keys(args: list[str]) -> Optional[int]:
+    """The numkeys of FCALL args, None unless it is an integer the args cover"""
+    try:
+        num_keys = int(args[1])
+    except (IndexError, ValueError):
+        return None
+    return num_keys if 0 <= num_keys <= len(args) - 2 else None
+
+
+def command_keys(command: Command, args: list[str]) -> list[str]:
+    """Keys a command touches, used to route it to the owning node"""
+    match command:
+        case Command.XREAD | Command.XREADGROUP:
+            try:
+                streams = [arg.upper() for arg in args].index("STREAMS")
+            except ValueError:
+                # A syntax error, the command itself replies with it
+                return []
+            names = args[streams + 1 :]
+            return names[: len(names) // 2]
+        case Command.XGROUP | Command.XINFO | Command.OBJECT:
+            return args[1:2]
+        case Command.BITOP:
+            return args[1:]
+        case Command.FCALL | Command.FCALL_RO:
+            num_keys = valid_num_keys(args)
+            return [] if num_keys is None else args[2 : 2 + num_keys]
+        case (
+            Command.DEL
+            | Command.UNLINK
+            | Command.MGET
+            | Command.PFCOUNT
+            | Command.PFMERGE
+        ):
+            return args
+        case Command.MSET | Command.MSETNX:
+            return args[::2]
+        case (
+            Command.SET
+            | Command.GET
+            | Command.RPUSH
+            | Command.LRANGE
+            | Command.LPUSH
+            | Command.LLEN
+            | Command.LPOP
+            | Command.BLPOP
+            | Command.TYPE
+            | Command.XADD
+            | Command.PFADD
+            | Command.SETBIT
+            | Command.GETBIT
+            | Command.BITCOUNT
+            | Command.BITPOS
+            | Command.BITFIELD
+            | Command.XRANGE
+            | Command.INCR
+            | Command.DECR
+            | Command.INCRBY
+            | Command.DECRBY
+            | Command.INCRBYFLOAT
+            | Command.APPEND
+            | Command.GETRANGE
+            | Command.SETRANGE
+            | Command.STRLEN
+            | Command.XACK
+            | Command.XPENDING
+            | Command.XCLAIM
+            | Command.XAUTOCLAIM
+            | Command.XTRIM
+            | Command.XDEL
+            | Command.XLEN
+            | Command.XSETID
+        ):
+            return args[:1]
+    return []
+
+
+@dataclass
+class ClusterNode:
+    id: str
+    host: str
+    port: int
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+class Cluster:
+    """Slot ownership table of a cluster node.
+
+    There is no gossip bus: nodes are introduced with CLUSTER MEET and every
+    node is told about slot owners with CLUSTER ADDSLOTS / SETSLOT.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.myself = ClusterNode(secrets.token_hex(20), "127.0.0.1", config.port)
+        self.nodes: dict[str, ClusterNode] = {self.myself.id: self.myself}
+        self.slots: list[Optional[ClusterNode]] = [None] * CLUSTER_SLOTS
+        self.migrating: dict[int, ClusterNode] = {}
+        self.importing: dict[int, ClusterNode] = {}
+
+    def enable(self, host: str, port: int) -> None:
+        self.enabled = True
+        self.myself.host, self.myself.port = host, port
+
+    def route(
+        self, command: Command, args: list[str], storage: Storage, asking: bool
+    ) -> Optional[ReplyError]:
+        """The redirection error for a command this node must not serve"""
+        keys = command_keys(command, args)
+        if not keys:
+            return None
+
+        slot = key_hash_slot(keys[0])
+        if any(key_hash_slot(key) != slot for key in keys[1:]):
+            return ReplyError("CROSSSLOT Keys in request don't hash to the same slot")
+
+        owner = self.slots[slot]
+        if owner is self.myself:
+            target = self.migrating.get(slot)
+            if target is None:
+                return None
+            missing = sum(1 for key in keys if key not in storage.data)
+            if missing == 0:
+                return None
+            if missing < len(keys):
+                return ReplyError("TRYAGAIN Multiple keys request during migration")
+            return ReplyError(f"ASK {slot} {target.address}")
+
+        if asking and slot in self.importing:
+            return None
+        if owner is None:
+            return ReplyError("CLUSTERDOWN Hash slot not served")
+        return ReplyError(f"MOVED {slot} {owner.address}")
+
+    def add_slots(self, slots: list[int]) -> None:
+        for slot in slots:
+            if self.slots[slot] is not None:
+                raise RuntimeError(f"Slot {slot} is already busy")
+        for slot in slots:
+            self.slots[slot] = self.myself
+
+    def delete_slots(self, slots: list[int]) -> None:
+        for slot in slots:
+            self.slots[slot] = None
+            self.migrating.pop(slot, None)
+            self.importing.pop(slot, None)
+
+    def set_slot(self, slot: int, state: str, node_id: Optional[str]) -> None:
+        match state:
+            case "MIGRATING":
+                self.migrating[slot] = self._node(node_id)
+            case "IMPORTING":
+                self.importing[slot] = self._node(node_id)
+            case "STABLE":
+                self.migrating.pop(slot, None)
+                self.importing.pop(slot, None)
+            case "NODE":
+                self.slots[slot] = self._node(node_id)
+                self.migrating.pop(slot, None)
+                self.importing.pop(slot, None)
+            case _:
+                raise RuntimeError(f"Invalid CLUSTER SETSLOT action {state}")
+
+    async def meet(self, host: str, port: int) -> ClusterNode:
+        """Learn the id of another node by asking it directly"""
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(formatter.format_command(["CLUSTER", "MYID"]))
+            node_id = (await self._read_replies(reader, 1))[0]
+        finally:
+            writer.close()
+        if isinstance(node_id, ReplyError):
+            raise RuntimeError(f"Node {host}:{port} replied {node_id}")
+        node = self.nodes.setdefault(node_id, ClusterNode(node_id, host, port))
+        node.host, node.port = host, port
+        return node
+
+    async def migrate(
+        self, host: str, port: int, keys: list[str], storage: Storage, copy: bool
+    ) -> bool:
+        """Move keys to another node, the target accepts them through ASKING"""
+        now = datetime.datetime.now()
+        commands = []
+        for key in keys:
+            for command in key_commands(key, storage.data.get(key), now):
+                commands += [["ASKING"], command]
+        if not commands:
+            return False
+
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(
+                b"".join(formatter.format_command(command) for command in commands)
+            )
+            for reply in await self._read_replies(reader, len(commands)):
+                if isinstance(reply, ReplyError):
+                    raise RuntimeError(f"Target replied {reply}")
+        finally:
+            writer.close()
+        if not copy:
+            for key in keys:
+                storage.delete(key)
+        return True
+
+    def slot_ranges(self) -> list[tuple[int, int, ClusterNode]]:
+        ranges: list[tuple[int, int, ClusterNode]] = []
+        for slot, node in enumerate(self.slots):
+            if node is None:
+                continue
+            if ranges and ranges[-1][2] is node and ranges[-1][1] == slot - 1:
+                ranges[-1] = (ranges[-1][0], slot, node)
+            else:
+                ranges.append((slot, slot, node))
+        return ranges
+
+    def slots_response(self) -> list[Any]:
+        return [
+            [start, end, [node.host, node.port, node.id]]
+            for start, end, node in self.slot_ranges()
+        ]
+
+    def shards_response(self) -> list[Any]:
+        shards: dict[str, list[int]] = {node_id: [] for node_id in self.nodes}
+        for start, end, node in self.slot_ranges():
+            shards[node.id] += [start, end]
+        return [
+            [
+                "slots",
+                slots,
+                "nodes",
+                [
+                    [
+                        "id",
+                        node_id,
+                        "port",
+                        self.nodes[node_id].port,
+                        "ip",
+                        self.nodes[node_id].host,
+                        "endpoint",
+                        self.nodes[node_id].host,
+                        "role",
+                        "master",
+                        "health",
+                        "online",
+                    ]
+                ],
+            ]
+            for node_id, slots in shards.items()
+        ]
+
+    def nodes_response(self) -> str:
+        lines = []
+        for node in self.nodes.values():
+            flags = "myself,master" if node is self.myself else "master"
+            ranges = [
+                str(start) if start == end else f"{start}-{end}"
+                for start, end, owner in self.slot_ranges()
+                if owner is node
+            ]
+            if node is self.myself:
+                ranges += [
+                    f"[{slot}->-{target.id}]" for slot, target in self.migrating.items()
+                ]
+                ranges += [
+                    f"[{slot}-<-{source.id}]" for slot, source in self.importing.items()
+                ]
+            lines.append(
+                " ".join(
+                    [
+                        node.id,
+                        f"{node.address}@{node.port + 10000}",
+                        flags,
+                        "-",
+                        "0",
+                        "0",
+                        "0",
+                        "connected",
+                        *ranges,
+                    ]
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+    def _node(self, node_id: Optional[str]) -> ClusterNode:
+        node = self.nodes.get(node_id or "")
+        if node is None:
+            raise RuntimeError(f"I don't know about node {node_id}")
+        return node
+
+    @staticmethod
+    async def _read_replies(reader: asyncio.StreamReader, count: int) -> list[Any]:
+        buffer = b""
+        replies: list[Any] = []
+        while len(replies) < count:
+            data = await reader.read(65536)
+            if not data:
+                raise RuntimeError("Connection closed")
+            buffer += data
+            parsed, consumed = parser.parse_replies(buffer)
+            replies += parsed
+            buffer = buffer[consumed:]
+        return replies
+
+
+cluster = Cluster()
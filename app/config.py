@@ -0,0 +1,83 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass
+class Config:
+    """Server settings, populated from the command line at startup"""
+
+    # TCP port, 0 disables TCP and leaves only the Unix socket
+    port: int = 6379
+    bind: list[str] = field(default_factory=lambda: ["localhost"])
+    tcp_backlog: int = 511
+    tcp_nodelay: bool = True
+    # Seconds of silence before keepalive probes are sent, 0 disables them
+    tcp_keepalive: int = 300
+    unixsocket: Optional[str] = None
+    unixsocketperm: Optional[int] = None
+    functions_dir: Optional[str] = None
+    # "host port" of the master when running as a replica
+    replicaof: Optional[str] = None
+    repl_backlog_size: int = 1024 * 1024
+    cluster_enabled: bool = False
+    # Logical databases SELECT can choose from
+    databases: int = 16
+    # Keyspace event classes published, a bitmask of app.notifications flags
+    notify_keyspace_events: int = 0
+    # Expired keys removed per database and step of the active expire cycle
+    active_expire_keys: int = 200
+    # Seconds between two steps of the active expire cycle
+    active_expire_interval: float = 0.1
+    # Entries per stream node, an approximate trim drops whole nodes
+    stream_node_max_entries: int = 100
+    # Release overwritten values in the background
+    lazyfree_lazy_server_del: bool = True
+    # Make DEL behave like UNLINK
+    lazyfree_lazy_user_del: bool = False
+    # Subscribers whose pending output exceeds this many bytes are disconnected
+    pubsub_output_buffer_limit: int = 32 * 1024 * 1024
+    # "streams" serves connections with StreamReader / StreamWriter,
+    # "protocol" with a bare asyncio.Protocol
+    network: str = "streams"
+    # Run on uvloop when it is installed
+    uvloop: bool = False
+    # Accepted for compatibility and ignored. Parsing on worker threads was
+    # measured slower with the GIL (SET 108.7k vs 112.7k ops/s, GET 118.8k vs
+    # 129.0k, 20 clients, pipeline 32), and replies, the larger part of the
+    # protocol work, have to be encoded on the event loop thread: they are
+    # built from live values the next command may change. Threads can come
+    # back once reply encoding can move off it.
+    io_threads: int = 0
+    maxclients: int = 10000
+    # Connections idle for this many seconds are closed, 0 disables it
+    timeout: int = 0
+    # Unparsed input allowed per connection before it is dropped
+    client_query_buffer_limit: int = 1024 * 1024 * 1024
+    # Pending output per connection: hard limit, soft limit and how many
+    # seconds a client may stay over the soft one, 0 disables a limit
+    client_output_buffer_limit: tuple[int, int, int] = (
+        256 * 1024 * 1024,
+        64 * 1024 * 1024,
+        60,
+    )
+    # Keys remembered for CLIENT TRACKING, the oldest are invalidated first
+    tracking_table_max_keys: int = 1_000_000
+    # Directory of the on-disk tier for cold values, disabled when unset
+    tiered_storage_dir: Optional[str] = None
+    # Only strings at least this large are moved to disk
+    tiered_value_min_size: int = 4096
+    tiered_segment_size: int = 64 * 1024 * 1024
+    # Seconds between two demotion and compaction steps
+    tiered_sweep_interval: float = 1.0
+    # Keys examined per demotion step, a key that is not read during a full
+    # pass over the keyspace is considered cold
+    tiered_sweep_count: int = 1000
+    # Sealed segments with a smaller live share are compacted
+    tiered_compact_ratio: float = 0.5
+    # Count key accesses for OBJECT FREQ / IDLETIME and HOTKEYS
+    access_tracking: bool = False
+    # Where DEBUG PROFILE STOP writes profiles, the working directory if unset
+    profile_dir: Optional[str] = None
+
+
+config = Config()
@@ -1,12 +1,13 @@
-from typing import Optional
+from typing import Any, Optional
 
-from app.storage import Value, ValueType
+from app.parser import ReplyError
+from app.storage import Value, ValueType, string_bytes
 
 
 class Formatter:
     def format_string_expression(self, argument: str) -> bytes:
-        response = f"${len(argument)}\r\n{argument}\r\n"
-        return response.encode("utf-8")
+        encoded = argument.encode("utf-8", "surrogateescape")
+        return b"$%d\r\n%s\r\n" % (len(encoded), encoded)
 
     def format_ok_expression(self) -> bytes:
         return b"+OK\r\n"
@@ -14,8 +15,17 @@ class Formatter:
     def format_get_response(self, value: Optional[Value]) -> bytes:
         if not value:
             return b"$-1\r\n"
-        response = f"${len(value.item)}\r\n{value.item}\r\n"
-        return response.encode("utf-8")
+        item = string_bytes(value.item)
+        return b"$%d\r\n%s\r\n" % (len(item), item)
+
+    def format_mget_response(self, values: list[Optional[Value]]) -> bytes:
+        parts = [b"$-1\r\n"] * (len(values) + 1)
+        parts[0] = b"*%d\r\n" % len(values)
+        for idx, value in enumerate(values, 1):
+            if value is not None:
+                item = string_bytes(value.item)
+                parts[idx] = b"$%d\r\n%s\r\n" % (len(item), item)
+        return b"".join(parts)
 
     def format_len_response(self, values: list[Value]) -> bytes:
         return f":{len(values)}\r\n".encode("utf-8")
@@ -36,7 +46,8 @@ class Formatter:
         return f"+{record_type.name.lower()}\r\n".encode("utf-8")
 
     def format_simple_error(self, error: Exception) -> bytes:
-        return f"-ERR {str(error)}\r\n".encode("utf-8")
+        prefix = getattr(error, "prefix", "ERR")
+        return f"-{prefix} {str(error)}\r\n".encode("utf-8")
 
     def format_xrange_response(self, values: Optional[list[Value]]) -> bytes:
         if not values:
@@ -78,5 +89,49 @@ class Formatter:
 
         return f"*{len(record_list)}\r\n{streams}".encode("utf-8")
 
+    def format_value(self, value: Any) -> bytes:
+        """Encode an arbitrary Python value, e.g. a function result, into RESP"""
+        match value:
+            case None | False:
+                return b"$-1\r\n"
+            case True:
+                return b":1\r\n"
+            case int():
+                return f":{value}\r\n".encode("utf-8")
+            case ReplyError():
+                return f"-{value}\r\n".encode("utf-8")
+            case Exception():
+                return self.format_simple_error(value)
+            case bytes() | bytearray():
+                return b"$%d\r\n%s\r\n" % (len(value), value)
+            case list() | tuple():
+                return b"*%d\r\n" % len(value) + b"".join(
+                    self.format_value(item) for item in value
+                )
+            case _:
+                encoded = str(value).encode("utf-8", "surrogateescape")
+                return b"$%d\r\n%s\r\n" % (len(encoded), encoded)
+
+    def format_map(self, items: dict[str, Any], protocol: int = 2) -> bytes:
+        """A RESP3 map, or the flat key / value array RESP2 clients expect"""
+        header = (
+            b"%%%d\r\n" % len(items) if protocol == 3 else b"*%d\r\n" % (len(items) * 2)
+        )
+        return header + b"".join(
+            self.format_value(part) for pair in items.items() for part in pair
+        )
+
+    def format_command(self, args: list[Any]) -> bytes:
+        """Encode a command as an array of bulk strings, as a client would send it"""
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            encoded = (
+                arg
+                if isinstance(arg, (bytes, bytearray, memoryview))
+                else str(arg).encode("utf-8", "surrogateescape")
+            )
+            parts.append(b"$%d\r\n%s\r\n" % (len(encoded), encoded))
+        return b"".join(parts)
+
 
 formatter = Formatter()
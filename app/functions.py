@@ -0,0 +1,230 @@
+import ast
+import builtins
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+
+class FunctionError(Exception):
+    pass
+
+
+# Builtins available to library code. Anything that reaches outside the
+# process (open, __import__, exec, ...) is deliberately absent.
+SAFE_BUILTINS = {
+    name: getattr(builtins, name)
+    for name in (
+        "abs",
+        "all",
+        "any",
+        "bool",
+        "dict",
+        "divmod",
+        "enumerate",
+        "Exception",
+        "filter",
+        "float",
+        "int",
+        "isinstance",
+        "len",
+        "list",
+        "map",
+        "max",
+        "min",
+        "range",
+        "reversed",
+        "round",
+        "set",
+        "sorted",
+        "str",
+        "sum",
+        "tuple",
+        "ValueError",
+        "zip",
+    )
+}
+
+LIBRARY_HEADER = "#!python"
+
+
+@dataclass
+class RegisteredFunction:
+    name: str
+    callback: Callable
+    library: str
+    read_only: bool = False
+
+
+@dataclass
+class Library:
+    name: str
+    code: str
+    functions: dict[str, RegisteredFunction] = field(default_factory=dict)
+
+
+class FunctionApi:
+    """The `redis` object visible to library code"""
+
+    def __init__(self, registry: "FunctionRegistry"):
+        self._registry = registry
+
+    def register_function(
+        self, name: str, callback: Callable, flags: tuple[str, ...] = ()
+    ) -> None:
+        self._registry._register(name, callback, flags)
+
+    def call(self, *args: Any) -> Any:
+        """Run a command and return its reply, raising on error replies"""
+        reply = self._registry._dispatch([str(arg) for arg in args])
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def pcall(self, *args: Any) -> Any:
+        """Run a command and return its reply, errors are returned as values"""
+        return self._registry._dispatch([str(arg) for arg in args])
+
+
+class FunctionRegistry:
+    """Libraries of named Python functions invoked through FCALL"""
+
+    def __init__(self):
+        self.libraries: dict[str, Library] = {}
+        self.functions: dict[str, RegisteredFunction] = {}
+        self._loading: Optional[Library] = None
+        self._dispatcher: Optional[Callable[[list[str], bool], Any]] = None
+        self._read_only = False
+        self.api = FunctionApi(self)
+
+    def load(self, code: str, replace: bool = False) -> str:
+        """Compile a library once and register the functions it declares"""
+        name = self._parse_header(code)
+        if name in self.libraries and not replace:
+            raise FunctionError(f"Library '{name}' already exists")
+
+        try:
+            tree = ast.parse(code, filename=f"<library {name}>")
+        except SyntaxError as err:
+            raise FunctionError(f"Error compiling library '{name}': {err}")
+        self._validate(tree)
+        compiled = compile(tree, f"<library {name}>", "exec")
+
+        library = Library(name, code)
+        self._loading = library
+        try:
+            exec(compiled, {"__builtins__": SAFE_BUILTINS, "redis": self.api})
+        except FunctionError:
+            raise
+        except Exception as err:
+            raise FunctionError(f"Error loading library '{name}': {err}")
+        finally:
+            self._loading = None
+
+        if not library.functions:
+            raise FunctionError("No functions registered")
+        previous = self.libraries.get(name)
+        for function_name in library.functions:
+            owner = self.functions.get(function_name)
+            if owner is not None and owner.library != name:
+                raise FunctionError(f"Function {function_name} already exists")
+
+        if previous is not None:
+            self._drop(previous)
+        self.libraries[name] = library
+        self.functions.update(library.functions)
+        return name
+
+    def load_directory(self, path: str) -> list[str]:
+        """Load every `*.py` library found in the plugin directory"""
+        loaded = []
+        for file_name in sorted(os.listdir(path)):
+            if not file_name.endswith(".py"):
+                continue
+            with open(os.path.join(path, file_name), encoding="utf-8") as file:
+                loaded.append(self.load(file.read()))
+        return loaded
+
+    def delete(self, name: str) -> None:
+        library = self.libraries.pop(name, None)
+        if library is None:
+            raise FunctionError("Library not found")
+        self._drop(library)
+
+    def flush(self) -> None:
+        self.libraries.clear()
+        self.functions.clear()
+
+    def call(
+        self,
+        name: str,
+        keys: list[str],
+        args: list[str],
+        dispatcher: Callable[[list[str], bool], Any],
+        read_only: bool = False,
+    ) -> Any:
+        """Invoke a registered function, commands are run through the dispatcher"""
+        function = self.functions.get(name)
+        if function is None:
+            raise FunctionError("Function not found")
+        if read_only and not function.read_only:
+            raise FunctionError(
+                "Can not execute a script with write flag using *_ro command."
+            )
+
+        self._dispatcher = dispatcher
+        self._read_only = read_only or function.read_only
+        try:
+            return function.callback(keys, args)
+        except FunctionError:
+            raise
+        except Exception as err:
+            raise FunctionError(f"Error running function '{name}': {err}")
+        finally:
+            self._dispatcher = None
+            self._read_only = False
+
+    def _register(self, name: str, callback: Callable, flags: tuple[str, ...]) -> None:
+        if self._loading is None:
+            raise FunctionError("register_function can only be called on library load")
+        if not callable(callback):
+            raise FunctionError(f"Function {name} is not callable")
+        if name in self._loading.functions:
+            raise FunctionError(f"Function {name} already exists")
+        self._loading.functions[name] = RegisteredFunction(
+            name, callback, self._loading.name, "no-writes" in flags
+        )
+
+    def _dispatch(self, args: list[str]) -> Any:
+        if self._dispatcher is None:
+            raise FunctionError("Commands can only be called from a running function")
+        return self._dispatcher(args, self._read_only)
+
+    def _drop(self, library: Library) -> None:
+        for function_name in library.functions:
+            self.functions.pop(function_name, None)
+
+    @staticmethod
+    def _parse_header(code: str) -> str:
+        first_line = code.split("\n", 1)[0].strip()
+        if not first_line.startswith(LIBRARY_HEADER):
+            raise FunctionError("Missing library metadata")
+        for option in first_line[len(LIBRARY_HEADER) :].split():
+            if option.startswith("name="):
+                name = option[len("name=") :]
+                if name:
+                    return name
+        raise FunctionError("Library name was not given")
+
+    @staticmethod
+    def _validate(tree: ast.AST) -> None:
+        """Reject imports and dunder access, the usual ways out of restricted builtins"""
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                raise FunctionError("Imports are not allowed in function libraries")
+            if isinstance(node, ast.Attribute) and node.attr.startswith("_"):
+                raise FunctionError(f"Access to '{node.attr}' is not allowed")
+            if isinstance(node, ast.Name) and node.id.startswith("__"):
+                raise FunctionError(f"Access to '{node.id}' is not allowed")
+
+
+functions = FunctionRegistry()
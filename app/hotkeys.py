@@ -0,0 +1,118 @@
+"""Access frequencies for OBJECT FREQ and HOTKEYS.
+
+Frequencies are estimated by a count-min sketch, a fixed table of
+counters however many keys there are, and the most accessed keys are
+kept in a small min-heap next to it. An access costs a hash, a few
+multiplications and shifts per row and, for a key hot enough to enter
+the top, a heap operation on at most TOP_KEYS entries.
+
+Like the reset of TinyLFU, every counter is halved once as many accesses
+as ten times the sketch width were counted, so keys that cool down fall
+back and the counters never overflow.
+"""
+
+import heapq
+from array import array
+from typing import Any
+
+SKETCH_WIDTH_BITS = 14
+SKETCH_DEPTH = 4
+# Keys kept for HOTKEYS
+TOP_KEYS = 32
+
+# Odd 64-bit multipliers, one per row of the sketch
+ROW_SEEDS = (
+    0x9E3779B97F4A7C15,
+    0xC2B2AE3D27D4EB4F,
+    0x165667B19E3779F9,
+    0xD6E8FEB86659FD93,
+)
+MASK_64 = (1 << 64) - 1
+
+
+class CountMinSketch:
+    def __init__(self, width_bits: int = SKETCH_WIDTH_BITS, depth: int = SKETCH_DEPTH):
+        self.width = 1 << width_bits
+        self.shift = 64 - width_bits
+        self.seeds = ROW_SEEDS[:depth]
+        self.rows = [array("I", bytes(4 * self.width)) for _ in self.seeds]
+        self.additions = 0
+        self.reset_at = 10 * self.width
+
+    def add(self, key: Any) -> int:
+        """Count an access, returns the key's estimate including it.
+
+        Conservative update: only the counters at the current minimum are
+        raised, the others already overestimate the key.
+        """
+        h = hash(key)
+        slots = [((h * seed) & MASK_64) >> self.shift for seed in self.seeds]
+        estimate = min(row[slot] for row, slot in zip(self.rows, slots)) + 1
+        for row, slot in zip(self.rows, slots):
+            if row[slot] < estimate:
+                row[slot] = estimate
+        self.additions += 1
+        if self.additions >= self.reset_at:
+            self.decay()
+        return estimate
+
+    def estimate(self, key: Any) -> int:
+        h = hash(key)
+        return min(
+            row[((h * seed) & MASK_64) >> self.shift]
+            for row, seed in zip(self.rows, self.seeds)
+        )
+
+    def decay(self) -> None:
+        for idx, row in enumerate(self.rows):
+            self.rows[idx] = array("I", (count >> 1 for count in row))
+        self.additions = 0
+
+
+class AccessTracker:
+    """The sketch together with the keys estimated to be the most accessed"""
+
+    def __init__(self, top_keys: int = TOP_KEYS):
+        self.sketch = CountMinSketch()
+        self.top_keys = top_keys
+        # Estimates of the top keys, and a min-heap over them that may hold
+        # outdated entries, dropped when they reach the root
+        self.top: dict[Any, int] = {}
+        self.heap: list[tuple[int, Any]] = []
+
+    def touch(self, key: Any) -> None:
+        additions = self.sketch.additions
+        estimate = self.sketch.add(key)
+        if self.sketch.additions < additions:
+            # The sketch was just halved, so are the top estimates
+            estimate >>= 1
+            self.top = {other: count >> 1 for other, count in self.top.items()}
+            self._rebuild_heap()
+        top, heap = self.top, self.heap
+        if key in top:
+            top[key] = estimate
+            heapq.heappush(heap, (estimate, key))
+            if len(heap) > 4 * self.top_keys:
+                self._rebuild_heap()
+            return
+        if len(top) < self.top_keys:
+            top[key] = estimate
+            heapq.heappush(heap, (estimate, key))
+            return
+        while top.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        if estimate > heap[0][0]:
+            _, coldest = heapq.heapreplace(heap, (estimate, key))
+            del top[coldest]
+            top[key] = estimate
+
+    def frequency(self, key: Any) -> int:
+        return self.sketch.estimate(key)
+
+    def hottest(self, count: int) -> list[tuple[Any, int]]:
+        """Up to count keys, the most accessed first"""
+        return heapq.nlargest(count, self.top.items(), key=lambda item: item[1])
+
+    def _rebuild_heap(self) -> None:
+        self.heap = [(count, key) for key, count in self.top.items()]
+        heapq.heapify(self.heap)
@@ -0,0 +1,94 @@
+import queue
+import threading
+from collections import deque
+from typing import Any, Optional
+
+from app.streams import Stream
+
+# Values with at most this many elements are cheaper to free inline
+LAZYFREE_THRESHOLD = 64
+# Elements released per step by the background thread, the GIL can be
+# handed back to the event loop between two steps
+LAZYFREE_CHUNK = 1024
+
+
+def free_effort(value: Any) -> int:
+    """Roughly how many allocations releasing the value touches"""
+    if isinstance(value, (list, deque, dict, Stream)):
+        return len(value)
+    return 1
+
+
+class LazyFree:
+    """Tears large values down on a background thread.
+
+    Dropping the last reference to a 10M element list frees it in one go,
+    holding the GIL until the end. The worker releases it in chunks instead,
+    so the event loop keeps running while the memory is given back.
+    """
+
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def free(self, value: Any) -> bool:
+        """Hand the value over if it is large, returns whether it was taken"""
+        if free_effort(value) <= LAZYFREE_THRESHOLD:
+            return False
+        self._ensure_thread()
+        self.queue.put(value)
+        return True
+
+    def pending(self) -> int:
+        return self.queue.unfinished_tasks
+
+    def wait(self) -> None:
+        """Block until everything handed over so far is released"""
+        self.queue.join()
+
+    def _ensure_thread(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="lazyfree", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            value = self.queue.get()
+            try:
+                self._tear_down(value)
+            except Exception as err:
+                print(f"Lazy free error: {err}")
+            finally:
+                del value
+                self.queue.task_done()
+
+    def _tear_down(self, value: Any) -> None:
+        if isinstance(value, list):
+            while value:
+                del value[-LAZYFREE_CHUNK:]
+        elif isinstance(value, deque):
+            while value:
+                for _ in range(min(LAZYFREE_CHUNK, len(value))):
+                    value.pop()
+        elif isinstance(value, Stream):
+            # A node holds at most stream_node_max_entries entries
+            while value.nodes:
+                value.nodes.pop()
+        elif isinstance(value, dict):
+            # A whole keyspace, the large values in it are torn down as well
+            while value:
+                for _ in range(min(LAZYFREE_CHUNK, len(value))):
+                    _, item = dict.popitem(value)
+                    if free_effort(item) > LAZYFREE_THRESHOLD:
+                        self._tear_down(item)
+            # Indexes kept next to the keyspace are as large as the keyspace
+            for attribute in getattr(value, "__dict__", {}).values():
+                if free_effort(attribute) > LAZYFREE_THRESHOLD:
+                    self._tear_down(attribute)
+
+
+lazyfree = LazyFree()
@@ -1,36 +1,278 @@
+import argparse
 import asyncio
+import os
 
+from app.clients import clients
+from app.cluster import cluster
+from app.config import config
+from app.functions import functions
+from app.notifications import parse_event_flags
 from app.parser import parser
-from app.processor import Processor
-from app.storage import storage
+from app.processor import Processor, coalesce_xadds, command_name
+from app.protocol import serve_protocol, serve_protocol_unix
+from app.pubsub import pubsub
+from app.replication import replication
+from app.storage import databases, storage
 
 
 async def handle_client(reader, writer):
     """Handle a single client connection."""
 
+    if not clients.admit():
+        writer.write(b"-ERR max number of clients reached\r\n")
+        writer.close()
+        await writer.wait_closed()
+        return
+
+    processor = Processor(writer, storage)
+    info = clients.register(processor, writer)
+    buffer = bytearray()
+    wanted = 0
     try:
         while True:
-            data = await reader.read(1024)
+            try:
+                data = await asyncio.wait_for(
+                    reader.read(65536), config.timeout or None
+                )
+            except asyncio.TimeoutError:
+                # Subscribers and replicas are expected to stay quiet
+                if pubsub.is_subscribed(writer) or writer in replication.replicas:
+                    continue
+                break
             if not data:
                 break
-            cmd = parser.parse_command(data)
-            processor = Processor(writer, storage)
-            await processor.process_command(cmd)
+            buffer += data
+            if len(buffer) > config.client_query_buffer_limit:
+                print(f"Closing client {processor.id}, query buffer limit reached")
+                break
+            if len(buffer) < wanted:
+                continue
+            commands, consumed = parser.parse_commands(buffer)
+            del buffer[:consumed]
+            wanted = parser.wanted_size(buffer)
+            for cmd in coalesce_xadds(commands):
+                clients.touch(info, command_name(cmd), len(buffer))
+                await processor.process_command(cmd)
+                if writer.is_closing():
+                    return
     except Exception as e:
         print(f"Error: {e}")
     finally:
+        clients.unregister(info)
         writer.close()
         await writer.wait_closed()
 
 
-async def main():
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(description="Redis clone")
+    arg_parser.add_argument(
+        "--port", type=int, default=config.port, help="TCP port, 0 disables TCP"
+    )
+    arg_parser.add_argument(
+        "--bind",
+        nargs="+",
+        default=config.bind,
+        metavar="ADDRESS",
+        help="addresses to listen on for TCP connections",
+    )
+    arg_parser.add_argument("--tcp-backlog", type=int, default=config.tcp_backlog)
+    arg_parser.add_argument(
+        "--tcp-nodelay",
+        action=argparse.BooleanOptionalAction,
+        default=config.tcp_nodelay,
+        help="disable Nagle's algorithm on client sockets",
+    )
+    arg_parser.add_argument(
+        "--tcp-keepalive",
+        type=int,
+        default=config.tcp_keepalive,
+        help="seconds of silence before keepalive probes, 0 disables them",
+    )
+    arg_parser.add_argument("--unixsocket", metavar="PATH")
+    arg_parser.add_argument(
+        "--unixsocketperm",
+        type=lambda value: int(value, 8),
+        metavar="MODE",
+        help="permissions of the Unix socket, in octal",
+    )
+    arg_parser.add_argument(
+        "--replicaof",
+        nargs="+",
+        metavar="HOST PORT",
+        help='master to replicate, either "host port" or two arguments',
+    )
+    arg_parser.add_argument(
+        "--cluster-enabled",
+        action="store_true",
+        help="serve only the hash slots assigned to this node",
+    )
+    arg_parser.add_argument(
+        "--databases",
+        type=int,
+        default=config.databases,
+        help="number of logical databases SELECT can choose from",
+    )
+    arg_parser.add_argument(
+        "--notify-keyspace-events",
+        type=parse_event_flags,
+        default=config.notify_keyspace_events,
+        metavar="CLASSES",
+        help='keyspace events to publish, e.g. "Ex" for expirations',
+    )
+    arg_parser.add_argument(
+        "--functions-dir",
+        help="directory of function libraries (*.py) loaded at startup",
+    )
+    arg_parser.add_argument("--maxclients", type=int, default=config.maxclients)
+    arg_parser.add_argument(
+        "--timeout",
+        type=int,
+        default=config.timeout,
+        help="close connections idle for this many seconds, 0 disables it",
+    )
+    arg_parser.add_argument(
+        "--client-query-buffer-limit",
+        type=int,
+        default=config.client_query_buffer_limit,
+    )
+    arg_parser.add_argument(
+        "--client-output-buffer-limit",
+        nargs=3,
+        type=int,
+        default=config.client_output_buffer_limit,
+        metavar=("HARD", "SOFT", "SECONDS"),
+    )
+    arg_parser.add_argument(
+        "--network",
+        choices=["streams", "protocol"],
+        default=config.network,
+        help="serve connections with asyncio streams or a bare asyncio.Protocol",
+    )
+    arg_parser.add_argument(
+        "--io-threads",
+        type=int,
+        default=config.io_threads,
+        help="accepted for compatibility and ignored, requests are parsed and "
+        "replies encoded on the event loop thread",
+    )
+    arg_parser.add_argument(
+        "--uvloop",
+        action="store_true",
+        help="run on uvloop, falls back to the asyncio loop when not installed",
+    )
+    arg_parser.add_argument(
+        "--access-tracking",
+        action="store_true",
+        help="estimate key access frequencies for OBJECT FREQ and HOTKEYS",
+    )
+    arg_parser.add_argument(
+        "--tiered-storage-dir",
+        help="move large, rarely read strings to memory-mapped files in this directory",
+    )
+    arg_parser.add_argument(
+        "--profile-dir",
+        help="directory DEBUG PROFILE writes profiles to, the working one if unset",
+    )
+    return arg_parser.parse_args(argv)
+
+
+async def start_listeners() -> list[asyncio.Server]:
+    """Listen on the TCP addresses and the Unix socket from the config"""
+    protocol = config.network == "protocol"
+    servers = []
+    if config.port:
+        if protocol:
+            server = await serve_protocol(
+                storage, config.bind, config.port, config.tcp_backlog
+            )
+        else:
+            server = await asyncio.start_server(
+                handle_client, config.bind, config.port, backlog=config.tcp_backlog
+            )
+        servers.append(server)
+    if config.unixsocket:
+        if protocol:
+            server = await serve_protocol_unix(
+                storage, config.unixsocket, config.tcp_backlog
+            )
+        else:
+            server = await asyncio.start_unix_server(
+                handle_client, config.unixsocket, backlog=config.tcp_backlog
+            )
+        if config.unixsocketperm is not None:
+            os.chmod(config.unixsocket, config.unixsocketperm)
+        servers.append(server)
+    if not servers:
+        raise SystemExit("Nothing to listen on, set --port or --unixsocket")
+    return servers
+
+
+def use_uvloop() -> bool:
+    """Switch the event loop policy to uvloop, if it is installed"""
+    try:
+        import uvloop  # type: ignore[import-not-found]
+    except ImportError:
+        print("uvloop is not installed, using the asyncio event loop")
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+async def main(args: argparse.Namespace):
+    config.port = args.port
+    config.bind = args.bind
+    config.tcp_backlog = args.tcp_backlog
+    config.tcp_nodelay = args.tcp_nodelay
+    config.tcp_keepalive = args.tcp_keepalive
+    config.unixsocket = args.unixsocket
+    config.unixsocketperm = args.unixsocketperm
+    config.network = args.network
+    config.uvloop = args.uvloop
+    config.io_threads = args.io_threads
+    config.functions_dir = args.functions_dir
+    config.cluster_enabled = args.cluster_enabled
+    config.databases = args.databases
+    config.notify_keyspace_events = args.notify_keyspace_events
+    config.tiered_storage_dir = args.tiered_storage_dir
+    config.profile_dir = args.profile_dir
+    config.access_tracking = args.access_tracking
+    config.maxclients = args.maxclients
+    config.timeout = args.timeout
+    config.client_query_buffer_limit = args.client_query_buffer_limit
+    config.client_output_buffer_limit = tuple(args.client_output_buffer_limit)
+    if args.replicaof:
+        config.replicaof = " ".join(args.replicaof)
+
     print("Logs from your program will appear here!")
 
-    server = await asyncio.start_server(handle_client, "localhost", 6379)
+    if config.cluster_enabled:
+        cluster.enable("127.0.0.1", config.port)
+
+    if config.functions_dir:
+        for name in functions.load_directory(config.functions_dir):
+            print(f"Loaded function library {name}")
+
+    if config.tiered_storage_dir:
+        storage.enable_tiering(config.tiered_storage_dir).start(storage)
+
+    if config.access_tracking:
+        storage.enable_access_tracking()
+
+    databases.start()
+    if config.io_threads:
+        print("--io-threads is ignored, requests are served on the event loop thread")
+
+    servers = await start_listeners()
+
+    if config.replicaof:
+        host, port = config.replicaof.split()
+        replication.replicaof(host, int(port), storage, Processor)
 
-    async with server:
-        await server.serve_forever()
+    await asyncio.gather(*(server.serve_forever() for server in servers))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    arguments = parse_args()
+    if arguments.uvloop:
+        use_uvloop()
+    asyncio.run(main(arguments))
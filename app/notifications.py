@@ -0,0 +1,70 @@
+"""Keyspace event notifications, see notify-keyspace-events.
+
+The enabled event classes are a bitmask in config.notify_keyspace_events,
+the mutation points in Storage test their class bit before calling
+notify_keyspace_event, so with notifications off a write pays a single
+integer test.
+"""
+
+from app.config import config
+
+NOTIFY_KEYSPACE = 1 << 0
+NOTIFY_KEYEVENT = 1 << 1
+NOTIFY_GENERIC = 1 << 2
+NOTIFY_STRING = 1 << 3
+NOTIFY_LIST = 1 << 4
+NOTIFY_SET = 1 << 5
+NOTIFY_HASH = 1 << 6
+NOTIFY_ZSET = 1 << 7
+NOTIFY_EXPIRED = 1 << 8
+NOTIFY_EVICTED = 1 << 9
+NOTIFY_STREAM = 1 << 10
+
+EVENT_FLAGS = {
+    "K": NOTIFY_KEYSPACE,
+    "E": NOTIFY_KEYEVENT,
+    "g": NOTIFY_GENERIC,
+    "$": NOTIFY_STRING,
+    "l": NOTIFY_LIST,
+    "s": NOTIFY_SET,
+    "h": NOTIFY_HASH,
+    "z": NOTIFY_ZSET,
+    "x": NOTIFY_EXPIRED,
+    "e": NOTIFY_EVICTED,
+    "t": NOTIFY_STREAM,
+}
+# Every event class, what the A alias stands for
+NOTIFY_ALL = sum(EVENT_FLAGS.values()) & ~(NOTIFY_KEYSPACE | NOTIFY_KEYEVENT)
+
+
+def parse_event_flags(text: str) -> int:
+    """The bitmask for a notify-keyspace-events string such as "KEA" or "Ex".
+
+    Like Redis, a string without K or E or without any event class enables
+    nothing and gives 0.
+    """
+    flags = 0
+    for char in text:
+        if char == "A":
+            flags |= NOTIFY_ALL
+        elif char in EVENT_FLAGS:
+            flags |= EVENT_FLAGS[char]
+        else:
+            raise ValueError(f"Invalid event class character '{char}'")
+    if not flags & (NOTIFY_KEYSPACE | NOTIFY_KEYEVENT) or not flags & NOTIFY_ALL:
+        return 0
+    return flags
+
+
+def notify_keyspace_event(event_class: int, event: str, key: str, db: int) -> None:
+    """Publish an event on the keyspace and keyevent channels that are enabled"""
+    flags = config.notify_keyspace_events
+    if not flags & event_class:
+        return
+    # Storage imports this module and pubsub, through the formatter, Storage
+    from app.pubsub import pubsub
+
+    if flags & NOTIFY_KEYSPACE:
+        pubsub.publish(f"__keyspace@{db}__:{key}", event)
+    if flags & NOTIFY_KEYEVENT:
+        pubsub.publish(f"__keyevent@{db}__:{event}", key)
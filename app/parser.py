@@ -1,4 +1,5 @@
 from enum import Enum
+from typing import Any, Optional
 
 
 class Command(Enum):
@@ -16,6 +17,71 @@ class Command(Enum):
     XADD = 12
     XRANGE = 13
     XREAD = 14
+    FUNCTION = 15
+    FCALL = 16
+    FCALL_RO = 17
+    SUBSCRIBE = 18
+    UNSUBSCRIBE = 19
+    PSUBSCRIBE = 20
+    PUNSUBSCRIBE = 21
+    PUBLISH = 22
+    PUBSUB = 23
+    REPLCONF = 24
+    PSYNC = 25
+    INFO = 26
+    REPLICAOF = 27
+    CLUSTER = 28
+    ASKING = 29
+    MIGRATE = 30
+    SCAN = 31
+    DEL = 32
+    UNLINK = 33
+    FLUSHALL = 34
+    FLUSHDB = 35
+    MGET = 36
+    MSET = 37
+    MSETNX = 38
+    INCR = 39
+    DECR = 40
+    INCRBY = 41
+    DECRBY = 42
+    INCRBYFLOAT = 43
+    APPEND = 44
+    GETRANGE = 45
+    SETRANGE = 46
+    STRLEN = 47
+    HELLO = 48
+    CLIENT = 49
+    XGROUP = 50
+    XREADGROUP = 51
+    XACK = 52
+    XPENDING = 53
+    XCLAIM = 54
+    XAUTOCLAIM = 55
+    XTRIM = 56
+    XDEL = 57
+    XLEN = 58
+    XINFO = 59
+    SELECT = 60
+    SWAPDB = 61
+    DBSIZE = 62
+    DEBUG = 63
+    OBJECT = 64
+    HOTKEYS = 65
+    PFADD = 66
+    PFCOUNT = 67
+    PFMERGE = 68
+    SETBIT = 69
+    GETBIT = 70
+    BITCOUNT = 71
+    BITPOS = 72
+    BITOP = 73
+    BITFIELD = 74
+    XSETID = 75
+
+
+class ReplyError(Exception):
+    """An error reply, kept as a value when decoding RESP replies"""
 
 
 class Parser:
@@ -34,61 +100,214 @@ class Parser:
         "XADD": Command.XADD,
         "XRANGE": Command.XRANGE,
         "XREAD": Command.XREAD,
+        "FUNCTION": Command.FUNCTION,
+        "FCALL": Command.FCALL,
+        "FCALL_RO": Command.FCALL_RO,
+        "SUBSCRIBE": Command.SUBSCRIBE,
+        "UNSUBSCRIBE": Command.UNSUBSCRIBE,
+        "PSUBSCRIBE": Command.PSUBSCRIBE,
+        "PUNSUBSCRIBE": Command.PUNSUBSCRIBE,
+        "PUBLISH": Command.PUBLISH,
+        "PUBSUB": Command.PUBSUB,
+        "REPLCONF": Command.REPLCONF,
+        "PSYNC": Command.PSYNC,
+        "INFO": Command.INFO,
+        "REPLICAOF": Command.REPLICAOF,
+        "CLUSTER": Command.CLUSTER,
+        "ASKING": Command.ASKING,
+        "MIGRATE": Command.MIGRATE,
+        "SCAN": Command.SCAN,
+        "DEL": Command.DEL,
+        "UNLINK": Command.UNLINK,
+        "FLUSHALL": Command.FLUSHALL,
+        "FLUSHDB": Command.FLUSHDB,
+        "MGET": Command.MGET,
+        "MSET": Command.MSET,
+        "MSETNX": Command.MSETNX,
+        "INCR": Command.INCR,
+        "DECR": Command.DECR,
+        "INCRBY": Command.INCRBY,
+        "DECRBY": Command.DECRBY,
+        "INCRBYFLOAT": Command.INCRBYFLOAT,
+        "APPEND": Command.APPEND,
+        "GETRANGE": Command.GETRANGE,
+        "SETRANGE": Command.SETRANGE,
+        "STRLEN": Command.STRLEN,
+        "HELLO": Command.HELLO,
+        "CLIENT": Command.CLIENT,
+        "XGROUP": Command.XGROUP,
+        "XREADGROUP": Command.XREADGROUP,
+        "XACK": Command.XACK,
+        "XPENDING": Command.XPENDING,
+        "XCLAIM": Command.XCLAIM,
+        "XAUTOCLAIM": Command.XAUTOCLAIM,
+        "XTRIM": Command.XTRIM,
+        "XDEL": Command.XDEL,
+        "XLEN": Command.XLEN,
+        "XINFO": Command.XINFO,
+        "SELECT": Command.SELECT,
+        "SWAPDB": Command.SWAPDB,
+        "DBSIZE": Command.DBSIZE,
+        "DEBUG": Command.DEBUG,
+        "OBJECT": Command.OBJECT,
+        "HOTKEYS": Command.HOTKEYS,
+        "PFADD": Command.PFADD,
+        "PFCOUNT": Command.PFCOUNT,
+        "PFMERGE": Command.PFMERGE,
+        "SETBIT": Command.SETBIT,
+        "GETBIT": Command.GETBIT,
+        "BITCOUNT": Command.BITCOUNT,
+        "BITPOS": Command.BITPOS,
+        "BITOP": Command.BITOP,
+        "BITFIELD": Command.BITFIELD,
+        "XSETID": Command.XSETID,
     }
 
     def parse_command(self, payload: bytes) -> tuple[Command, *tuple[str, ...]]:
         """Parse command from payload"""
-        decoded = payload.decode()
+        commands, _ = self.parse_commands(payload)
+        if not commands:
+            raise Exception(f"Cannot extract command from: {payload!r}")
+        return commands[0]
+
+    def parse_commands(
+        self, buffer: bytes | bytearray
+    ) -> tuple[list[tuple[Command, *tuple[str, ...]]], int]:
+        """Parse every complete command in the buffer.
 
-        command_name = self._extract_command_name(decoded)
-        command_enum = self.COMMAND_MAP.get(command_name)
+        Returns the commands together with the number of bytes consumed, a
+        trailing partial command is left for the next read. A connection's
+        bytearray is parsed in place, without a copy per read.
+        """
+        commands = []
+        pos = 0
+        while pos < len(buffer):
+            parsed = self._parse_request(buffer, pos)
+            if parsed is None:
+                break
+            args, pos = parsed
+            if args:
+                commands.append(self._to_command(args))
+        return commands, pos
+
+    def _to_command(self, args: list[str]) -> tuple[Command, *tuple[str, ...]]:
+        command_enum = self.COMMAND_MAP.get(args[0].upper())
 
         if command_enum is None:
-            raise RuntimeError(
-                f"Unknown command {decoded}".encode("unicode_escape").decode("utf-8")
-            )
+            raise RuntimeError(f"Unknown command {args[0]}")
 
         if command_enum == Command.PING:
             return (command_enum,)
 
-        args = self._parse(decoded)
-        return command_enum, *args
+        return command_enum, *args[1:]
 
-    def _extract_command_name(self, message: str) -> str:
-        """Extract the command name from the Redis protocol message"""
-        elements = message.split("\r\n")
+    @staticmethod
+    def wanted_size(buffer: bytes | bytearray) -> int:
+        """Size the buffer needs before the request at its start can be complete.
 
-        if elements[0].startswith("+"):
-            return elements[0][1:].upper()
+        Only the headers are read, so a connection waiting on a large bulk
+        string can skip parsing until it has arrived. 0 when the headers
+        read so far do not tell.
+        """
+        end = buffer.find(b"\r\n")
+        if end == -1 or buffer[0] != ord("*"):
+            return 0
+        pos = end + 2
+        for _ in range(int(buffer[1:end])):
+            end = buffer.find(b"\r\n", pos)
+            if end == -1:
+                return 0
+            pos = end + 2 + int(buffer[pos + 1 : end]) + 2
+            if pos > len(buffer):
+                return pos
+        return 0
 
-        if not elements or not elements[0].startswith("*"):
-            raise Exception(f"Invalid message format: {message}")
+    @staticmethod
+    def _parse_request(
+        buffer: bytes | bytearray, pos: int
+    ) -> Optional[tuple[list[str], int]]:
+        """Parse one request starting at pos, None when it is not complete yet"""
+        end = buffer.find(b"\r\n", pos)
+        if end == -1:
+            return None
 
-        # Skip array size and first bulk string size
-        # The command name is at index 2
-        if len(elements) > 2:
-            return elements[2].upper()
+        if buffer[pos] != ord("*"):
+            # Inline command, e.g. "PING\r\n" or "+PING\r\n"
+            line = buffer[pos:end].decode("utf-8", "surrogateescape")
+            return line.lstrip("+").split(), end + 2
 
-        raise Exception(f"Cannot extract command from: {message}")
+        size = int(buffer[pos + 1 : end])
+        pos = end + 2
+        args = []
+        for _ in range(size):
+            end = buffer.find(b"\r\n", pos)
+            if end == -1:
+                return None
+            if buffer[pos] != ord("$"):
+                raise RuntimeError(f"Protocol error, expected '$': {buffer!r}")
+            length = int(buffer[pos + 1 : end])
+            start = end + 2
+            if start + length + 2 > len(buffer):
+                return None
+            if buffer[start + length : start + length + 2] != b"\r\n":
+                raise RuntimeError(f"Protocol error, invalid bulk length: {buffer!r}")
+            # Binary arguments, e.g. a replicated bitmap, survive the round trip
+            # through str as surrogate escapes
+            args.append(
+                buffer[start : start + length].decode("utf-8", "surrogateescape")
+            )
+            pos = start + length + 2
+        return args, pos
 
-    @staticmethod
-    def _parse(message: str) -> list[str]:
-        """Parse Redis protocol message into arguments"""
-        expression = []
-        elements = message.split("\r\n")
-
-        if not elements:
-            raise Exception(f"Empty message: {message}")
-
-        if elements[0].startswith("*"):
-            size = int(elements[0][1:])
-            elements.pop(0)
-            for i in range(size):
-                elements.pop(0)  # Skip size markers
-                expression.append(elements.pop(0))
-
-        # Drop the command name itself
-        return expression[1:]
+    def parse_reply(self, payload: bytes) -> Any:
+        """Decode a single RESP reply, error replies are returned as ReplyError"""
+        value, _ = self._parse_reply(payload, 0)
+        return value
+
+    def parse_replies(self, buffer: bytes) -> tuple[list[Any], int]:
+        """Decode every complete reply in the buffer, with the bytes consumed"""
+        replies = []
+        pos = 0
+        while pos < len(buffer):
+            try:
+                reply, end = self._parse_reply(buffer, pos)
+            except (ValueError, IndexError):
+                break
+            if end > len(buffer):
+                break
+            replies.append(reply)
+            pos = end
+        return replies, pos
+
+    def _parse_reply(self, payload: bytes, pos: int) -> tuple[Any, int]:
+        end = payload.index(b"\r\n", pos)
+        marker, line = payload[pos : pos + 1], payload[pos + 1 : end]
+        pos = end + 2
+        match marker:
+            case b"+":
+                return line.decode(), pos
+            case b"-":
+                return ReplyError(line.decode()), pos
+            case b":":
+                return int(line), pos
+            case b"$":
+                size = int(line)
+                if size < 0:
+                    return None, pos
+                return (
+                    payload[pos : pos + size].decode("utf-8", "surrogateescape"),
+                    pos + size + 2,
+                )
+            case b"*":
+                size = int(line)
+                if size < 0:
+                    return None, pos
+                items = []
+                for _ in range(size):
+                    item, pos = self._parse_reply(payload, pos)
+                    items.append(item)
+                return items, pos
+        raise Exception(f"Invalid reply: {payload!r}")
 
 
 parser = Parser()
@@ -0,0 +1,42 @@
+import re
+
+GLOB_SPECIAL = "*?[\\"
+
+
+def compile_glob(pattern: str) -> re.Pattern:
+    """Compile a Redis glob pattern (*, ?, [abc], [^a-z], \\x) into a regex"""
+    regex = []
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        idx += 1
+        if char == "*":
+            regex.append(".*")
+        elif char == "?":
+            regex.append(".")
+        elif char == "\\" and idx < len(pattern):
+            regex.append(re.escape(pattern[idx]))
+            idx += 1
+        elif char == "[":
+            end = pattern.find("]", idx + 1)
+            if end == -1:
+                regex.append(re.escape(char))
+                continue
+            body = pattern[idx:end]
+            idx = end + 1
+            negate = body.startswith("^")
+            if negate:
+                body = body[1:]
+            body = body.replace("\\", "\\\\")
+            regex.append(f"[{'^' if negate else ''}{body}]")
+        else:
+            regex.append(re.escape(char))
+    return re.compile("".join(regex), re.DOTALL)
+
+
+def literal_prefix(pattern: str) -> str:
+    """The part of a glob pattern before its first wildcard"""
+    for idx, char in enumerate(pattern):
+        if char in GLOB_SPECIAL:
+            return pattern[:idx]
+    return pattern
@@ -1,11 +1,55 @@
 import asyncio
 import datetime  # use this way to keep tests working
+import itertools
+import time
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
 from enum import Enum
-from typing import Any, Callable
+from typing import Any, Callable, Optional
 
+from app.bitmaps import MAX_BIT_OFFSET, BitfieldOperation, parse_bitfield_type
+from app.clients import clients, output_buffer_size
+from app.cluster import (
+    CLUSTER_SLOTS,
+    cluster,
+    command_keys,
+    key_hash_slot,
+    valid_num_keys,
+)
+from app.config import config
 from app.formatter import formatter
-from app.parser import Command
-from app.storage import Storage, Value
+from app.lazyfree import lazyfree
+from app.functions import FunctionError, functions
+from app.hotkeys import TOP_KEYS
+from app.parser import Command, ReplyError, parser
+from app.patterns import compile_glob
+from app.profiler import DEFAULT_SAMPLING_HZ, profiler
+from app.pubsub import pubsub
+from app.replication import replication
+from app.storage import (
+    Databases,
+    Storage,
+    Value,
+    ValueType,
+    WrongTypeError,
+    encode_string,
+    object_encoding,
+)
+from app.streams import (
+    MAX_STREAM_ID,
+    NoGroupError,
+    StreamId,
+    entry_fields,
+    format_stream_id,
+    now_ms,
+    parse_stream_id,
+)
+from app.tiering import ColdValue
+from app.tracking import tracking
+
+
+# Connection ids, as reported by HELLO and CLIENT ID
+CLIENT_IDS = itertools.count(1)
 
 
 class Push(Enum):
@@ -13,6 +57,132 @@ class Push(Enum):
     LEFT = 2
 
 
+# Commands that modify the keyspace
+WRITE_COMMANDS = {
+    Command.SET,
+    Command.RPUSH,
+    Command.LPUSH,
+    Command.LPOP,
+    Command.BLPOP,
+    Command.XADD,
+    Command.DEL,
+    Command.UNLINK,
+    Command.FLUSHALL,
+    Command.FLUSHDB,
+    Command.MSET,
+    Command.MSETNX,
+    Command.INCR,
+    Command.DECR,
+    Command.INCRBY,
+    Command.DECRBY,
+    Command.INCRBYFLOAT,
+    Command.APPEND,
+    Command.SETRANGE,
+    Command.XGROUP,
+    Command.XREADGROUP,
+    Command.XACK,
+    Command.XCLAIM,
+    Command.XAUTOCLAIM,
+    Command.XTRIM,
+    Command.XDEL,
+    Command.XSETID,
+    Command.SWAPDB,
+    Command.PFADD,
+    Command.PFMERGE,
+    Command.SETBIT,
+    Command.BITOP,
+    Command.BITFIELD,
+}
+
+# Options ending the id list of XCLAIM
+XCLAIM_OPTIONS = {"IDLE", "TIME", "RETRYCOUNT", "FORCE", "JUSTID", "LASTID"}
+
+# Commands that may wait for other clients, the protocol layer runs them in
+# a task from the start: asyncio timeouts refuse to run outside of one
+BLOCKING_COMMANDS = {Command.BLPOP, Command.XREADGROUP}
+
+# Commands a function is not allowed to run through redis.call
+FUNCTION_DENIED_COMMANDS = {
+    Command.BLPOP,
+    Command.FUNCTION,
+    Command.FCALL,
+    Command.FCALL_RO,
+    Command.SUBSCRIBE,
+    Command.UNSUBSCRIBE,
+    Command.PSUBSCRIBE,
+    Command.PUNSUBSCRIBE,
+}
+
+# The only commands a client may send once it has subscriptions
+SUBSCRIBED_MODE_COMMANDS = {
+    Command.SUBSCRIBE,
+    Command.UNSUBSCRIBE,
+    Command.PSUBSCRIBE,
+    Command.PUNSUBSCRIBE,
+    Command.PING,
+}
+
+
+class ReplyBuffer:
+    """Writer collecting replies in memory instead of sending them"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+
+    async def drain(self):
+        pass
+
+
+# XADD options that keep a command out of a bulk append
+XADD_OPTIONS = {"NOMKSTREAM", "MAXLEN", "MINID"}
+
+# OBJECT FREQ / IDLETIME and HOTKEYS need the server started with tracking
+ACCESS_TRACKING_DISABLED = (
+    "access tracking is disabled, start the server with --access-tracking"
+)
+
+
+@dataclass
+class XaddBatch:
+    """Pipelined XADDs to one stream, appended in one go"""
+
+    key: str
+    commands: list[tuple[Any, ...]]
+
+
+def _plain_xadd_key(command: tuple) -> Optional[str]:
+    # (Command.XADD, key, id, field, value, ...) without options
+    if command[0] is not Command.XADD or len(command) < 5 or len(command) % 2 == 0:
+        return None
+    if command[2].upper() in XADD_OPTIONS:
+        return None
+    return command[1]
+
+
+def coalesce_xadds(commands: list) -> list:
+    """Fold runs of plain XADDs to the same key into a single XaddBatch"""
+    result: list = []
+    run_key = None
+    for command in commands:
+        key = _plain_xadd_key(command)
+        if key is not None and key == run_key:
+            if isinstance(result[-1], XaddBatch):
+                result[-1].commands.append(command)
+            else:
+                result[-1] = XaddBatch(key, [result[-1], command])
+        else:
+            result.append(command)
+        run_key = key
+    return result
+
+
+def command_name(command: Any) -> str:
+    return "XADD" if isinstance(command, XaddBatch) else command[0].name
+
+
 class CommandHandlerRegistry:
     """Registry for command handlers"""
 
@@ -40,8 +210,21 @@ class CommandHandlerRegistry:
 class Processor:
     def __init__(self, writer: Any, storage: Storage):
         self.writer = writer
+        # The selected database, SELECT switches to another of self.databases
         self.storage = storage
+        self.databases = storage.databases or Databases(storage)
         self.registry = CommandHandlerRegistry()
+        # Set on the replica for the connection applying the master's stream
+        self.is_master_link = False
+        # Set by ASKING, lets the next command use a slot being imported
+        self.asking = False
+        # The command sent to replicas once the current handler finishes,
+        # handlers rewrite it for non-deterministic commands or drop it
+        self.replicated: Optional[tuple[Command, list[Any]]] = None
+        self.id = next(CLIENT_IDS)
+        self.name = ""
+        # RESP version negotiated with HELLO
+        self.protocol = 2
         self._register_handlers()
 
     def _register_handlers(self):
@@ -54,32 +237,277 @@ class Processor:
 
         @self.registry.register(Command.SET)
         async def handle_set(args: list[str]) -> None:
-            # Command example: (Command.SET, "foo", "bar", "PX", 100)
-            # TODO Add check that only optional either EX or PX are possible
-            record_key = args[0]
-            record_value = args[1]
-            if len(args) > 2:
-                expiration = (
-                    datetime.datetime.now() + datetime.timedelta(seconds=int(args[3]))
-                    if args[2].upper() == "EX"
-                    else datetime.datetime.now()
-                    + datetime.timedelta(milliseconds=int(args[3]))
+            # Command example: (Command.SET, "foo", "bar", "NX", "PX", 100)
+            options = self._set_options(args[2:])
+            if options is None:
+                return
+            expiration, condition, keep_ttl, get = options
+            try:
+                stored, previous = await self.storage.set(
+                    args[0],
+                    Value(encode_string(args[1]), expiration),
+                    only_new=condition == "NX",
+                    only_existing=condition == "XX",
+                    keep_ttl=keep_ttl,
+                    get=get,
                 )
+            except WrongTypeError as err:
+                self._string_error(err)
+                return
+
+            if not stored:
+                self.replicated = None
+            elif expiration is not None:
+                # Relative expirations are sent as an absolute time, so a
+                # replica applying the stream late expires the key together
+                # with the master
+                at = int(expiration.timestamp() * 1000)
+                self.replicated = (Command.SET, [args[0], args[1], "PXAT", at])
+            elif get:
+                self.replicated = (Command.SET, args[:2] + ["KEEPTTL"] * keep_ttl)
+
+            if get:
+                # The old item may be int-encoded, a bytearray, cold or an HLL
+                old = None if previous is None else Value(previous)
+                self.writer.write(formatter.format_get_response(old))
+            elif stored:
+                self.writer.write(formatter.format_ok_expression())
             else:
-                expiration = None
-            await self.storage.set(record_key, Value(record_value, expiration))
-            self.writer.write(formatter.format_ok_expression())
+                self.writer.write(formatter.format_value(None))
 
         @self.registry.register(Command.GET)
         async def handle_get(args: list[str]) -> None:
             # Command example: (Command.GET, "foo")
             value = self.storage.get(args[0])
+            if value is not None and isinstance(value.item, ColdValue):
+                # Written straight from the mapping, no copy into a reply
+                view = value.item.view()
+                self.writer.write(b"$%d\r\n" % len(view))
+                self.writer.write(view)
+                self.writer.write(b"\r\n")
+                return
             self.writer.write(formatter.format_get_response(value))
 
+        @self.registry.register(Command.MGET)
+        async def handle_mget(args: list[str]) -> None:
+            # Command example: (Command.MGET, "foo", "bar")
+            self.writer.write(formatter.format_mget_response(self.storage.mget(args)))
+
+        @self.registry.register(Command.MSET)
+        async def handle_mset(args: list[str]) -> None:
+            # Command example: (Command.MSET, "foo", "1", "bar", "2")
+            items = self._key_value_pairs("mset", args)
+            if items is None:
+                return
+            await self.storage.mset(items)
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.MSETNX)
+        async def handle_msetnx(args: list[str]) -> None:
+            # Command example: (Command.MSETNX, "foo", "1", "bar", "2")
+            items = self._key_value_pairs("msetnx", args)
+            if items is None:
+                return
+            stored = await self.storage.mset(items, only_new=True)
+            if not stored:
+                self.replicated = None
+            self.writer.write(formatter.format_value(int(stored)))
+
+        @self.registry.register(Command.INCR)
+        async def handle_incr(args: list[str]) -> None:
+            # Command example: (Command.INCR, "counter")
+            self._string_command(self.storage.incr_by, args[0], 1)
+
+        @self.registry.register(Command.DECR)
+        async def handle_decr(args: list[str]) -> None:
+            # Command example: (Command.DECR, "counter")
+            self._string_command(self.storage.incr_by, args[0], -1)
+
+        @self.registry.register(Command.INCRBY)
+        async def handle_incrby(args: list[str]) -> None:
+            # Command example: (Command.INCRBY, "counter", "5")
+            try:
+                increment = self._parse_integer(args[1])
+            except ValueError as err:
+                self._string_error(err)
+                return
+            self._string_command(self.storage.incr_by, args[0], increment)
+
+        @self.registry.register(Command.DECRBY)
+        async def handle_decrby(args: list[str]) -> None:
+            # Command example: (Command.DECRBY, "counter", "5")
+            try:
+                decrement = self._parse_integer(args[1])
+            except ValueError as err:
+                self._string_error(err)
+                return
+            self._string_command(self.storage.incr_by, args[0], -decrement)
+
+        @self.registry.register(Command.INCRBYFLOAT)
+        async def handle_incrbyfloat(args: list[str]) -> None:
+            # Command example: (Command.INCRBYFLOAT, "price", "0.5")
+            try:
+                increment = Decimal(args[1])
+            except InvalidOperation:
+                increment = None
+            if increment is None or increment.is_nan():
+                self._string_error(ValueError("value is not a valid float"))
+                return
+            result = self._string_command(
+                self.storage.incr_by_float, args[0], increment, reply=False
+            )
+            if result is not None:
+                # Replies are bulk strings, unlike the integer replies of INCRBY
+                self.writer.write(formatter.format_value(result))
+                # Replicas store the result, they would not round the same way
+                self.replicated = (Command.SET, [args[0], result, "KEEPTTL"])
+
+        @self.registry.register(Command.APPEND)
+        async def handle_append(args: list[str]) -> None:
+            # Command example: (Command.APPEND, "log", "line")
+            self._string_command(self.storage.append, args[0], args[1])
+
+        @self.registry.register(Command.GETRANGE)
+        async def handle_getrange(args: list[str]) -> None:
+            # Command example: (Command.GETRANGE, "foo", "0", "-1")
+            try:
+                start, end = self._parse_integer(args[1]), self._parse_integer(args[2])
+            except ValueError as err:
+                self._string_error(err)
+                return
+            result = self._string_command(
+                self.storage.get_range, args[0], start, end, reply=False
+            )
+            if result is not None:
+                self.writer.write(formatter.format_value(result))
+
+        @self.registry.register(Command.SETRANGE)
+        async def handle_setrange(args: list[str]) -> None:
+            # Command example: (Command.SETRANGE, "foo", "6", "redis")
+            try:
+                offset = self._parse_integer(args[1])
+            except ValueError as err:
+                self._string_error(err)
+                return
+            self._string_command(self.storage.set_range, args[0], offset, args[2])
+
+        @self.registry.register(Command.STRLEN)
+        async def handle_strlen(args: list[str]) -> None:
+            # Command example: (Command.STRLEN, "foo")
+            self._string_command(self.storage.strlen, args[0])
+
+        @self.registry.register(Command.PFADD)
+        async def handle_pfadd(args: list[str]) -> None:
+            # Command example: (Command.PFADD, "visitors", "alice", "bob")
+            self._string_command(self.storage.pfadd, args[0], args[1:])
+
+        @self.registry.register(Command.PFCOUNT)
+        async def handle_pfcount(args: list[str]) -> None:
+            # Command example: (Command.PFCOUNT, "visitors", "other-visitors")
+            self._string_command(self.storage.pfcount, args)
+
+        @self.registry.register(Command.PFMERGE)
+        async def handle_pfmerge(args: list[str]) -> None:
+            # Command example: (Command.PFMERGE, "all", "visitors", "other-visitors")
+            try:
+                self.storage.pfmerge(args[0], args[1:])
+            except WrongTypeError as err:
+                self._string_error(err)
+                return
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.SETBIT)
+        async def handle_setbit(args: list[str]) -> None:
+            # Command example: (Command.SETBIT, "flags", "7", "1")
+            try:
+                offset = self._parse_bit_offset(args[1])
+                if args[2] not in ("0", "1"):
+                    raise ValueError("bit is not an integer or out of range")
+            except ValueError as err:
+                self._string_error(err)
+                return
+            self._string_command(self.storage.setbit, args[0], offset, int(args[2]))
+
+        @self.registry.register(Command.GETBIT)
+        async def handle_getbit(args: list[str]) -> None:
+            # Command example: (Command.GETBIT, "flags", "7")
+            try:
+                offset = self._parse_bit_offset(args[1])
+            except ValueError as err:
+                self._string_error(err)
+                return
+            self._string_command(self.storage.getbit, args[0], offset)
+
+        @self.registry.register(Command.BITCOUNT)
+        async def handle_bitcount(args: list[str]) -> None:
+            # Command example: (Command.BITCOUNT, "flags", "0", "-1", "BIT")
+            try:
+                if len(args) not in (1, 3, 4):
+                    raise ValueError("syntax error")
+                start = end = None
+                if len(args) > 1:
+                    start, end = (
+                        self._parse_integer(args[1]),
+                        self._parse_integer(args[2]),
+                    )
+                bit_unit = self._bit_unit(args[3:])
+            except ValueError as err:
+                self._string_error(err)
+                return
+            self._string_command(self.storage.bitcount, args[0], start, end, bit_unit)
+
+        @self.registry.register(Command.BITPOS)
+        async def handle_bitpos(args: list[str]) -> None:
+            # Command example: (Command.BITPOS, "flags", "0", "2", "-1", "BYTE")
+            try:
+                if not 2 <= len(args) <= 5:
+                    raise ValueError("syntax error")
+                if args[1] not in ("0", "1"):
+                    raise ValueError("The bit argument must be 1 or 0.")
+                start = self._parse_integer(args[2]) if len(args) > 2 else 0
+                end = self._parse_integer(args[3]) if len(args) > 3 else None
+                bit_unit = self._bit_unit(args[4:])
+            except ValueError as err:
+                self._string_error(err)
+                return
+            self._string_command(
+                self.storage.bitpos, args[0], int(args[1]), start, end, bit_unit
+            )
+
+        @self.registry.register(Command.BITOP)
+        async def handle_bitop(args: list[str]) -> None:
+            # Command example: (Command.BITOP, "AND", "both", "flags", "other-flags")
+            operation = args[0].upper()
+            if operation not in ("AND", "OR", "XOR", "NOT") or len(args) < 3:
+                self._string_error(ValueError("syntax error"))
+                return
+            if operation == "NOT" and len(args) != 3:
+                self._string_error(
+                    ValueError("BITOP NOT must be called with a single source key.")
+                )
+                return
+            self._string_command(self.storage.bitop, operation, args[1], args[2:])
+
+        @self.registry.register(Command.BITFIELD)
+        async def handle_bitfield(args: list[str]) -> None:
+            # Command example: (Command.BITFIELD, "counters", "INCRBY", "u8", "#1", "1")
+            try:
+                operations = self._bitfield_operations(args[1:])
+            except ValueError as err:
+                self._string_error(err)
+                return
+            if all(operation.name == "GET" for operation in operations):
+                # Nothing is written, there is nothing to send to replicas
+                self.replicated = None
+            self._string_command(self.storage.bitfield, args[0], operations)
+
         @self.registry.register(Command.PING)
         async def handle_ping(_: list[str]) -> None:
             # Command example: (Command.PING,)
-            self.writer.write(b"+PONG\r\n")
+            if pubsub.is_subscribed(self.writer):
+                self.writer.write(formatter.format_value(["pong", ""]))
+            else:
+                self.writer.write(b"+PONG\r\n")
 
         @self.registry.register(Command.RPUSH)
         async def handle_rpush(args: list[str]) -> None:
@@ -126,10 +554,13 @@ class Processor:
                 if not all_values or not isinstance(all_values, list):
                     self.writer.write(formatter.format_get_response(None))
                 else:
-                    key_and_value = [Value(record_key), all_values.pop(0)]
+                    key_and_value = [Value(record_key), *self.storage.lpop(record_key)]
                     self.writer.write(formatter.format_lrange_response(key_and_value))
+                    self.replicated = (Command.LPOP, [record_key])
+                    return
             except asyncio.TimeoutError:
                 self.writer.write(formatter.format_null_array_response())
+            self.replicated = None
 
         @self.registry.register(Command.LPOP)
         async def handle_lpop(args: list[str]) -> None:
@@ -138,15 +569,13 @@ class Processor:
             all_values = self.storage.get(record_key)
             if not all_values or not isinstance(all_values, list):
                 self.writer.write(formatter.format_get_response(None))
-            elif len(args) == 2:
-                queried = []
-                for _ in range(int(args[1])):
-                    if not all_values:
-                        break
-                    queried.append(all_values.pop(0))
+                return
+            if len(args) == 2:
+                queried = self.storage.lpop(record_key, int(args[1]))
                 self.writer.write(formatter.format_lrange_response(queried))
             else:
-                self.writer.write(formatter.format_get_response(all_values.pop(0)))
+                (value,) = self.storage.lpop(record_key)
+                self.writer.write(formatter.format_get_response(value))
 
         @self.registry.register(Command.TYPE)
         async def handle_type(args: list[str]) -> None:
@@ -157,20 +586,171 @@ class Processor:
 
         @self.registry.register(Command.XADD)
         async def handle_xadd(args: list[str]) -> None:
-            # Command example: (Command.XADD,  "key1", "0-1", "foo", "bar", "baz", "qux")
+            # Command example: (Command.XADD,  "key1", "MAXLEN", "~", "1000", "0-1", "foo", "bar")
             record_key = args[0]
-            stream_key = args[1]
+            nomkstream, trim = False, None
+            idx = 1
+            try:
+                while idx < len(args):
+                    option = args[idx].upper()
+                    if option == "NOMKSTREAM":
+                        nomkstream = True
+                        idx += 1
+                    elif option in ("MAXLEN", "MINID"):
+                        trim, used = self._trim_options(args[idx:])
+                        idx += used
+                    else:
+                        break
+            except IndexError:
+                self._string_error(ValueError("syntax error"))
+                return
+            except ValueError as err:
+                self._string_error(err)
+                return
+            if len(args) - idx < 3 or (len(args) - idx) % 2 == 0:
+                self._string_error(
+                    ValueError("wrong number of arguments for 'xadd' command")
+                )
+                return
+
+            stream_key = args[idx]
             obj = dict(id=stream_key)
-            idx = 2
+            idx += 1
+            fields = args[idx:]
             while idx < len(args):
                 obj[args[idx]] = args[idx + 1]
                 idx += 2
 
             try:
-                stream_id = self.storage.set_stream(record_key, Value(obj))
-                self.writer.write(formatter.format_string_expression(stream_id))
-            except ValueError as err:
-                self.writer.write(formatter.format_simple_error(err))
+                stream_id = self.storage.set_stream(
+                    record_key, Value(obj), nomkstream, trim
+                )
+            except (ValueError, WrongTypeError) as err:
+                self._string_error(err)
+                return
+            if stream_id is None:
+                self.writer.write(formatter.format_get_response(None))
+                self.replicated = None
+                return
+            self.writer.write(formatter.format_string_expression(stream_id))
+            # Replicas must store the generated id, not "*"
+            self.replicated = (
+                Command.XADD,
+                [
+                    record_key,
+                    *args[1 : len(args) - len(fields) - 1],
+                    stream_id,
+                    *fields,
+                ],
+            )
+
+        @self.registry.register(Command.XTRIM)
+        async def handle_xtrim(args: list[str]) -> None:
+            # Command example: (Command.XTRIM, "telemetry", "MAXLEN", "~", "100000")
+            try:
+                options, used = self._trim_options(args[1:])
+                if used != len(args) - 1:
+                    raise ValueError("syntax error")
+                trimmed = self.storage.trim_stream(args[0], **options)
+            except IndexError:
+                self._string_error(ValueError("syntax error"))
+                return
+            except (ValueError, WrongTypeError) as err:
+                self._string_error(err)
+                return
+            self.writer.write(formatter.format_value(trimmed))
+            if not trimmed:
+                self.replicated = None
+
+        @self.registry.register(Command.XDEL)
+        async def handle_xdel(args: list[str]) -> None:
+            # Command example: (Command.XDEL, "telemetry", "1526569495631-0")
+            try:
+                ids = [parse_stream_id(arg) for arg in args[1:]]
+                deleted = self.storage.delete_stream_entries(args[0], ids)
+            except (ValueError, WrongTypeError) as err:
+                self._string_error(err)
+                return
+            self.writer.write(formatter.format_value(deleted))
+            if not deleted:
+                self.replicated = None
+
+        @self.registry.register(Command.XSETID)
+        async def handle_xsetid(args: list[str]) -> None:
+            # Command example: (Command.XSETID, "telemetry", "1526569498055-0", "ENTRIESADDED", "12")
+            entries_added, max_deleted_id = None, None
+            try:
+                if len(args) < 2:
+                    raise ValueError("wrong number of arguments for 'xsetid' command")
+                last_id = parse_stream_id(args[1])
+                idx = 2
+                while idx < len(args):
+                    option = args[idx].upper()
+                    if option == "ENTRIESADDED" and idx + 1 < len(args):
+                        entries_added = self._parse_integer(args[idx + 1])
+                        if entries_added < 0:
+                            raise ValueError("entries_added must be positive")
+                    elif option == "MAXDELETEDID" and idx + 1 < len(args):
+                        max_deleted_id = parse_stream_id(args[idx + 1])
+                    else:
+                        raise ValueError("syntax error")
+                    idx += 2
+                self.storage.set_stream_id(
+                    args[0], last_id, entries_added, max_deleted_id
+                )
+            except (ValueError, WrongTypeError) as err:
+                self._string_error(err)
+                return
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.XLEN)
+        async def handle_xlen(args: list[str]) -> None:
+            # Command example: (Command.XLEN, "telemetry")
+            try:
+                stream = self.storage.get_stream(args[0])
+            except WrongTypeError as err:
+                self._string_error(err)
+                return
+            self.writer.write(formatter.format_value(len(stream or ())))
+
+        @self.registry.register(Command.XINFO)
+        async def handle_xinfo(args: list[str]) -> None:
+            # Command example: (Command.XINFO, "STREAM", "telemetry")
+            subcommand = args[0].upper() if args else ""
+            if subcommand != "STREAM" or len(args) != 2:
+                self._string_error(
+                    ValueError(
+                        f"unknown subcommand or wrong number of arguments for "
+                        f"'{subcommand.lower()}'"
+                    )
+                )
+                return
+            try:
+                stream = self.storage.get_stream(args[1])
+            except WrongTypeError as err:
+                self._string_error(err)
+                return
+            if stream is None:
+                self._string_error(ValueError("no such key"))
+                return
+            # Length and both ends are kept up to date, nothing is walked
+            first, last = stream.first(), stream.last()
+            ends = (
+                self._stream_entries([first, last])
+                if first is not None and last is not None
+                else [None, None]
+            )
+            info = {
+                "length": len(stream),
+                "last-generated-id": format_stream_id(stream.last_id),
+                "max-deleted-entry-id": format_stream_id(stream.max_deleted_id),
+                "entries-added": stream.entries_added,
+                "recorded-first-entry-id": format_stream_id(stream.first_id),
+                "groups": len(stream.groups),
+                "first-entry": ends[0],
+                "last-entry": ends[1],
+            }
+            self.writer.write(formatter.format_map(info, self.protocol))
 
         @self.registry.register(Command.XRANGE)
         async def handle_xrange(args: list[str]) -> None:
@@ -217,8 +797,815 @@ class Processor:
 
             self.writer.write(formatter.format_xread_response(record_list))
 
-    async def process_command(self, command: tuple[Command, *tuple[str]]) -> None:
+        @self.registry.register(Command.XGROUP)
+        async def handle_xgroup(args: list[str]) -> None:
+            # Command example: (Command.XGROUP, "CREATE", "jobs", "workers", "$", "MKSTREAM")
+            subcommand = args[0].upper() if args else ""
+            try:
+                match subcommand:
+                    case "CREATE" if len(args) >= 4:
+                        mkstream = "MKSTREAM" in (arg.upper() for arg in args[4:])
+                        self.storage.create_group(args[1], args[2], args[3], mkstream)
+                        reply: Any = "OK"
+                    case "SETID" if len(args) >= 4:
+                        stream, group = self.storage.get_group(args[1], args[2])
+                        group.last_delivered = (
+                            stream.last_id
+                            if args[3] == "$"
+                            else parse_stream_id(args[3])
+                        )
+                        reply = "OK"
+                    case "DESTROY" if len(args) == 3:
+                        existing = self.storage.get_stream(args[1])
+                        reply = int(
+                            existing is not None
+                            and existing.groups.pop(args[2], None) is not None
+                        )
+                    case "CREATECONSUMER" if len(args) == 4:
+                        _, group = self.storage.get_group(args[1], args[2])
+                        reply = int(args[3] not in group.consumers)
+                        group.consumer(args[3], now_ms())
+                    case "DELCONSUMER" if len(args) == 4:
+                        _, group = self.storage.get_group(args[1], args[2])
+                        reply = group.delete_consumer(args[3])
+                    case _:
+                        raise ValueError(
+                            f"unknown subcommand or wrong number of arguments for "
+                            f"'{subcommand.lower()}'"
+                        )
+            except (ValueError, RuntimeError) as err:
+                self._string_error(err)
+                return
+            if reply == "OK":
+                self.writer.write(formatter.format_ok_expression())
+            else:
+                self.writer.write(formatter.format_value(reply))
+
+        @self.registry.register(Command.XREADGROUP)
+        async def handle_xreadgroup(args: list[str]) -> None:
+            # Command example: (Command.XREADGROUP, "GROUP", "workers", "alice", "COUNT", "10", "STREAMS", "jobs", ">")
+            options = [arg.upper() for arg in args]
+            count, timeout, blocking, noack = None, None, False, False
+            try:
+                if options[0] != "GROUP":
+                    raise ValueError("syntax error")
+                group_name, consumer_name = args[1], args[2]
+                idx = 3
+                while options[idx] != "STREAMS":
+                    if options[idx] == "COUNT":
+                        count = self._parse_integer(args[idx + 1])
+                        idx += 2
+                    elif options[idx] == "BLOCK":
+                        blocking = True
+                        milliseconds = self._parse_integer(args[idx + 1])
+                        timeout = milliseconds / 1000 if milliseconds else None
+                        idx += 2
+                    elif options[idx] == "NOACK":
+                        noack = True
+                        idx += 1
+                    else:
+                        raise ValueError("syntax error")
+                streams = args[idx + 1 :]
+                if not streams or len(streams) % 2:
+                    raise ValueError(
+                        "Unbalanced 'xreadgroup' list of streams: for each stream "
+                        "key an ID or '>' must be specified."
+                    )
+                keys, ids = streams[: len(streams) // 2], streams[len(streams) // 2 :]
+                starts = [None if id_ == ">" else parse_stream_id(id_) for id_ in ids]
+            except IndexError:
+                self._string_error(ValueError("syntax error"))
+                return
+            except ValueError as err:
+                self._string_error(err)
+                return
+
+            # Only a read of new entries for every stream waits for them
+            blocking = blocking and all(start is None for start in starts)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                try:
+                    reply = self._read_groups(
+                        group_name, consumer_name, keys, starts, count, noack
+                    )
+                except RuntimeError as err:
+                    self._string_error(err)
+                    return
+                if reply or not blocking:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                if not await self.storage.wait_for_stream(keys, remaining):
+                    break
+
+            if not reply:
+                self.writer.write(formatter.format_null_array_response())
+                self.replicated = None
+                return
+            self.writer.write(formatter.format_value(reply))
+
+        @self.registry.register(Command.XACK)
+        async def handle_xack(args: list[str]) -> None:
+            # Command example: (Command.XACK, "jobs", "workers", "1526569495631-0")
+            try:
+                ids = [parse_stream_id(arg) for arg in args[2:]]
+                _, group = self.storage.get_group(args[0], args[1])
+            except NoGroupError:
+                acknowledged = 0
+            except (ValueError, RuntimeError) as err:
+                self._string_error(err)
+                return
+            else:
+                acknowledged = sum(group.ack(stream_id) for stream_id in ids)
+            self.writer.write(formatter.format_value(acknowledged))
+            if not acknowledged:
+                self.replicated = None
+
+        @self.registry.register(Command.XPENDING)
+        async def handle_xpending(args: list[str]) -> None:
+            # Command example: (Command.XPENDING, "jobs", "workers", "IDLE", "9000", "-", "+", "10", "alice")
+            try:
+                _, group = self.storage.get_group(args[0], args[1])
+                if len(args) == 2:
+                    total, lowest, highest, consumers = group.summary()
+                    reply: list = [
+                        total,
+                        lowest and format_stream_id(lowest),
+                        highest and format_stream_id(highest),
+                        [[name, str(pending)] for name, pending in consumers] or None,
+                    ]
+                else:
+                    rest, min_idle = args[2:], 0
+                    if rest[0].upper() == "IDLE":
+                        min_idle, rest = self._parse_integer(rest[1]), rest[2:]
+                    start = parse_stream_id(rest[0])
+                    end = parse_stream_id(rest[1], MAX_STREAM_ID[1])
+                    count = self._parse_integer(rest[2])
+                    consumer = group.consumers.get(rest[3]) if len(rest) > 3 else None
+                    now = now_ms()
+                    pending = (
+                        []
+                        if len(rest) > 3 and consumer is None
+                        else group.pending_range(
+                            start, end, count, consumer, min_idle, now
+                        )
+                    )
+                    reply = [
+                        [
+                            format_stream_id(stream_id),
+                            entry.consumer,
+                            now - entry.delivery_time,
+                            entry.delivery_count,
+                        ]
+                        for stream_id, entry in pending
+                    ]
+            except IndexError:
+                self._string_error(ValueError("syntax error"))
+                return
+            except (ValueError, RuntimeError) as err:
+                self._string_error(err)
+                return
+            self.writer.write(formatter.format_value(reply))
+
+        @self.registry.register(Command.XCLAIM)
+        async def handle_xclaim(args: list[str]) -> None:
+            # Command example: (Command.XCLAIM, "jobs", "workers", "bob", "3600000", "1526569498055-0", "JUSTID")
+            options = [arg.upper() for arg in args]
+            delivery_time, retry_count, last_id = None, None, None
+            force, justid = False, False
+            now = now_ms()
+            try:
+                min_idle = self._parse_integer(args[3])
+                idx = 4
+                ids = []
+                while idx < len(args) and options[idx] not in XCLAIM_OPTIONS:
+                    ids.append(parse_stream_id(args[idx]))
+                    idx += 1
+                while idx < len(args):
+                    match options[idx]:
+                        case "IDLE":
+                            idx += 1
+                            delivery_time = now - self._parse_integer(args[idx])
+                        case "TIME":
+                            idx += 1
+                            delivery_time = self._parse_integer(args[idx])
+                        case "RETRYCOUNT":
+                            idx += 1
+                            retry_count = self._parse_integer(args[idx])
+                        case "LASTID":
+                            idx += 1
+                            last_id = parse_stream_id(args[idx])
+                        case "FORCE":
+                            force = True
+                        case "JUSTID":
+                            justid = True
+                        case _:
+                            raise ValueError("syntax error")
+                    idx += 1
+                stream, group = self.storage.get_group(args[0], args[1])
+            except IndexError:
+                self._string_error(ValueError("syntax error"))
+                return
+            except (ValueError, RuntimeError) as err:
+                self._string_error(err)
+                return
+
+            consumer = group.consumer(args[2], now)
+            claimed = stream.claim(
+                group,
+                consumer,
+                ids,
+                min_idle,
+                now,
+                delivery_time,
+                retry_count,
+                force,
+                justid,
+            )
+            if last_id is not None and last_id > group.last_delivered:
+                group.last_delivered = last_id
+            if justid:
+                reply = [format_stream_id(stream_id) for stream_id, _ in claimed]
+            else:
+                reply = self._stream_entries(claimed)
+            self.writer.write(formatter.format_value(reply))
+
+        @self.registry.register(Command.XAUTOCLAIM)
+        async def handle_xautoclaim(args: list[str]) -> None:
+            # Command example: (Command.XAUTOCLAIM, "jobs", "workers", "bob", "3600000", "0-0", "COUNT", "25")
+            count, justid = 100, False
+            try:
+                min_idle = self._parse_integer(args[3])
+                start = parse_stream_id(args[4])
+                idx = 5
+                while idx < len(args):
+                    option = args[idx].upper()
+                    if option == "COUNT":
+                        count = self._parse_integer(args[idx + 1])
+                        idx += 2
+                    elif option == "JUSTID":
+                        justid = True
+                        idx += 1
+                    else:
+                        raise ValueError("syntax error")
+                if count < 1:
+                    raise ValueError("COUNT must be > 0")
+                stream, group = self.storage.get_group(args[0], args[1])
+            except IndexError:
+                self._string_error(ValueError("syntax error"))
+                return
+            except (ValueError, RuntimeError) as err:
+                self._string_error(err)
+                return
+
+            now = now_ms()
+            consumer = group.consumer(args[2], now)
+            cursor, claimed, deleted = stream.autoclaim(
+                group, consumer, min_idle, start, count, now, justid
+            )
+            if justid:
+                entries: list = [
+                    format_stream_id(stream_id) for stream_id, _ in claimed
+                ]
+            else:
+                entries = self._stream_entries(claimed)
+            reply = [
+                format_stream_id(cursor),
+                entries,
+                [format_stream_id(stream_id) for stream_id in deleted],
+            ]
+            self.writer.write(formatter.format_value(reply))
+
+        @self.registry.register(Command.FUNCTION)
+        async def handle_function(args: list[str]) -> None:
+            # Command example: (Command.FUNCTION, "LOAD", "REPLACE", "#!python name=lib ...")
+            subcommand = args[0].upper()
+            try:
+                match subcommand:
+                    case "LOAD":
+                        replace = len(args) > 2 and args[1].upper() == "REPLACE"
+                        name = functions.load(args[-1], replace)
+                        self.writer.write(formatter.format_string_expression(name))
+                        self.replicated = (Command.FUNCTION, args)
+                    case "DELETE":
+                        functions.delete(args[1])
+                        self.writer.write(formatter.format_ok_expression())
+                        self.replicated = (Command.FUNCTION, args)
+                    case "FLUSH":
+                        functions.flush()
+                        self.writer.write(formatter.format_ok_expression())
+                        self.replicated = (Command.FUNCTION, args)
+                    case "LIST":
+                        libraries = [
+                            [
+                                "library_name",
+                                library.name,
+                                "functions",
+                                list(library.functions),
+                            ]
+                            for library in functions.libraries.values()
+                        ]
+                        self.writer.write(formatter.format_value(libraries))
+                    case _:
+                        raise FunctionError(f"Unknown FUNCTION subcommand {subcommand}")
+            except FunctionError as err:
+                self.writer.write(formatter.format_simple_error(err))
+
+        @self.registry.register(Command.FCALL)
+        async def handle_fcall(args: list[str]) -> None:
+            # Command example: (Command.FCALL, "incr_pair", "2", "a", "b", "10")
+            await self._process_fcall(args, read_only=False)
+
+        @self.registry.register(Command.FCALL_RO)
+        async def handle_fcall_ro(args: list[str]) -> None:
+            # Command example: (Command.FCALL_RO, "get_pair", "2", "a", "b")
+            await self._process_fcall(args, read_only=True)
+
+        @self.registry.register(Command.SUBSCRIBE)
+        async def handle_subscribe(args: list[str]) -> None:
+            # Command example: (Command.SUBSCRIBE, "news", "orders")
+            for channel in args:
+                count = pubsub.subscribe(self.writer, channel)
+                self.writer.write(formatter.format_value(["subscribe", channel, count]))
+
+        @self.registry.register(Command.UNSUBSCRIBE)
+        async def handle_unsubscribe(args: list[str]) -> None:
+            # Command example: (Command.UNSUBSCRIBE, "news")
+            channels = args or sorted(pubsub.subscriber_channels.get(self.writer, ()))
+            if not channels:
+                self.writer.write(formatter.format_value(["unsubscribe", None, 0]))
+            for channel in channels:
+                count = pubsub.unsubscribe(self.writer, channel)
+                self.writer.write(
+                    formatter.format_value(["unsubscribe", channel, count])
+                )
+
+        @self.registry.register(Command.PSUBSCRIBE)
+        async def handle_psubscribe(args: list[str]) -> None:
+            # Command example: (Command.PSUBSCRIBE, "news.*")
+            for pattern in args:
+                count = pubsub.psubscribe(self.writer, pattern)
+                self.writer.write(
+                    formatter.format_value(["psubscribe", pattern, count])
+                )
+
+        @self.registry.register(Command.PUNSUBSCRIBE)
+        async def handle_punsubscribe(args: list[str]) -> None:
+            # Command example: (Command.PUNSUBSCRIBE, "news.*")
+            patterns = args or sorted(pubsub.subscriber_patterns.get(self.writer, ()))
+            if not patterns:
+                self.writer.write(formatter.format_value(["punsubscribe", None, 0]))
+            for pattern in patterns:
+                count = pubsub.punsubscribe(self.writer, pattern)
+                self.writer.write(
+                    formatter.format_value(["punsubscribe", pattern, count])
+                )
+
+        @self.registry.register(Command.PUBLISH)
+        async def handle_publish(args: list[str]) -> None:
+            # Command example: (Command.PUBLISH, "news", "hello")
+            receivers = pubsub.publish(args[0], args[1])
+            self.writer.write(formatter.format_value(receivers))
+
+        @self.registry.register(Command.PUBSUB)
+        async def handle_pubsub(args: list[str]) -> None:
+            # Command example: (Command.PUBSUB, "NUMSUB", "news")
+            match args[0].upper():
+                case "CHANNELS":
+                    channels = sorted(pubsub.channels)
+                    if len(args) > 1:
+                        regex = compile_glob(args[1])
+                        channels = [ch for ch in channels if regex.fullmatch(ch)]
+                    self.writer.write(formatter.format_value(channels))
+                case "NUMSUB":
+                    counts: list[str | int] = []
+                    for channel in args[1:]:
+                        counts += [channel, len(pubsub.channels.get(channel, ()))]
+                    self.writer.write(formatter.format_value(counts))
+                case "NUMPAT":
+                    self.writer.write(
+                        formatter.format_value(pubsub.pattern_index.patterns())
+                    )
+                case _:
+                    raise RuntimeError(f"Unknown PUBSUB subcommand {args[0]}")
+
+        @self.registry.register(Command.REPLCONF)
+        async def handle_replconf(args: list[str]) -> None:
+            # Command example: (Command.REPLCONF, "listening-port", "6380")
+            if args and args[0].upper() == "ACK":
+                return
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.PSYNC)
+        async def handle_psync(args: list[str]) -> None:
+            # Command example: (Command.PSYNC, "?", "-1")
+            if len(args) != 2:
+                self._string_error(
+                    ValueError("wrong number of arguments for 'psync' command")
+                )
+                return
+            try:
+                offset = self._parse_integer(args[1])
+            except ValueError:
+                # Not an offset we can continue from, the replica gets it all
+                offset = -1
+            replication.psync(self.writer, args[0], offset, self.storage)
+
+        @self.registry.register(Command.REPLICAOF)
+        async def handle_replicaof(args: list[str]) -> None:
+            # Command example: (Command.REPLICAOF, "localhost", "6379")
+            if args[0].upper() == "NO" and args[1].upper() == "ONE":
+                replication.stop_replication()
+            else:
+                replication.replicaof(
+                    args[0], int(args[1]), self.storage, self.__class__
+                )
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.INFO)
+        async def handle_info(args: list[str]) -> None:
+            # Command example: (Command.INFO, "replication")
+            sections = {
+                "replication": replication.info,
+                "memory": self._memory_info,
+                "keyspace": self.databases.keyspace_info,
+            }
+            requested = [arg.lower() for arg in args] or list(sections)
+            info = "\r\n".join(
+                sections[name]() for name in requested if name in sections
+            )
+            self.writer.write(formatter.format_value(info))
+
+        @self.registry.register(Command.HELLO)
+        async def handle_hello(args: list[str]) -> None:
+            # Command example: (Command.HELLO, "3", "SETNAME", "app")
+            protocol = self.protocol
+            if args:
+                requested = encode_string(str(args[0]))
+                if not isinstance(requested, int) or requested not in (2, 3):
+                    self.writer.write(
+                        formatter.format_value(
+                            ReplyError("NOPROTO unsupported protocol version")
+                        )
+                    )
+                    return
+                protocol = requested
+            name = self.name
+            options = [str(arg).upper() for arg in args[1:]]
+            idx = 0
+            while idx < len(options):
+                if options[idx] == "SETNAME" and idx + 1 < len(options):
+                    name = args[idx + 2]
+                    idx += 2
+                elif options[idx] == "AUTH" and idx + 2 < len(options):
+                    self._string_error(
+                        ValueError(
+                            "AUTH <password> called without any password configured"
+                        )
+                    )
+                    return
+                else:
+                    self._string_error(ValueError("syntax error"))
+                    return
+            self.protocol, self.name = protocol, name
+            self.writer.write(
+                formatter.format_map(
+                    {
+                        "server": "redis",
+                        "version": "7.2.0",
+                        "proto": self.protocol,
+                        "id": self.id,
+                        "mode": "cluster" if cluster.enabled else "standalone",
+                        "role": replication.role,
+                        "modules": [],
+                    },
+                    self.protocol,
+                )
+            )
+
+        @self.registry.register(Command.CLIENT)
+        async def handle_client(args: list[str]) -> None:
+            # Command example: (Command.CLIENT, "TRACKING", "ON", "BCAST")
+            subcommand = args[0].upper() if args else ""
+            match subcommand:
+                case "ID":
+                    self.writer.write(formatter.format_value(self.id))
+                case "TRACKING":
+                    self._client_tracking(args[1:])
+                case "SETNAME" if len(args) == 2:
+                    if any(not 33 <= ord(char) <= 126 for char in args[1]):
+                        self._string_error(
+                            ValueError(
+                                "Client names cannot contain spaces, newlines or "
+                                "special characters."
+                            )
+                        )
+                        return
+                    self.name = args[1]
+                    self.writer.write(formatter.format_ok_expression())
+                case "GETNAME":
+                    self.writer.write(formatter.format_value(self.name or None))
+                case "LIST":
+                    ids = None
+                    if len(args) > 2 and args[1].upper() == "ID":
+                        try:
+                            ids = [int(client_id) for client_id in args[2:]]
+                        except ValueError:
+                            self._string_error(ValueError("Invalid client ID"))
+                            return
+                    self.writer.write(
+                        formatter.format_value(clients.list_response(ids))
+                    )
+                case "KILL":
+                    self._client_kill(args[1:])
+                case _:
+                    self._string_error(
+                        ValueError(f"unknown subcommand '{subcommand.lower()}'")
+                    )
+
+        @self.registry.register(Command.ASKING)
+        async def handle_asking(_: list[str]) -> None:
+            # Command example: (Command.ASKING,)
+            self.asking = True
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.CLUSTER)
+        async def handle_cluster(args: list[str]) -> None:
+            # Command example: (Command.CLUSTER, "KEYSLOT", "foo")
+            subcommand = args[0].upper()
+            if not cluster.enabled:
+                self.writer.write(
+                    formatter.format_simple_error(
+                        RuntimeError("This instance has cluster support disabled")
+                    )
+                )
+                return
+            try:
+                match subcommand:
+                    case "KEYSLOT":
+                        reply: Any = key_hash_slot(args[1])
+                    case "MYID":
+                        reply = cluster.myself.id
+                    case "ADDSLOTS":
+                        cluster.add_slots([int(slot) for slot in args[1:]])
+                        reply = "OK"
+                    case "ADDSLOTSRANGE":
+                        bounds = [int(slot) for slot in args[1:]]
+                        cluster.add_slots(
+                            [
+                                slot
+                                for start, end in zip(bounds[::2], bounds[1::2])
+                                for slot in range(start, end + 1)
+                            ]
+                        )
+                        reply = "OK"
+                    case "DELSLOTS":
+                        cluster.delete_slots([int(slot) for slot in args[1:]])
+                        reply = "OK"
+                    case "SETSLOT":
+                        node_id = args[3] if len(args) > 3 else None
+                        cluster.set_slot(int(args[1]), args[2].upper(), node_id)
+                        reply = "OK"
+                    case "MEET":
+                        await cluster.meet(args[1], int(args[2]))
+                        reply = "OK"
+                    case "SLOTS":
+                        reply = cluster.slots_response()
+                    case "SHARDS":
+                        reply = cluster.shards_response()
+                    case "NODES":
+                        reply = cluster.nodes_response()
+                    case "COUNTKEYSINSLOT":
+                        slot = int(args[1])
+                        reply = len(self.storage.data.keys_in_slot(slot, key_hash_slot))
+                    case "GETKEYSINSLOT":
+                        slot, count = int(args[1]), int(args[2])
+                        keys = self.storage.data.keys_in_slot(slot, key_hash_slot)
+                        reply = list(itertools.islice(keys, count))
+                    case "INFO":
+                        assigned = sum(1 for node in cluster.slots if node is not None)
+                        state = "ok" if assigned == CLUSTER_SLOTS else "fail"
+                        reply = (
+                            f"cluster_state:{state}\r\n"
+                            f"cluster_slots_assigned:{assigned}\r\n"
+                            f"cluster_known_nodes:{len(cluster.nodes)}\r\n"
+                        )
+                    case _:
+                        raise RuntimeError(f"Unknown CLUSTER subcommand {subcommand}")
+            except (RuntimeError, ValueError, IndexError, OSError) as err:
+                self.writer.write(formatter.format_simple_error(err))
+                return
+            if reply == "OK":
+                self.writer.write(formatter.format_ok_expression())
+            else:
+                self.writer.write(formatter.format_value(reply))
+
+        @self.registry.register(Command.MIGRATE)
+        async def handle_migrate(args: list[str]) -> None:
+            # Command example: (Command.MIGRATE, "127.0.0.1", "7001", "", "0", "5000", "KEYS", "a", "b")
+            options = [arg.upper() for arg in args[5:]]
+            keys = args[5 + options.index("KEYS") + 1 :] if "KEYS" in options else []
+            if args[2]:
+                keys = [args[2]]
+            try:
+                moved = await cluster.migrate(
+                    args[0], int(args[1]), keys, self.storage, "COPY" in options
+                )
+            except (RuntimeError, OSError) as err:
+                self.writer.write(formatter.format_value(ReplyError(f"IOERR {err}")))
+                return
+            if moved:
+                self.writer.write(formatter.format_ok_expression())
+            else:
+                self.writer.write(b"+NOKEY\r\n")
+
+        @self.registry.register(Command.SCAN)
+        async def handle_scan(args: list[str]) -> None:
+            # Command example: (Command.SCAN, "0", "MATCH", "user:*", "COUNT", "100", "TYPE", "list")
+            if not args:
+                self._string_error(
+                    ValueError("wrong number of arguments for 'scan' command")
+                )
+                return
+            try:
+                cursor = self._parse_integer(args[0])
+            except ValueError:
+                cursor = -1
+            if cursor < 0:
+                self._string_error(ValueError("invalid cursor"))
+                return
+            count, pattern, value_type = 10, None, None
+            options = list(zip(args[1::2], args[2::2]))
+            if len(args) % 2 == 0:
+                options.append(("", ""))
+            try:
+                for option, value in options:
+                    match option.upper():
+                        case "MATCH":
+                            pattern = compile_glob(value)
+                        case "COUNT":
+                            count = self._parse_integer(value)
+                            if count < 1:
+                                raise ValueError("syntax error")
+                        case "TYPE" if value.upper() in ValueType.__members__:
+                            value_type = ValueType[value.upper()]
+                        case _:
+                            raise ValueError("syntax error")
+            except ValueError as err:
+                self._string_error(err)
+                return
+            next_cursor, keys = self.storage.scan(cursor, count, pattern, value_type)
+            self.writer.write(formatter.format_value([str(next_cursor), keys]))
+
+        @self.registry.register(Command.DEL)
+        async def handle_del(args: list[str]) -> None:
+            # Command example: (Command.DEL, "foo", "bar")
+            deleted = sum(1 for key in args if self.storage.delete(key))
+            self.writer.write(formatter.format_value(deleted))
+
+        @self.registry.register(Command.UNLINK)
+        async def handle_unlink(args: list[str]) -> None:
+            # Command example: (Command.UNLINK, "foo", "bar")
+            deleted = sum(1 for key in args if self.storage.unlink(key))
+            self.writer.write(formatter.format_value(deleted))
+
+        @self.registry.register(Command.FLUSHALL)
+        async def handle_flushall(args: list[str]) -> None:
+            # Command example: (Command.FLUSHALL, "ASYNC")
+            asynchronous = bool(args) and args[0].upper() == "ASYNC"
+            self.databases.flush(asynchronous)
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.FLUSHDB)
+        async def handle_flushdb(args: list[str]) -> None:
+            # Command example: (Command.FLUSHDB, "ASYNC")
+            asynchronous = bool(args) and args[0].upper() == "ASYNC"
+            self.storage.flush(asynchronous)
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.SELECT)
+        async def handle_select(args: list[str]) -> None:
+            # Command example: (Command.SELECT, "1")
+            try:
+                index = self._parse_integer(args[0])
+            except ValueError as err:
+                self._string_error(err)
+                return
+            if cluster.enabled and index != 0:
+                self._string_error(ValueError("SELECT is not allowed in cluster mode"))
+                return
+            try:
+                self.storage = self.databases.get(index)
+            except ValueError as err:
+                self._string_error(err)
+                return
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.SWAPDB)
+        async def handle_swapdb(args: list[str]) -> None:
+            # Command example: (Command.SWAPDB, "0", "1")
+            if len(args) != 2:
+                self._string_error(
+                    ValueError("wrong number of arguments for 'swapdb' command")
+                )
+                return
+            try:
+                first, second = (
+                    self._parse_integer(args[0]),
+                    self._parse_integer(args[1]),
+                )
+                await self.databases.swap(first, second)
+            except ValueError as err:
+                self._string_error(err)
+                return
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.DBSIZE)
+        async def handle_dbsize(_: list[str]) -> None:
+            # Command example: (Command.DBSIZE,)
+            self.writer.write(formatter.format_value(len(self.storage.data)))
+
+        @self.registry.register(Command.DEBUG)
+        async def handle_debug(args: list[str]) -> None:
+            # Command example: (Command.DEBUG, "PROFILE", "START", "200")
+            words = [arg.upper() for arg in args[:3]]
+            try:
+                match words:
+                    case ["PROFILE", "START"]:
+                        profiler.start_sampling(DEFAULT_SAMPLING_HZ)
+                    case ["PROFILE", "START", "CPROFILE"]:
+                        profiler.start_cprofile()
+                    case ["PROFILE", "START", _]:
+                        profiler.start_sampling(self._parse_integer(args[2]))
+                    case ["PROFILE", "STOP"]:
+                        path = profiler.stop(config.profile_dir)
+                        self.writer.write(formatter.format_value(path))
+                        return
+                    case _:
+                        subcommand = " ".join(args[:2]).lower()
+                        raise ValueError(f"unknown subcommand '{subcommand}'")
+            except (RuntimeError, ValueError, OSError) as err:
+                self._string_error(err)
+                return
+            self.writer.write(formatter.format_ok_expression())
+
+        @self.registry.register(Command.OBJECT)
+        async def handle_object(args: list[str]) -> None:
+            # Command example: (Command.OBJECT, "FREQ", "foo")
+            subcommand = args[0].upper() if args else ""
+            if subcommand not in ("ENCODING", "FREQ", "IDLETIME") or len(args) != 2:
+                self._string_error(
+                    ValueError(f"unknown subcommand '{' '.join(args[:1]).lower()}'")
+                )
+                return
+            key = args[1]
+            # Read without get(), looking at a key is not an access
+            value = self.storage.data.get(key)
+            if isinstance(value, Value) and value.expire:
+                if value.expire <= datetime.datetime.now():
+                    value = None
+            if value is None:
+                self.writer.write(formatter.format_value(None))
+                return
+            if subcommand == "ENCODING":
+                self.writer.write(formatter.format_value(object_encoding(value)))
+                return
+            if self.storage.tracker is None:
+                self._string_error(ValueError(ACCESS_TRACKING_DISABLED))
+                return
+            if subcommand == "FREQ":
+                reply = self.storage.tracker.frequency(key)
+            else:
+                reply = self.storage.idle_time(key) or 0
+            self.writer.write(formatter.format_value(reply))
+
+        @self.registry.register(Command.HOTKEYS)
+        async def handle_hotkeys(args: list[str]) -> None:
+            # Command example: (Command.HOTKEYS, "10")
+            try:
+                count = self._parse_integer(args[0]) if args else 10
+            except ValueError as err:
+                self._string_error(err)
+                return
+            if self.storage.tracker is None:
+                self._string_error(ValueError(ACCESS_TRACKING_DISABLED))
+                return
+            # Deleted keys may linger in the top until they are pushed out
+            hottest = [
+                [key, frequency]
+                for key, frequency in self.storage.tracker.hottest(TOP_KEYS)
+                if key in self.storage.data
+            ]
+            self.writer.write(formatter.format_value(hottest[: max(count, 0)]))
+
+    async def process_command(
+        self, command: tuple[Command, *tuple[str]] | XaddBatch
+    ) -> None:
         """Process a command and return the result into the writer."""
+        if isinstance(command, XaddBatch):
+            await self._process_xadd_batch(command)
+            return
         if not command:
             raise RuntimeError("Empty command")
 
@@ -230,9 +1617,435 @@ class Processor:
         if handler is None:
             raise RuntimeError(f"Unknown command: {cmd_type}")
 
+        if cmd_type not in SUBSCRIBED_MODE_COMMANDS and pubsub.is_subscribed(
+            self.writer
+        ):
+            self.writer.write(
+                formatter.format_simple_error(
+                    RuntimeError(
+                        f"Can't execute '{cmd_type.name.lower()}': only (P)SUBSCRIBE / "
+                        "(P)UNSUBSCRIBE / PING are allowed in this context"
+                    )
+                )
+            )
+            await self._drain()
+            return
+
+        asking, self.asking = self.asking, False
+        if cluster.enabled and not self.is_master_link:
+            redirect = cluster.route(cmd_type, args, self.storage, asking)
+            if redirect is not None:
+                self.writer.write(formatter.format_value(redirect))
+                await self._drain()
+                return
+
+        if (
+            cmd_type in WRITE_COMMANDS
+            and replication.role == "slave"
+            and not self.is_master_link
+        ):
+            self.writer.write(
+                formatter.format_value(
+                    ReplyError("READONLY You can't write against a read only replica.")
+                )
+            )
+            await self._drain()
+            return
+
+        self.replicated = (cmd_type, args) if cmd_type in WRITE_COMMANDS else None
         await handler(args)
+        self._propagate()
+        if tracking.clients and cmd_type not in WRITE_COMMANDS:
+            tracking.remember(self.writer, command_keys(cmd_type, args))
+        await self._drain()
+
+    async def _process_xadd_batch(self, batch: XaddBatch) -> None:
+        """Run pipelined XADDs to one stream as a single append.
+
+        Replies and replication stay per command. Whenever a command could
+        be rejected or redirected, the batch runs one command at a time.
+        """
+        if (
+            pubsub.is_subscribed(self.writer)
+            or cluster.enabled
+            or (replication.role == "slave" and not self.is_master_link)
+        ):
+            for command in batch.commands:
+                await self.process_command(command)
+            return
+
+        self.asking = False
+        values = [
+            Value({"id": command[2], **dict(zip(command[3::2], command[4::2]))})
+            for command in batch.commands
+        ]
+        try:
+            results = self.storage.add_stream_entries(batch.key, values)
+        except WrongTypeError as err:
+            results = [err] * len(values)
+        replies = []
+        for command, result in zip(batch.commands, results):
+            if isinstance(result, Exception):
+                replies.append(formatter.format_simple_error(result))
+                continue
+            replies.append(formatter.format_string_expression(result))
+            # Replicas must store the generated id, not "*"
+            self.replicated = (Command.XADD, [batch.key, result, *command[3:]])
+            self._propagate()
+        self.replicated = None
+        self.writer.write(b"".join(replies))
+        await self._drain()
+
+    def _key_value_pairs(
+        self, name: str, args: list[str]
+    ) -> Optional[list[tuple[str, Value]]]:
+        if not args or len(args) % 2:
+            self.writer.write(
+                formatter.format_simple_error(
+                    RuntimeError(f"wrong number of arguments for '{name}' command")
+                )
+            )
+            self.replicated = None
+            return None
+        return [
+            (key, Value(encode_string(value)))
+            for key, value in zip(args[::2], args[1::2])
+        ]
+
+    def _client_kill(self, args: list[str]) -> None:
+        if len(args) == 1:
+            # Old form, CLIENT KILL addr
+            if clients.kill(address=args[0]):
+                self.writer.write(formatter.format_ok_expression())
+            else:
+                self._string_error(ValueError("No such client"))
+            return
+        if not args or len(args) % 2:
+            self._string_error(ValueError("syntax error"))
+            return
+        filters: dict[str, Any] = {}
+        for name, value in zip(args[::2], args[1::2]):
+            match name.upper():
+                case "ID":
+                    try:
+                        filters["client_id"] = self._parse_integer(value)
+                    except ValueError as err:
+                        self._string_error(err)
+                        return
+                case "ADDR":
+                    filters["address"] = value
+                case _:
+                    self._string_error(ValueError("syntax error"))
+                    return
+        self.writer.write(formatter.format_value(clients.kill(**filters)))
+
+    async def _drain(self) -> None:
+        """Wait for the reply to be sent, within the output buffer limits.
+
+        Only a client above the soft limit is waited for at most the soft
+        limit's seconds and closed after that. Below it the wait lasts as
+        long as the client takes to read.
+        """
+        if self.writer in replication.replicas:
+            # The replication stream is bounded by the backlog instead
+            await self.writer.drain()
+            return
+        if clients.output_limit_exceeded(self.writer):
+            print(f"Closing client {self.id}, output buffer limit reached")
+            self.writer.close()
+            return
+        _, soft, seconds = config.client_output_buffer_limit
+        if soft and output_buffer_size(self.writer) > soft:
+            # A client that stopped reading would block this connection forever.
+            # asyncio.wait, unlike wait_for, also works before the protocol
+            # layer hands the command to a task
+            drained = asyncio.ensure_future(self.writer.drain())
+            done, _ = await asyncio.wait({drained}, timeout=seconds)
+            if not done:
+                drained.cancel()
+                print(f"Closing client {self.id}, output buffer limit reached")
+                self.writer.close()
+            return
         await self.writer.drain()
 
+    def _client_tracking(self, args: list[str]) -> None:
+        if not args or args[0].upper() not in ("ON", "OFF"):
+            self._string_error(ValueError("syntax error"))
+            return
+        if args[0].upper() == "OFF":
+            tracking.disable(self.writer)
+            self.writer.write(formatter.format_ok_expression())
+            return
+
+        bcast, prefixes = False, []
+        idx = 1
+        while idx < len(args):
+            option = args[idx].upper()
+            if option == "BCAST":
+                bcast = True
+            elif option == "PREFIX" and idx + 1 < len(args):
+                idx += 1
+                prefixes.append(args[idx])
+            else:
+                # OPTIN, OPTOUT, NOLOOP and REDIRECT are not supported
+                self._string_error(ValueError(f"unsupported option '{args[idx]}'"))
+                return
+            idx += 1
+        if prefixes and not bcast:
+            self._string_error(
+                ValueError("PREFIX option requires BCAST mode to be enabled")
+            )
+            return
+        if self.protocol != 3:
+            # Invalidations are pushed on the connection itself
+            self._string_error(
+                ValueError("client tracking requires RESP3, switch with HELLO 3")
+            )
+            return
+        tracking.enable(self.writer, bcast, prefixes)
+        self.writer.write(formatter.format_ok_expression())
+
+    def _memory_info(self) -> str:
+        lines = [f"lazyfree_pending_objects:{lazyfree.pending()}"]
+        if self.storage.tier is not None:
+            lines += self.storage.tier.info()
+        return "# Memory\r\n" + "\r\n".join(lines) + "\r\n"
+
+    def _set_options(
+        self, args: list[str]
+    ) -> Optional[tuple[Optional[datetime.datetime], Optional[str], bool, bool]]:
+        """Parse the options following SET key value, None on an error"""
+        expiration, condition, keep_ttl, get = None, None, False, False
+        expiration_option = None
+        idx = 0
+        while idx < len(args):
+            option = args[idx].upper()
+            if option in ("NX", "XX") and condition is None:
+                condition = option
+            elif option == "GET" and not get:
+                get = True
+            elif option == "KEEPTTL" and not keep_ttl and expiration_option is None:
+                keep_ttl = True
+            elif (
+                option in ("EX", "PX", "EXAT", "PXAT")
+                and expiration_option is None
+                and not keep_ttl
+                and idx + 1 < len(args)
+            ):
+                expiration_option = option
+                idx += 1
+                try:
+                    amount = self._parse_integer(args[idx])
+                except ValueError as err:
+                    self._string_error(err)
+                    return None
+                if amount <= 0:
+                    self._string_error(
+                        ValueError("invalid expire time in 'set' command")
+                    )
+                    return None
+                expiration = self._expiration_time(option, amount)
+            else:
+                self._string_error(ValueError("syntax error"))
+                return None
+            idx += 1
+        return expiration, condition, keep_ttl, get
+
+    @staticmethod
+    def _expiration_time(option: str, amount: int) -> datetime.datetime:
+        milliseconds: float
+        match option:
+            case "EX":
+                milliseconds = amount * 1000
+            case "PX":
+                milliseconds = amount
+            case "EXAT":
+                milliseconds = amount * 1000 - time.time() * 1000
+            case _:
+                milliseconds = amount - time.time() * 1000
+        return datetime.datetime.now() + datetime.timedelta(milliseconds=milliseconds)
+
+    def _string_command(
+        self, operation: Callable, *args: Any, reply: bool = True
+    ) -> Any:
+        """Run a string operation, errors are replied instead of raised"""
+        try:
+            result = operation(*args)
+        except (ValueError, WrongTypeError) as err:
+            self._string_error(err)
+            return None
+        if reply:
+            self.writer.write(formatter.format_value(result))
+        return result
+
+    @staticmethod
+    def _parse_integer(arg: str) -> int:
+        number = encode_string(str(arg))
+        if not isinstance(number, int):
+            raise ValueError("value is not an integer or out of range")
+        return number
+
+    @staticmethod
+    def _parse_bit_offset(arg: str) -> int:
+        offset = encode_string(str(arg))
+        if not isinstance(offset, int) or not 0 <= offset <= MAX_BIT_OFFSET:
+            raise ValueError("bit offset is not an integer or out of range")
+        return offset
+
+    @staticmethod
+    def _bit_unit(args: list[str]) -> bool:
+        """Whether the optional BYTE | BIT of BITCOUNT and BITPOS is BIT"""
+        if not args:
+            return False
+        if len(args) > 1 or args[0].upper() not in ("BYTE", "BIT"):
+            raise ValueError("syntax error")
+        return args[0].upper() == "BIT"
+
+    def _bitfield_operations(self, args: list[str]) -> list[BitfieldOperation]:
+        """Parse the GET / SET / INCRBY / OVERFLOW subcommands of BITFIELD"""
+        operations: list[BitfieldOperation] = []
+        overflow, idx = "WRAP", 0
+        while idx < len(args):
+            name = args[idx].upper()
+            if name == "OVERFLOW" and idx + 1 < len(args):
+                overflow = args[idx + 1].upper()
+                if overflow not in ("WRAP", "SAT", "FAIL"):
+                    raise ValueError("Invalid OVERFLOW type specified")
+                idx += 2
+                continue
+            arity = 3 if name == "GET" else 4
+            if name not in ("GET", "SET", "INCRBY") or idx + arity > len(args):
+                raise ValueError("syntax error")
+            signed, width = parse_bitfield_type(args[idx + 1])
+            # #N addresses the Nth field of this width
+            text = args[idx + 2]
+            if text.startswith("#"):
+                offset = self._parse_bit_offset(text[1:]) * width
+            else:
+                offset = self._parse_bit_offset(text)
+            if offset + width - 1 > MAX_BIT_OFFSET:
+                raise ValueError("bit offset is not an integer or out of range")
+            value = self._parse_integer(args[idx + 3]) if arity == 4 else 0
+            operations.append(
+                BitfieldOperation(name, signed, width, offset, value, overflow)
+            )
+            idx += arity
+        return operations
+
+    def _trim_options(self, args: list[str]) -> tuple[dict[str, Any], int]:
+        """Parse MAXLEN|MINID [=|~] threshold [LIMIT count] at the head of args.
+
+        Returns the keyword arguments of Stream.trim and how many args it used.
+        """
+        strategy, idx = args[0].upper(), 1
+        approximate = args[idx] == "~"
+        if args[idx] in ("=", "~"):
+            idx += 1
+        options: dict[str, Any] = {"approximate": approximate}
+        if strategy == "MAXLEN":
+            options["maxlen"] = self._parse_integer(args[idx])
+            if options["maxlen"] < 0:
+                raise ValueError("The MAXLEN argument must be >= 0.")
+        else:
+            options["minid"] = parse_stream_id(args[idx])
+        idx += 1
+        if idx < len(args) and args[idx].upper() == "LIMIT":
+            if not approximate:
+                raise ValueError(
+                    "syntax error, LIMIT cannot be used without the special ~ option"
+                )
+            options["limit"] = self._parse_integer(args[idx + 1])
+            idx += 2
+        return options, idx
+
+    def _read_groups(
+        self,
+        group_name: str,
+        consumer_name: str,
+        keys: list[str],
+        starts: list[Optional[StreamId]],
+        count: Optional[int],
+        noack: bool,
+    ) -> list:
+        """One XREADGROUP pass, streams without new entries are left out"""
+        # Every group is looked up first, a missing one fails the whole call
+        groups = [self.storage.get_group(key, group_name) for key in keys]
+        now = now_ms()
+        reply = []
+        for key, start, (stream, group) in zip(keys, starts, groups):
+            consumer = group.consumer(consumer_name, now)
+            entries = stream.read_group(group, consumer, start, count, noack, now)
+            if entries or start is not None:
+                reply.append([key, self._stream_entries(entries)])
+        return reply
+
+    @staticmethod
+    def _stream_entries(entries: list[tuple[StreamId, Any]]) -> list:
+        # Entries deleted since their delivery are replied as a null
+        return [
+            [format_stream_id(stream_id), entry and entry_fields(entry)]
+            for stream_id, entry in entries
+        ]
+
+    def _string_error(self, error: Exception) -> None:
+        self.writer.write(formatter.format_simple_error(error))
+        self.replicated = None
+
+    async def _process_fcall(self, args: list[str], read_only: bool) -> None:
+        name, num_keys = args[0], valid_num_keys(args)
+        if num_keys is None:
+            self._string_error(ValueError("Bad number of keys provided"))
+            return
+        keys, function_args = args[2 : 2 + num_keys], args[2 + num_keys :]
+        try:
+            result = functions.call(
+                name, keys, function_args, self._execute_from_function, read_only
+            )
+            self.writer.write(formatter.format_value(result))
+        except FunctionError as err:
+            self.writer.write(formatter.format_simple_error(err))
+
+    def _execute_from_function(self, args: list[str], read_only: bool) -> Any:
+        """Run a command for a function and decode its reply.
+
+        The handler coroutine is driven synchronously, so a function can never
+        yield to the event loop half-way and the whole call stays atomic.
+        """
+        command = parser.COMMAND_MAP.get(args[0].upper()) if args else None
+        if command is None or command in FUNCTION_DENIED_COMMANDS:
+            return ReplyError("ERR This command is not allowed from functions")
+        if read_only and command in WRITE_COMMANDS:
+            return ReplyError(
+                "ERR Write commands are not allowed from read-only functions"
+            )
+
+        writer, self.writer = self.writer, ReplyBuffer()
+        self.replicated = (command, args[1:]) if command in WRITE_COMMANDS else None
+        try:
+            coroutine = self.registry.get_handler(command)(args[1:])
+            try:
+                coroutine.send(None)
+            except StopIteration:
+                pass
+            else:
+                coroutine.close()
+                return ReplyError(
+                    "ERR Blocking commands are not allowed from functions"
+                )
+            reply = bytes(self.writer.buffer)
+            # Functions are replicated by their effects, command by command
+            self._propagate()
+        except Exception as err:
+            return ReplyError(f"ERR {err}")
+        finally:
+            self.writer = writer
+            self.replicated = None
+        return parser.parse_reply(reply)
+
+    def _propagate(self) -> None:
+        if self.replicated is not None and not self.is_master_link:
+            replication.propagate(*self.replicated, self.storage.index)
+
     async def _process_push_command(self, push: Push, args: list[str]) -> None:
         record_key = args[0]
         values = None
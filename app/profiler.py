@@ -0,0 +1,113 @@
+"""On demand profiling of the running server, for DEBUG PROFILE.
+
+Nothing is installed while the profiler is off, the event loop runs
+exactly as it would without this module. Sampling runs a thread that
+looks at the loop thread's stack hz times a second and counts each
+distinct stack, written out in the collapsed format flamegraph.pl,
+speedscope and inferno read. cProfile traces every call instead, more
+precise but slower, and is written as a pstats file.
+"""
+
+import cProfile
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+DEFAULT_SAMPLING_HZ = 100
+MAX_SAMPLING_HZ = 10_000
+
+
+def collapse_stack(frame) -> str:
+    """A stack as one collapsed line, outermost frame first"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class Profiler:
+    def __init__(self):
+        # "sample" or "cprofile" while running, None when off
+        self.mode: Optional[str] = None
+        self.samples: Counter = Counter()
+        self._profile: Optional[cProfile.Profile] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.mode is not None
+
+    def start_sampling(self, hz: int = DEFAULT_SAMPLING_HZ) -> None:
+        """Sample the calling thread's stack, the one running the event loop.
+
+        The sampler needs the GIL to read a stack, so the loop thread gives
+        it up at the next switch interval, 5ms by default; rates above
+        200hz mostly add samples of whatever holds the GIL for longest.
+        """
+        if self.running:
+            raise RuntimeError("profiler is already running")
+        if not 0 < hz <= MAX_SAMPLING_HZ:
+            raise ValueError(f"sampling rate must be between 1 and {MAX_SAMPLING_HZ}")
+        self.mode = "sample"
+        self.samples = Counter()
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(), 1 / hz),
+            name="profiler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def start_cprofile(self) -> None:
+        """Trace every call of the calling thread until stop()"""
+        if self.running:
+            raise RuntimeError("profiler is already running")
+        self.mode = "cprofile"
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, directory: Optional[str] = None) -> str:
+        """Stop and write the profile into directory, returns the file path"""
+        if not self.running:
+            raise RuntimeError("profiler is not running")
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(directory or os.getcwd(), f"profile-{os.getpid()}-{stamp}")
+        try:
+            if self.mode == "cprofile":
+                assert self._profile is not None
+                self._profile.disable()
+                path = base + ".pstats"
+                self._profile.dump_stats(path)
+            else:
+                assert self._thread is not None
+                self._stopped.set()
+                self._thread.join()
+                path = base + ".folded"
+                with open(path, "w") as file:
+                    for stack, count in self.samples.most_common():
+                        file.write(f"{stack} {count}\n")
+        finally:
+            # A failed write, e.g. a missing directory, still stops profiling
+            self.mode = None
+            self._profile = None
+            self._thread = None
+        return path
+
+    def _sample(self, thread_id: int, interval: float) -> None:
+        while not self._stopped.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            self.samples[collapse_stack(frame)] += 1
+            del frame
+
+
+profiler = Profiler()
@@ -0,0 +1,280 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Optional
+
+from app.clients import ClientInfo, clients
+from app.config import config
+from app.parser import parser
+from app.processor import (
+    BLOCKING_COMMANDS,
+    Processor,
+    coalesce_xadds,
+    command_name,
+)
+from app.pubsub import pubsub
+from app.replication import replication
+from app.storage import Storage
+
+
+class TransportWriter:
+    """The part of StreamWriter the processor uses, on top of a bare transport"""
+
+    def __init__(self, transport: asyncio.Transport):
+        self.transport = transport
+        self._paused = False
+        self._drain_waiter: Optional[asyncio.Future] = None
+
+    def write(self, data: Any) -> None:
+        self.transport.write(data)
+
+    async def drain(self) -> None:
+        if not self._paused:
+            return
+        if self._drain_waiter is None:
+            self._drain_waiter = asyncio.get_running_loop().create_future()
+        await self._drain_waiter
+
+    def close(self) -> None:
+        self.transport.close()
+
+    def is_closing(self) -> bool:
+        return self.transport.is_closing()
+
+    def get_extra_info(self, name: str, default: Any = None) -> Any:
+        return self.transport.get_extra_info(name, default)
+
+    def pause_writing(self) -> None:
+        self._paused = True
+
+    def resume_writing(self) -> None:
+        self._paused = False
+        self._wake_up()
+
+    def connection_lost(self) -> None:
+        self._paused = False
+        self._wake_up()
+
+    def _wake_up(self) -> None:
+        waiter, self._drain_waiter = self._drain_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+
+class Resume:
+    """Finish, inside a task, a coroutine that was started by hand.
+
+    Commands are run with coroutine.send(None) straight from data_received,
+    most of them complete without suspending. The few that do suspend (a
+    drain under back pressure) hand the awaited future over to a task, which
+    resumes the coroutine once it resolves. Blocking commands never start
+    this way, see BLOCKING_COMMANDS.
+    """
+
+    def __init__(self, coroutine: Any, awaited: Any):
+        self.coroutine = coroutine
+        self.awaited = awaited
+
+    def __await__(self):
+        awaited = self.awaited
+        while True:
+            try:
+                yield awaited
+            except BaseException as err:
+                try:
+                    awaited = self.coroutine.throw(err)
+                except StopIteration as stop:
+                    return stop.value
+                continue
+            try:
+                awaited = self.coroutine.send(None)
+            except StopIteration as stop:
+                return stop.value
+
+
+class RedisProtocol(asyncio.Protocol):
+    """A connection served from data_received, without StreamReader.
+
+    Complete commands are parsed as soon as bytes arrive and run right
+    away; a task is only created for a command that has to wait. Reading
+    pauses while one does, so a client pipelining faster than its commands
+    run has its bytes wait in the socket rather than in the command queue.
+    """
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.writer: Optional[TransportWriter] = None
+        self.processor: Optional[Processor] = None
+        self.info: Optional[ClientInfo] = None
+        self.buffer = bytearray()
+        # Size the buffer has to reach before a partial request can parse
+        self.wanted = 0
+        self.commands: deque = deque()
+        # [commands left, bytes] per parsed read still in the queue
+        self.batches: deque[list[int]] = deque()
+        self.queued_bytes = 0
+        self.pending: Optional[asyncio.Task] = None
+        self._idle_timer: Optional[asyncio.TimerHandle] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.Transport)
+        if not clients.admit():
+            transport.write(b"-ERR max number of clients reached\r\n")
+            transport.close()
+            return
+        self.writer = TransportWriter(transport)
+        self.processor = Processor(self.writer, self.storage)
+        self.info = clients.register(self.processor, self.writer)
+        if config.timeout:
+            self._schedule_idle_check(config.timeout)
+
+    def data_received(self, data: bytes) -> None:
+        if self.writer is None or self.writer.is_closing():
+            return
+        self.buffer += data
+        if self.query_buffer_size() > config.client_query_buffer_limit:
+            assert self.processor is not None
+            print(f"Closing client {self.processor.id}, query buffer limit reached")
+            self.writer.close()
+            return
+        if len(self.buffer) < self.wanted:
+            return
+        try:
+            commands, consumed = parser.parse_commands(self.buffer)
+            del self.buffer[:consumed]
+            self.wanted = parser.wanted_size(self.buffer)
+        except Exception as e:
+            print(f"Error: {e}")
+            self.writer.close()
+            return
+        queued = coalesce_xadds(commands)
+        if queued:
+            self.commands.extend(queued)
+            self.batches.append([len(queued), consumed])
+            self.queued_bytes += consumed
+        if self.pending is None:
+            self._run_commands()
+
+    def query_buffer_size(self) -> int:
+        """Bytes read but not run yet, unparsed or waiting in the queue"""
+        return len(self.buffer) + self.queued_bytes
+
+    def pause_writing(self) -> None:
+        if self.writer is not None:
+            self.writer.pause_writing()
+
+    def resume_writing(self) -> None:
+        if self.writer is not None:
+            self.writer.resume_writing()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+        if self.writer is None:
+            return
+        self.writer.connection_lost()
+        if self.pending is not None:
+            self.pending.cancel()
+        self._clear_commands()
+        if self.info is not None:
+            clients.unregister(self.info)
+
+    def _run_commands(self) -> None:
+        self._run_queue()
+        self._pause_reading_while_pending()
+
+    def _run_queue(self) -> None:
+        assert self.writer is not None and self.processor is not None
+        assert self.info is not None
+        while self.commands:
+            if self.writer.is_closing():
+                self._clear_commands()
+                return
+            command = self.commands.popleft()
+            batch = self.batches[0]
+            batch[0] -= 1
+            if not batch[0]:
+                self.batches.popleft()
+                self.queued_bytes -= batch[1]
+            clients.touch(self.info, command_name(command), self.query_buffer_size())
+            coroutine = self.processor.process_command(command)
+            if isinstance(command, tuple) and command[0] in BLOCKING_COMMANDS:
+                self.pending = asyncio.ensure_future(coroutine)
+                self.pending.add_done_callback(self._command_done)
+                return
+            try:
+                awaited = coroutine.send(None)
+            except StopIteration:
+                continue
+            except Exception as e:
+                print(f"Error: {e}")
+                self.writer.close()
+                return
+            self.pending = asyncio.ensure_future(Resume(coroutine, awaited))
+            self.pending.add_done_callback(self._command_done)
+            return
+
+    def _pause_reading_while_pending(self) -> None:
+        # The queue only grows while a command waits, so this bounds it too
+        assert self.writer is not None
+        transport = self.writer.transport
+        if transport.is_closing():
+            return
+        if self.pending is not None and transport.is_reading():
+            transport.pause_reading()
+        elif self.pending is None and not transport.is_reading():
+            transport.resume_reading()
+
+    def _clear_commands(self) -> None:
+        self.commands.clear()
+        self.batches.clear()
+        self.queued_bytes = 0
+
+    def _command_done(self, task: asyncio.Task) -> None:
+        self.pending = None
+        if task.cancelled():
+            return
+        assert self.writer is not None
+        if task.exception() is not None:
+            print(f"Error: {task.exception()}")
+            self.writer.close()
+            return
+        self._run_commands()
+
+    def _schedule_idle_check(self, delay: float) -> None:
+        loop = asyncio.get_running_loop()
+        self._idle_timer = loop.call_later(delay, self._check_idle)
+
+    def _check_idle(self) -> None:
+        assert self.writer is not None and self.info is not None
+        idle = time.monotonic() - self.info.last_interaction
+        # Subscribers, replicas and blocked commands are expected to stay quiet
+        quiet = (
+            pubsub.is_subscribed(self.writer)
+            or self.writer in replication.replicas
+            or self.pending is not None
+        )
+        if quiet:
+            self._schedule_idle_check(config.timeout)
+        elif idle >= config.timeout:
+            self.writer.close()
+        else:
+            self._schedule_idle_check(config.timeout - idle)
+
+
+async def serve_protocol(
+    storage: Storage, host: str | list[str], port: int, backlog: int = 100
+) -> asyncio.Server:
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(
+        lambda: RedisProtocol(storage), host, port, backlog=backlog
+    )
+
+
+async def serve_protocol_unix(
+    storage: Storage, path: str, backlog: int = 100
+) -> asyncio.Server:
+    loop = asyncio.get_running_loop()
+    return await loop.create_unix_server(
+        lambda: RedisProtocol(storage), path, backlog=backlog
+    )
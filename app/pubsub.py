@@ -0,0 +1,167 @@
+import bisect
+import re
+from typing import Any
+
+from app.config import config
+from app.formatter import formatter
+from app.patterns import compile_glob, literal_prefix
+
+
+class PatternIndex:
+    """Pattern subscriptions grouped by their literal prefix.
+
+    A publish only tests the patterns whose prefix is a prefix of the channel,
+    so unrelated patterns ("news.*" vs "orders.*") cost a dict miss at most.
+    """
+
+    def __init__(self):
+        self.buckets: dict[str, dict[str, tuple[re.Pattern, set[Any]]]] = {}
+        self.prefix_lengths: list[int] = []
+
+    def add(self, pattern: str, subscriber: Any) -> None:
+        prefix = literal_prefix(pattern)
+        bucket = self.buckets.get(prefix)
+        if bucket is None:
+            bucket = self.buckets[prefix] = {}
+            self._add_length(len(prefix))
+        if pattern not in bucket:
+            bucket[pattern] = (compile_glob(pattern), set())
+        bucket[pattern][1].add(subscriber)
+
+    def remove(self, pattern: str, subscriber: Any) -> None:
+        prefix = literal_prefix(pattern)
+        bucket = self.buckets.get(prefix)
+        if bucket is None or pattern not in bucket:
+            return
+        subscribers = bucket[pattern][1]
+        subscribers.discard(subscriber)
+        if subscribers:
+            return
+        del bucket[pattern]
+        if not bucket:
+            del self.buckets[prefix]
+            if not any(len(other) == len(prefix) for other in self.buckets):
+                self.prefix_lengths.remove(len(prefix))
+
+    def match(self, channel: str) -> list[tuple[str, set[Any]]]:
+        """Patterns matching the channel together with their subscribers"""
+        matched = []
+        for length in self.prefix_lengths:
+            if length > len(channel):
+                break
+            bucket = self.buckets.get(channel[:length])
+            if bucket is None:
+                continue
+            for pattern, (regex, subscribers) in bucket.items():
+                if regex.fullmatch(channel):
+                    matched.append((pattern, subscribers))
+        return matched
+
+    def patterns(self) -> int:
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def _add_length(self, length: int) -> None:
+        idx = bisect.bisect_left(self.prefix_lengths, length)
+        if idx == len(self.prefix_lengths) or self.prefix_lengths[idx] != length:
+            self.prefix_lengths.insert(idx, length)
+
+
+class PubSub:
+    """Channel and pattern subscriptions, subscribers are connection writers"""
+
+    def __init__(self):
+        self.channels: dict[str, set[Any]] = {}
+        self.pattern_index = PatternIndex()
+        self.subscriber_channels: dict[Any, set[str]] = {}
+        self.subscriber_patterns: dict[Any, set[str]] = {}
+
+    def is_subscribed(self, subscriber: Any) -> bool:
+        return (
+            subscriber in self.subscriber_channels
+            or subscriber in self.subscriber_patterns
+        )
+
+    def subscription_count(self, subscriber: Any) -> int:
+        return len(self.subscriber_channels.get(subscriber, ())) + len(
+            self.subscriber_patterns.get(subscriber, ())
+        )
+
+    def subscribe(self, subscriber: Any, channel: str) -> int:
+        self.channels.setdefault(channel, set()).add(subscriber)
+        self.subscriber_channels.setdefault(subscriber, set()).add(channel)
+        return self.subscription_count(subscriber)
+
+    def unsubscribe(self, subscriber: Any, channel: str) -> int:
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.channels[channel]
+        channels = self.subscriber_channels.get(subscriber)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.subscriber_channels[subscriber]
+        return self.subscription_count(subscriber)
+
+    def psubscribe(self, subscriber: Any, pattern: str) -> int:
+        self.pattern_index.add(pattern, subscriber)
+        self.subscriber_patterns.setdefault(subscriber, set()).add(pattern)
+        return self.subscription_count(subscriber)
+
+    def punsubscribe(self, subscriber: Any, pattern: str) -> int:
+        self.pattern_index.remove(pattern, subscriber)
+        patterns = self.subscriber_patterns.get(subscriber)
+        if patterns is not None:
+            patterns.discard(pattern)
+            if not patterns:
+                del self.subscriber_patterns[subscriber]
+        return self.subscription_count(subscriber)
+
+    def remove_subscriber(self, subscriber: Any) -> None:
+        """Drop every subscription of a disconnected client"""
+        for channel in list(self.subscriber_channels.get(subscriber, ())):
+            self.unsubscribe(subscriber, channel)
+        for pattern in list(self.subscriber_patterns.get(subscriber, ())):
+            self.punsubscribe(subscriber, pattern)
+
+    def publish(self, channel: str, message: str) -> int:
+        """Deliver a message and return the number of clients that received it.
+
+        The reply is encoded once per channel (and once per matching pattern),
+        the very same bytes object is then written to every subscriber.
+        """
+        receivers = 0
+        subscribers = self.channels.get(channel)
+        if subscribers:
+            payload = formatter.format_value(["message", channel, message])
+            receivers += self._fan_out(payload, subscribers)
+
+        for pattern, pattern_subscribers in self.pattern_index.match(channel):
+            payload = formatter.format_value(["pmessage", pattern, channel, message])
+            receivers += self._fan_out(payload, pattern_subscribers)
+        return receivers
+
+    def _fan_out(self, payload: bytes, subscribers: set[Any]) -> int:
+        delivered = 0
+        slow = []
+        for subscriber in subscribers:
+            if self._output_buffer_size(subscriber) > config.pubsub_output_buffer_limit:
+                slow.append(subscriber)
+                continue
+            subscriber.write(payload)
+            delivered += 1
+        for subscriber in slow:
+            self.remove_subscriber(subscriber)
+            subscriber.close()
+        return delivered
+
+    @staticmethod
+    def _output_buffer_size(subscriber: Any) -> int:
+        transport = getattr(subscriber, "transport", None)
+        if transport is None:
+            return 0
+        return transport.get_write_buffer_size()
+
+
+pubsub = PubSub()
@@ -0,0 +1,348 @@
+import asyncio
+import datetime
+import secrets
+from typing import Any, Callable, Optional
+
+from app.config import config
+from app.formatter import formatter
+from app.functions import functions
+from app.parser import Command, parser
+from app.storage import Storage, Value, string_bytes
+from app.streams import Stream, format_stream_id
+
+
+class ReplicationBacklog:
+    """Fixed-size ring buffer with the tail of the replication stream.
+
+    Offsets are absolute positions in the stream, a replica asking for an
+    offset still held in the buffer can continue without a full resync.
+    """
+
+    def __init__(self, size: int, offset: int = 0):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.offset = offset  # offset right after the last appended byte
+        self.histlen = 0
+
+    def append(self, data: bytes) -> None:
+        length = len(data)
+        self.offset += length
+        self.histlen = min(self.histlen + length, self.size)
+        if length > self.size:
+            data = memoryview(data)[length - self.size :]
+            length = self.size
+
+        start = (self.offset - length) % self.size
+        first = min(length, self.size - start)
+        self.buffer[start : start + first] = data[:first]
+        self.buffer[: length - first] = data[first:]
+
+    def read_from(self, offset: int) -> Optional[bytes]:
+        """The stream from offset up to now, None if it is no longer held"""
+        if offset > self.offset or offset < self.offset - self.histlen:
+            return None
+        start = offset % self.size
+        end = start + self.offset - offset
+        if end <= self.size:
+            return bytes(self.buffer[start:end])
+        return bytes(self.buffer[start:]) + bytes(self.buffer[: end - self.size])
+
+
+class DiscardWriter:
+    """Writer for the master link, replies to the master's commands are dropped"""
+
+    def write(self, data: bytes) -> None:
+        pass
+
+    async def drain(self):
+        pass
+
+
+def key_commands(key: str, value: Any, now: datetime.datetime) -> list[list[Any]]:
+    """The commands that recreate a single key, empty for expired keys"""
+    match value:
+        case Value():
+            if value.expire and value.expire <= now:
+                return []
+            command: list[Any] = ["SET", key, string_bytes(value.item)]
+            if value.expire:
+                remaining = value.expire - now
+                command += ["PX", max(1, int(remaining.total_seconds() * 1000))]
+            return [command]
+        case list() if value:
+            return [["RPUSH", key, *[item.item for item in value]]]
+        case Stream():
+            return stream_commands(key, value)
+    return []
+
+
+def stream_commands(key: str, stream: Stream) -> list[list[Any]]:
+    """The entries of a stream, then its ids and consumer groups, as Redis
+    rewrites a stream in its AOF"""
+    commands: list[list[Any]] = []
+    for entry in stream:
+        fields = []
+        for field, field_value in entry.item.items():
+            if field != "id":
+                fields += [field, field_value]
+        commands.append(["XADD", key, entry.item["id"], *fields])
+    if not stream:
+        # An entry trimmed right away leaves the empty stream, XSETID fixes
+        # up its ids
+        commands.append(["XADD", key, "MAXLEN", 0, "0-1", "x", "y"])
+    commands.append(
+        [
+            "XSETID",
+            key,
+            format_stream_id(stream.last_id),
+            "ENTRIESADDED",
+            stream.entries_added,
+            "MAXDELETEDID",
+            format_stream_id(stream.max_deleted_id),
+        ]
+    )
+    for name, group in stream.groups.items():
+        commands.append(
+            ["XGROUP", "CREATE", key, name, format_stream_id(group.last_delivered)]
+        )
+        for consumer in group.consumers:
+            commands.append(["XGROUP", "CREATECONSUMER", key, name, consumer])
+        # Entries deleted while pending are dropped, XCLAIM only takes
+        # those still in the stream
+        for stream_id in group.pending_ids:
+            pending = group.pending[stream_id]
+            commands.append(
+                [
+                    "XCLAIM",
+                    key,
+                    name,
+                    pending.consumer,
+                    0,
+                    format_stream_id(stream_id),
+                    "TIME",
+                    pending.delivery_time,
+                    "RETRYCOUNT",
+                    pending.delivery_count,
+                    "FORCE",
+                    "JUSTID",
+                ]
+            )
+    return commands
+
+
+def snapshot(storage: Storage) -> bytes:
+    """Serialize the dataset as the commands that rebuild it.
+
+    Every database is included, a SELECT goes before the keys of all but
+    the first one.
+    """
+    now = datetime.datetime.now()
+    commands: list[list[Any]] = [
+        ["FUNCTION", "LOAD", "REPLACE", library.code]
+        for library in functions.libraries.values()
+    ]
+    databases = storage.databases.storages if storage.databases else {0: storage}
+    for index, db in sorted(databases.items()):
+        if index and db.data:
+            commands.append(["SELECT", index])
+        for key, value in db.data.items():
+            commands += key_commands(key, value, now)
+    return b"".join(formatter.format_command(command) for command in commands)
+
+
+class Replication:
+    """Replication state, both for the master and the replica side"""
+
+    def __init__(self):
+        self.role = "master"
+        self.replid = secrets.token_hex(20)
+        self.offset = 0
+        self.backlog: Optional[ReplicationBacklog] = None
+        self.replicas: set[Any] = set()
+        self.master_host: Optional[str] = None
+        self.master_port: Optional[int] = None
+        self.master_link_up = False
+        self._link_task: Optional[asyncio.Task] = None
+        # Database the stream is applied to, on the replicas of this master
+        self.selected_db = 0
+        # And on this replica, kept across a partial resync
+        self.master_db = 0
+
+    def propagate(self, command: Command, args: list[Any], db: int = 0) -> None:
+        """Append a write command to the replication stream.
+
+        Nothing is encoded until the first replica connects and the backlog
+        is created, a standalone server pays a single attribute test.
+        """
+        if self.backlog is None:
+            return
+        if db != self.selected_db:
+            self.selected_db = db
+            self.feed(formatter.format_command(["SELECT", db]))
+        self.feed(formatter.format_command([command.name, *args]))
+
+    def feed(self, data: bytes) -> None:
+        if self.backlog is None:
+            self.backlog = ReplicationBacklog(config.repl_backlog_size, self.offset)
+        self.backlog.append(data)
+        self.offset += len(data)
+        for replica in self.replicas:
+            replica.write(data)
+
+    def psync(self, writer: Any, replid: str, offset: int, storage: Storage) -> None:
+        """Answer a PSYNC and attach the writer as a replica"""
+        if self.backlog is None:
+            self.backlog = ReplicationBacklog(config.repl_backlog_size, self.offset)
+
+        pending = self.backlog.read_from(offset) if replid == self.replid else None
+        if pending is not None:
+            writer.write(f"+CONTINUE {self.replid}\r\n".encode("utf-8"))
+            writer.write(pending)
+        else:
+            if self.selected_db != 0:
+                # A fully synced replica starts from database 0, the others
+                # are moved there so the stream stays the same for all
+                self.selected_db = 0
+                self.feed(formatter.format_command(["SELECT", 0]))
+            payload = snapshot(storage)
+            writer.write(f"+FULLRESYNC {self.replid} {self.offset}\r\n".encode("utf-8"))
+            writer.write(b"$%d\r\n" % len(payload) + payload)
+        self.replicas.add(writer)
+
+    def remove_replica(self, writer: Any) -> None:
+        self.replicas.discard(writer)
+
+    def replicaof(
+        self,
+        host: str,
+        port: int,
+        storage: Storage,
+        processor_factory: Callable[[Any, Storage], Any],
+    ) -> None:
+        """Start following a master, the link reconnects on failures"""
+        self.stop_replication()
+        self.role = "slave"
+        self.master_host, self.master_port = host, port
+        self._link_task = asyncio.create_task(
+            self._follow_master(storage, processor_factory)
+        )
+
+    def stop_replication(self) -> None:
+        """Turn into a master (REPLICAOF NO ONE), the dataset is kept"""
+        if self._link_task is not None:
+            self._link_task.cancel()
+            self._link_task = None
+        if self.role == "slave":
+            self.replid = secrets.token_hex(20)
+        self.role = "master"
+        self.master_host = self.master_port = None
+        self.master_link_up = False
+
+    def info(self) -> str:
+        lines = [f"role:{self.role}"]
+        if self.role == "slave":
+            lines += [
+                f"master_host:{self.master_host}",
+                f"master_port:{self.master_port}",
+                f"master_link_status:{'up' if self.master_link_up else 'down'}",
+            ]
+        lines += [
+            f"connected_slaves:{len(self.replicas)}",
+            f"master_replid:{self.replid}",
+            f"master_repl_offset:{self.offset}",
+            f"repl_backlog_active:{int(self.backlog is not None)}",
+            f"repl_backlog_size:{config.repl_backlog_size}",
+        ]
+        return "# Replication\r\n" + "\r\n".join(lines) + "\r\n"
+
+    async def _follow_master(
+        self, storage: Storage, processor_factory: Callable[[Any, Storage], Any]
+    ) -> None:
+        while True:
+            try:
+                await self._sync_with_master(storage, processor_factory)
+            except (OSError, asyncio.IncompleteReadError, RuntimeError) as err:
+                print(f"Replication error: {err}")
+            self.master_link_up = False
+            await asyncio.sleep(1)
+
+    async def _sync_with_master(
+        self, storage: Storage, processor_factory: Callable[[Any, Storage], Any]
+    ) -> None:
+        reader, writer = await asyncio.open_connection(
+            self.master_host, self.master_port
+        )
+        try:
+            await self._request(reader, writer, ["PING"])
+            await self._request(
+                reader, writer, ["REPLCONF", "listening-port", config.port]
+            )
+            await self._request(reader, writer, ["REPLCONF", "capa", "psync2"])
+
+            synced = self.backlog is not None
+            writer.write(
+                formatter.format_command(
+                    [
+                        "PSYNC",
+                        self.replid if synced else "?",
+                        self.offset if synced else -1,
+                    ]
+                )
+            )
+            reply = (await reader.readline()).decode().split()
+            if reply[0] == "+FULLRESYNC":
+                await self._load_snapshot(reader, storage, processor_factory)
+                self.replid, self.offset = reply[1], int(reply[2])
+                self.backlog = ReplicationBacklog(config.repl_backlog_size, self.offset)
+            elif reply[0] != "+CONTINUE":
+                raise RuntimeError(f"Unexpected PSYNC reply {reply}")
+
+            self.master_link_up = True
+            processor = processor_factory(DiscardWriter(), storage)
+            processor.is_master_link = True
+            if reply[0] == "+FULLRESYNC":
+                self.master_db = 0
+            processor.storage = processor.databases.get(self.master_db)
+            buffer = bytearray()
+            while data := await reader.read(65536):
+                buffer += data
+                commands, consumed = parser.parse_commands(bytes(buffer))
+                for command in commands:
+                    await processor.process_command(command)
+                self.master_db = processor.storage.index
+                # The raw stream is proxied so sub-replicas see the same offsets
+                self.feed(bytes(buffer[:consumed]))
+                del buffer[:consumed]
+        finally:
+            writer.close()
+
+    async def _load_snapshot(
+        self,
+        reader: asyncio.StreamReader,
+        storage: Storage,
+        processor_factory: Callable[[Any, Storage], Any],
+    ) -> None:
+        header = await reader.readline()
+        payload = await reader.readexactly(int(header[1:]))
+        if storage.databases is not None:
+            storage.databases.flush(asynchronous=True)
+        else:
+            storage.flush(asynchronous=True)
+        functions.flush()
+        processor = processor_factory(DiscardWriter(), storage)
+        processor.is_master_link = True
+        commands, _ = parser.parse_commands(payload)
+        for command in commands:
+            await processor.process_command(command)
+
+    @staticmethod
+    async def _request(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter, args: list[Any]
+    ) -> None:
+        writer.write(formatter.format_command(args))
+        reply = await reader.readline()
+        if reply.startswith(b"-"):
+            raise RuntimeError(f"Master replied {reply.decode().strip()}")
+
+
+replication = Replication()
@@ -1,9 +1,47 @@
 import asyncio
-from collections import deque
+import bisect
+import heapq
+import re
+import time
 from dataclasses import dataclass
 import datetime
+from decimal import Context, Decimal, InvalidOperation
 from enum import Enum
-from typing import Any, Optional
+from typing import Any, Callable, Optional
+
+from app.bitmaps import (
+    BitfieldOperation,
+    bit_count,
+    bit_operation,
+    bit_position,
+    byte_range,
+    get_bits,
+    run_bitfield,
+    set_bits,
+)
+from app.config import config
+from app.hotkeys import AccessTracker
+from app.hyperloglog import HyperLogLog, union_count
+from app.lazyfree import lazyfree
+from app.notifications import (
+    NOTIFY_EXPIRED,
+    NOTIFY_GENERIC,
+    NOTIFY_LIST,
+    NOTIFY_STREAM,
+    NOTIFY_STRING,
+    notify_keyspace_event,
+)
+from app.streams import (
+    BusyGroupError,
+    ConsumerGroup,
+    NoGroupError,
+    Stream,
+    StreamId,
+    format_stream_id,
+    parse_stream_id,
+)
+from app.tiering import ColdTier, ColdValue
+from app.tracking import tracking
 
 
 class ValueType(Enum):
@@ -15,6 +53,7 @@ class ValueType(Enum):
     HASH = 5
     STREAM = 6
     VECTORSET = 7
+    HYPERLOGLOG = 8
 
 
 @dataclass
@@ -23,12 +62,297 @@ class Value:
     expire: Optional[datetime.datetime] = None
 
 
-class Storage:
+class WrongTypeError(RuntimeError):
+    prefix = "WRONGTYPE"
+
     def __init__(self):
-        self.data: dict[Any, Any] = {}
+        super().__init__("Operation against a key holding the wrong kind of value")
+
+
+class InvalidHyperLogLogError(WrongTypeError):
+    def __init__(self):
+        RuntimeError.__init__(self, "Key is not a valid HyperLogLog string value.")
+
+
+INT64_MIN, INT64_MAX = -(2**63), 2**63 - 1
+
+# Counters below this value share their int objects instead of allocating
+SHARED_INTEGERS = tuple(range(10000))
+
+
+def encode_string(text: str) -> int | str:
+    """Store text that is the canonical form of a 64-bit integer as an int"""
+    if not text or len(text) > 20:
+        return text
+    digits = text[1:] if text[0] == "-" else text
+    if (
+        not digits.isascii()
+        or not digits.isdigit()
+        or (digits[0] == "0" and text != "0")
+    ):
+        return text
+    number = int(text)
+    if 0 <= number < len(SHARED_INTEGERS):
+        return SHARED_INTEGERS[number]
+    if INT64_MIN <= number <= INT64_MAX:
+        return number
+    return text
+
+
+# INCRBYFLOAT results keep 17 significant digits, as Redis prints them
+FLOAT_CONTEXT = Context(prec=17)
+
+
+def format_float(number: Decimal) -> str:
+    """Fixed-point text of an INCRBYFLOAT result, without trailing zeros"""
+    text = format(FLOAT_CONTEXT.plus(number), "f")
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return text
+
+
+def string_bytes(item: Any) -> bytes | bytearray | memoryview:
+    """The bytes of a string value, whatever its encoding"""
+    match item:
+        case bytearray() | bytes():
+            return item
+        case ColdValue():
+            return item.view()
+        case HyperLogLog():
+            return item.dump()
+        case bool():
+            return str(item).encode("utf-8")
+        case int():
+            return b"%d" % item
+        case float():
+            return repr(item).encode("utf-8")
+    return str(item).encode("utf-8", "surrogateescape")
+
+
+# Longest string Redis keeps in a single allocation with its object header
+EMBSTR_MAX_LENGTH = 44
+# Lists up to this many elements are a single listpack in Redis
+LISTPACK_MAX_ENTRIES = 128
+
+
+def object_encoding(value: Any) -> str:
+    """The encoding Redis would report for a value, for OBJECT ENCODING"""
+    match value:
+        case Stream():
+            return "stream"
+        case list():
+            return "listpack" if len(value) <= LISTPACK_MAX_ENTRIES else "quicklist"
+        case set():
+            return "hashtable"
+    item = value.item
+    if isinstance(item, int) and not isinstance(item, bool):
+        return "int"
+    if isinstance(item, (bytearray, ColdValue, HyperLogLog)):
+        return "raw"
+    return "embstr" if len(string_bytes(item)) <= EMBSTR_MAX_LENGTH else "raw"
+
+
+class Keyspace(dict):
+    """The keyspace dict, keeping an insertion sequence for SCAN cursors.
+
+    Every new key gets the next sequence number and a cursor is the last
+    sequence number returned. Keys that exist for the whole scan are reported
+    exactly once, whatever is inserted or deleted between the calls.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.sequences: dict[Any, int] = {}
+        self.keys_by_sequence: dict[int, Any] = {}
+        # Ascending sequence numbers, deleted ones are dropped lazily
+        self.order: list[int] = []
+        self.next_sequence = 1
+        # Keys holding a value with an expiry, counted for INFO keyspace
+        self.volatile: set[Any] = set()
+        # (expire, key) min-heap for the active expire cycle, entries whose
+        # key was deleted or got another expiry are skipped when popped
+        self.expiries: list[tuple[datetime.datetime, Any]] = []
+        # Monotonic time of the last access per key, while access tracking is on
+        self.access_times: dict[Any, float] = {}
+        # Cluster slot -> its keys in insertion order, kept once keys_in_slot
+        # was first called, so servers outside a cluster never hash keys
+        self.slot_of: Optional[Callable[[Any], int]] = None
+        self.slot_keys: dict[int, dict[Any, None]] = {}
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        if key not in self.sequences:
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            self.sequences[key] = sequence
+            self.keys_by_sequence[sequence] = key
+            self.order.append(sequence)
+            if self.slot_of is not None:
+                self.slot_keys.setdefault(self.slot_of(key), {})[key] = None
+        dict.__setitem__(self, key, value)
+        self.update_expire(key, value)
+
+    def update_expire(self, key: Any, value: Any) -> None:
+        """Count the key as volatile or not, after its expiry was changed in place"""
+        if isinstance(value, Value) and value.expire:
+            self.volatile.add(key)
+            heapq.heappush(self.expiries, (value.expire, key))
+            if len(self.expiries) > 2 * len(self.volatile) + 1024:
+                self._rebuild_expiries()
+        elif self.volatile:
+            self.volatile.discard(key)
+
+    def __delitem__(self, key: Any) -> None:
+        dict.__delitem__(self, key)
+        self._forget(key)
+
+    def pop(self, key: Any, *default: Any) -> Any:
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = dict.pop(self, key)
+        self._forget(key)
+        return value
+
+    def setdefault(self, key: Any, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def clear(self) -> None:
+        dict.clear(self)
+        self.sequences.clear()
+        self.keys_by_sequence.clear()
+        self.order.clear()
+        self.volatile.clear()
+        self.expiries.clear()
+        self.access_times.clear()
+        self.slot_keys.clear()
+
+    def keys_in_slot(self, slot: int, slot_of: Callable[[Any], int]) -> dict[Any, None]:
+        """The keys hashing to slot, the index is built on the first call"""
+        if self.slot_of is None:
+            self.slot_of = slot_of
+            for key in self:
+                self.slot_keys.setdefault(slot_of(key), {})[key] = None
+        return self.slot_keys.get(slot, {})
+
+    def scan(self, cursor: int, count: int) -> tuple[int, list[Any]]:
+        """Up to count keys added after the cursor, with the next cursor (0 at the end)"""
+        idx = bisect.bisect_right(self.order, cursor)
+        keys: list[Any] = []
+        # Deleted entries count too, so a page never walks an unbounded run
+        budget = count * 10
+        while idx < len(self.order) and len(keys) < count and budget > 0:
+            key = self.keys_by_sequence.get(self.order[idx])
+            idx += 1
+            budget -= 1
+            if key is not None:
+                keys.append(key)
+        if idx >= len(self.order):
+            return 0, keys
+        return self.order[idx - 1], keys
+
+    def pop_expired(self, now: datetime.datetime) -> Optional[Any]:
+        """The next key whose expiry passed, None once there is none left"""
+        expiries = self.expiries
+        while expiries and expiries[0][0] <= now:
+            expire, key = heapq.heappop(expiries)
+            value = dict.get(self, key)
+            if isinstance(value, Value) and value.expire == expire:
+                return key
+        return None
+
+    def _rebuild_expiries(self) -> None:
+        self.expiries = [
+            (dict.__getitem__(self, key).expire, key) for key in self.volatile
+        ]
+        heapq.heapify(self.expiries)
+
+    def _forget(self, key: Any) -> None:
+        sequence = self.sequences.pop(key)
+        del self.keys_by_sequence[sequence]
+        self.volatile.discard(key)
+        if self.access_times:
+            self.access_times.pop(key, None)
+        if self.slot_of is not None:
+            slot = self.slot_of(key)
+            keys = self.slot_keys[slot]
+            del keys[key]
+            if not keys:
+                del self.slot_keys[slot]
+        if len(self.order) > 2 * len(self.sequences) + 1024:
+            self.order = [seq for seq in self.order if seq in self.keys_by_sequence]
+
+
+class Storage:
+    def __init__(self, index: int = 0):
+        self.data: Keyspace = Keyspace()
+        # Position among the logical databases, and the Databases holding it
+        self.index = index
+        self.databases: Optional["Databases"] = None
         self.conditions: dict[Any, asyncio.Condition] = {}
+        # Blocked XREADGROUP calls, by the stream keys they wait on
+        self.stream_waiters: dict[str, set[asyncio.Future]] = {}
+        # Clock shared by the XADDs of one event loop pass, see stream_clock
+        self._clock_ms: Optional[int] = None
+        # On-disk tier for cold strings, see enable_tiering
+        self.tier: Optional[ColdTier] = None
+        self.recently_accessed: set[str] = set()
+        self._sweep_cursor = 0
+        # Access frequencies and idle times, see enable_access_tracking
+        self.tracker: Optional[AccessTracker] = None
+
+    def enable_tiering(self, directory: str) -> ColdTier:
+        self.tier = ColdTier(directory, config.tiered_segment_size)
+        return self.tier
+
+    def enable_access_tracking(self) -> AccessTracker:
+        self.tracker = AccessTracker()
+        return self.tracker
+
+    def touch(self, key: str) -> None:
+        """Count an access to an existing key, only called while tracking is on"""
+        assert self.tracker is not None
+        self.tracker.touch(key)
+        self.data.access_times[key] = time.monotonic()
+
+    def idle_time(self, key: str) -> Optional[int]:
+        """Seconds since the key was last accessed, None when not tracked"""
+        if self.tracker is None:
+            return None
+        accessed = self.data.access_times.get(key)
+        if accessed is None:
+            return None
+        return int(time.monotonic() - accessed)
+
+    def demote_cold(self, count: int) -> int:
+        """Move large strings not read since the last pass to the disk tier.
+
+        Walks the keyspace a page at a time with the SCAN cursor, so a step
+        costs the same however large the keyspace is. Returns how many
+        values were moved.
+        """
+        if self.tier is None:
+            return 0
+        self._sweep_cursor, keys = self.data.scan(self._sweep_cursor, count)
+        moved = 0
+        for key in keys:
+            value = dict.get(self.data, key)
+            if key in self.recently_accessed or not isinstance(value, Value):
+                continue
+            if not isinstance(value.item, (str, bytes, bytearray)):
+                continue
+            data = string_bytes(value.item)
+            if len(data) < config.tiered_value_min_size:
+                continue
+            value.item = self.tier.store(data)
+            moved += 1
+        if self._sweep_cursor == 0:
+            self.recently_accessed.clear()
+        return moved
 
     def get(self, key: str) -> Any:
+        if self.tier is not None:
+            self.recently_accessed.add(key)
         if (
             key in self.data
             and not isinstance(
@@ -37,8 +361,332 @@ class Storage:
             and self.data[key].expire
             and self.data[key].expire <= datetime.datetime.now()
         ):
+            self._expire(key)
+            return None
+        value = self.data.get(key)
+        # Misses are not counted, they would leave an access time behind
+        if self.tracker is not None and value is not None:
+            self.touch(key)
+        return value
+
+    def get_string(self, key: str) -> Optional[Value]:
+        """The live string value of a key, raises for other types"""
+        value = self.data.get(key)
+        if value is None:
+            return None
+        if not isinstance(value, Value):
+            raise WrongTypeError()
+        if value.expire and value.expire <= datetime.datetime.now():
+            self._expire(key)
             return None
-        return self.data.get(key)
+        if self.tracker is not None:
+            self.touch(key)
+        if self.tier is not None:
+            self.recently_accessed.add(key)
+            if isinstance(value.item, ColdValue):
+                # Modified values come back to memory
+                value.item = bytes(value.item.view())
+        return value
+
+    def incr_by(self, key: str, increment: int) -> int:
+        value = self.get_string(key)
+        current = 0 if value is None else self._as_integer(value.item)
+        result = current + increment
+        if not INT64_MIN <= result <= INT64_MAX:
+            raise ValueError("increment or decrement would overflow")
+        if 0 <= result < len(SHARED_INTEGERS):
+            result = SHARED_INTEGERS[result]
+        if value is None:
+            self.data[key] = Value(result)
+        else:
+            value.item = result
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "incrby", key, self.index)
+        return result
+
+    def incr_by_float(self, key: str, increment: Decimal) -> str:
+        """INCRBYFLOAT, returns the result as stored and replicated.
+
+        The sum is taken in decimal, so 0.1 + 0.2 gives 0.3 as with the long
+        doubles of Redis, not the 0.30000000000000004 of binary floats.
+        """
+        value = self.get_string(key)
+        current = Decimal(0)
+        if value is not None:
+            try:
+                current = Decimal(bytes(string_bytes(value.item)).decode("ascii"))
+            except (ValueError, InvalidOperation):
+                raise ValueError("value is not a valid float")
+            if not current.is_finite():
+                raise ValueError("value is not a valid float")
+        result = current + increment
+        if not result.is_finite():
+            raise ValueError("increment would produce NaN or Infinity")
+        text = format_float(result)
+        if value is None:
+            self.data[key] = Value(encode_string(text))
+        else:
+            value.item = encode_string(text)
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "incrbyfloat", key, self.index)
+        return text
+
+    def append(self, key: str, text: str) -> int:
+        """Append in place, the value becomes a bytearray so appends are amortized O(1)"""
+        value = self.get_string(key)
+        if value is None:
+            item = bytearray(text.encode("utf-8", "surrogateescape"))
+            self.data[key] = Value(item)
+        else:
+            if not isinstance(value.item, bytearray):
+                value.item = bytearray(string_bytes(value.item))
+            item = value.item
+            item += text.encode("utf-8", "surrogateescape")
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "append", key, self.index)
+        return len(item)
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        value = self.get_string(key)
+        if value is None:
+            return b""
+        item = string_bytes(value.item)
+        length = len(item)
+        start = max(start + length if start < 0 else start, 0)
+        end = min(end + length if end < 0 else end, length - 1)
+        if start > end:
+            return b""
+        return bytes(item[start : end + 1])
+
+    def set_range(self, key: str, offset: int, text: str) -> int:
+        if offset < 0:
+            raise ValueError("offset is out of range")
+        value = self.get_string(key)
+        data = text.encode("utf-8", "surrogateescape")
+        if value is None:
+            if not data:
+                return 0
+            value = Value(bytearray())
+            self.data[key] = value
+        elif not isinstance(value.item, bytearray):
+            value.item = bytearray(string_bytes(value.item))
+        item = value.item
+        if len(item) < offset:
+            item += bytes(offset - len(item))
+        item[offset : offset + len(data)] = data
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "setrange", key, self.index)
+        return len(item)
+
+    def strlen(self, key: str) -> int:
+        value = self.get_string(key)
+        return 0 if value is None else len(string_bytes(value.item))
+
+    def get_bitmap(self, key: str) -> bytearray:
+        """The bytes of a string as a bytearray to change in place, created if missing"""
+        value = self.get_string(key)
+        if value is None:
+            value = self.data[key] = Value(bytearray())
+        elif not isinstance(value.item, bytearray):
+            value.item = bytearray(string_bytes(value.item))
+        return value.item
+
+    def _string_data(self, key: str) -> bytes | bytearray | memoryview:
+        """The bytes of a string for reading, empty for a missing key"""
+        value = self.get_string(key)
+        return b"" if value is None else string_bytes(value.item)
+
+    def setbit(self, key: str, offset: int, bit: int) -> int:
+        """SETBIT, returns the bit that was there before"""
+        data = self.get_bitmap(key)
+        if len(data) <= offset >> 3:
+            data += bytes((offset >> 3) + 1 - len(data))
+        previous = get_bits(data, offset, 1)
+        set_bits(data, offset, 1, bit)
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "setbit", key, self.index)
+        return previous
+
+    def getbit(self, key: str, offset: int) -> int:
+        return get_bits(self._string_data(key), offset, 1)
+
+    def bitcount(
+        self,
+        key: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        bit_unit: bool = False,
+    ) -> int:
+        """BITCOUNT, start and end count bytes, or bits with bit_unit"""
+        data = self._string_data(key)
+        if start is None or end is None:
+            return bit_count(data, 0, len(data) << 3)
+        scale = 1 if bit_unit else 8
+        bounds = byte_range(len(data) * 8 // scale, start, end)
+        if bounds is None:
+            return 0
+        return bit_count(data, bounds[0] * scale, bounds[1] * scale)
+
+    def bitpos(
+        self,
+        key: str,
+        bit: int,
+        start: int = 0,
+        end: Optional[int] = None,
+        bit_unit: bool = False,
+    ) -> int:
+        """BITPOS, start and end count bytes, or bits with bit_unit"""
+        value = self.get_string(key)
+        if value is None:
+            return 0 if bit == 0 else -1
+        data = string_bytes(value.item)
+        scale = 1 if bit_unit else 8
+        length = len(data) * 8 // scale
+        bounds = byte_range(length, start, length - 1 if end is None else end)
+        if bounds is None:
+            return -1
+        position = bit_position(data, bit, bounds[0] * scale, bounds[1] * scale)
+        if position == -1 and bit == 0 and end is None:
+            # Looking for a clear bit without an end, the string is padded
+            # with zeros on the right
+            return bounds[1] * scale
+        return position
+
+    def bitop(self, operation: str, destination: str, keys: list[str]) -> int:
+        """BITOP, stores the result and returns its length"""
+        result = bit_operation(operation, [self._string_data(key) for key in keys])
+        if not result:
+            self.delete(destination)
+            return 0
+        previous = self.data.get(destination)
+        self.data[destination] = Value(result)
+        if previous is not None and config.lazyfree_lazy_server_del:
+            lazyfree.free(previous)
+        tracking.invalidate(destination)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "set", destination, self.index)
+        return len(result)
+
+    def bitfield(
+        self, key: str, operations: list[BitfieldOperation]
+    ) -> list[Optional[int]]:
+        """BITFIELD, the string grows to fit the fields that are written"""
+        writes = [operation for operation in operations if operation.name != "GET"]
+        if not writes:
+            return run_bitfield(self._string_data(key), operations)
+        data = self.get_bitmap(key)
+        needed = (max(operation.end for operation in writes) + 7) >> 3
+        if len(data) < needed:
+            data += bytes(needed - len(data))
+        results = run_bitfield(data, operations)
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "setbit", key, self.index)
+        return results
+
+    def get_hyperloglog(self, key: str) -> Optional[HyperLogLog]:
+        """The live HyperLogLog of a key, its string form is parsed on first use"""
+        value = self.get_string(key)
+        if value is None:
+            return None
+        if not isinstance(value.item, HyperLogLog):
+            try:
+                value.item = HyperLogLog.load(bytes(string_bytes(value.item)))
+            except ValueError:
+                raise InvalidHyperLogLogError()
+        return value.item
+
+    def pfadd(self, key: str, members: list[str]) -> int:
+        """PFADD, 1 when the key was created or a register changed"""
+        hll = self.get_hyperloglog(key)
+        created = hll is None
+        if hll is None:
+            hll = HyperLogLog()
+            self.data[key] = Value(hll)
+        if not hll.add(members) and not created:
+            return 0
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "pfadd", key, self.index)
+        return 1
+
+    def pfcount(self, keys: list[str]) -> int:
+        """PFCOUNT, the cached estimate of one key or that of a union"""
+        if len(keys) == 1:
+            hll = self.get_hyperloglog(keys[0])
+            return 0 if hll is None else hll.count()
+        hlls = [self.get_hyperloglog(key) for key in keys]
+        return union_count([hll for hll in hlls if hll is not None])
+
+    def pfmerge(self, destination: str, sources: list[str]) -> None:
+        target = self.get_hyperloglog(destination)
+        others = [self.get_hyperloglog(key) for key in sources if key != destination]
+        if target is None:
+            target = HyperLogLog()
+            self.data[destination] = Value(target)
+        target.merge([hll for hll in others if hll is not None])
+        tracking.invalidate(destination)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "pfadd", destination, self.index)
+
+    @staticmethod
+    def _as_integer(item: Any) -> int:
+        if isinstance(item, int):
+            return item
+        encoded = encode_string(bytes(string_bytes(item)).decode("utf-8", "replace"))
+        if not isinstance(encoded, int):
+            raise ValueError("value is not an integer or out of range")
+        return encoded
+
+    def mget(self, keys: list[str]) -> list[Optional[Value]]:
+        """String values for many keys, with a single clock read for expiry"""
+        now = datetime.datetime.now()
+        values: list[Optional[Value]] = [None] * len(keys)
+        data = self.data
+        if self.tier is not None:
+            self.recently_accessed.update(keys)
+        for idx, key in enumerate(keys):
+            value = data.get(key)
+            if isinstance(value, Value) and not (value.expire and value.expire <= now):
+                values[idx] = value
+        return values
+
+    async def mset(
+        self, items: list[tuple[str, Value]], only_new: bool = False
+    ) -> bool:
+        """Set many keys at once, with only_new nothing is set if any key exists"""
+        data = self.data
+        if only_new:
+            now = datetime.datetime.now()
+            for key, _ in items:
+                value = data.get(key)
+                if value is not None and not (
+                    isinstance(value, Value) and value.expire and value.expire <= now
+                ):
+                    return False
+
+        lazy = config.lazyfree_lazy_server_del
+        for key, value in items:
+            previous = data.get(key)
+            data[key] = value
+            if previous is not None and lazy:
+                lazyfree.free(previous)
+            tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            for key, _ in items:
+                notify_keyspace_event(NOTIFY_STRING, "set", key, self.index)
+
+        if self.conditions:
+            for key, _ in items:
+                if key in self.conditions:
+                    async with self.conditions[key]:
+                        self.conditions[key].notify_all()
+        return True
 
     async def get_blocking(self, key: str, timeout=None):
         if key in self.data:
@@ -54,100 +702,365 @@ class Storage:
             del self.conditions[key]  # Is this necessary?
             return self.data.get(key)
 
-    async def set(self, key: str, value: Value) -> None:
-        self.data[key] = value
+    async def set(
+        self,
+        key: str,
+        value: Value,
+        only_new: bool = False,
+        only_existing: bool = False,
+        keep_ttl: bool = False,
+        get: bool = False,
+    ) -> tuple[bool, Any]:
+        """SET with its NX / XX / KEEPTTL / GET options, the key is looked up once.
+
+        Returns whether the value was stored and, with get, the previous item.
+        """
+        previous = self.data.get(key)
+        live = previous
+        if isinstance(previous, Value) and previous.expire:
+            if previous.expire <= datetime.datetime.now():
+                live = None
+        if get and live is not None and not isinstance(live, Value):
+            raise WrongTypeError()
+        old_item = live.item if get and live is not None else None
+
+        if (only_new and live is not None) or (only_existing and live is None):
+            return False, old_item
+        if self.tracker is not None:
+            self.touch(key)
+
+        if isinstance(previous, Value):
+            # Overwriting a string reuses its entry, no second dict operation
+            previous.item = value.item
+            if not keep_ttl or live is None:
+                previous.expire = value.expire
+                self.data.update_expire(key, previous)
+        else:
+            self.data[key] = value
+            if previous is not None and config.lazyfree_lazy_server_del:
+                lazyfree.free(previous)
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STRING:
+            notify_keyspace_event(NOTIFY_STRING, "set", key, self.index)
 
         if key in self.conditions:
             async with self.conditions[key]:
                 self.conditions[key].notify_all()
+        return True, old_item
 
-    def _autogenerate_and_set_stream_id(self, key: str, value: Value) -> Optional[str]:
-        rec_id = value.item["id"]
-        if rec_id == "*":
-            # This branch is for full id generation
-            auto_timestmp = int(datetime.datetime.now(datetime.UTC).timestamp() * 1000)
-            auto_version = 0
-            value.item["id"] = f"{auto_timestmp}-{auto_version}"
-
-            if key not in self.data:
-                # new autogenerated record
-                self.data[key] = deque([value])
-            else:
-                # some records already exist, define the id based on the last timestamp and the version
-                last_timestmp, last_version = [
-                    int(x) for x in self.data[key][-1].item["id"].split("-")
-                ]
-                if auto_timestmp == last_timestmp:
-                    value.item["id"] = f"{auto_timestmp}-{last_version + 1}"
-                else:
-                    value.item["id"] = f"{auto_timestmp}-{auto_version}"
-                self.data[key].append(value)
-            return value.item["id"]
+    def scan(
+        self,
+        cursor: int,
+        count: int = 10,
+        pattern: Optional[re.Pattern] = None,
+        value_type: Optional[ValueType] = None,
+    ) -> tuple[int, list[str]]:
+        """One SCAN page, MATCH and TYPE filter the keys of the page"""
+        next_cursor, keys = self.data.scan(cursor, count)
+        now = datetime.datetime.now()
+        matched = []
+        for key in keys:
+            value = self.data[key]
+            if isinstance(value, Value) and value.expire and value.expire <= now:
+                continue
+            if pattern is not None and not pattern.fullmatch(key):
+                continue
+            if value_type is not None and self.get_type(key) != value_type:
+                continue
+            matched.append(key)
+        return next_cursor, matched
+
+    def delete(self, key: str) -> bool:
+        if config.lazyfree_lazy_user_del:
+            return self.unlink(key)
+        if self._expire_if_needed(key) or self.data.pop(key, None) is None:
+            return False
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_GENERIC:
+            notify_keyspace_event(NOTIFY_GENERIC, "del", key, self.index)
+        return True
+
+    def unlink(self, key: str) -> bool:
+        """Remove the key now, a large value is released in the background"""
+        if self._expire_if_needed(key):
+            return False
+        value = self.data.pop(key, None)
+        if value is None:
+            return False
+        lazyfree.free(value)
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_GENERIC:
+            notify_keyspace_event(NOTIFY_GENERIC, "del", key, self.index)
+        return True
+
+    def expire_keys(self, limit: int) -> int:
+        """Remove up to limit keys whose expiry passed, a step of active expiry"""
+        now = datetime.datetime.now()
+        expired = 0
+        while expired < limit:
+            key = self.data.pop_expired(now)
+            if key is None:
+                break
+            self._expire(key)
+            expired += 1
+        return expired
+
+    def _expire_if_needed(self, key: str) -> bool:
+        """Expire the key if its time passed, it then no longer counts as one"""
+        value = self.data.get(key)
+        if (
+            isinstance(value, Value)
+            and value.expire
+            and value.expire <= datetime.datetime.now()
+        ):
+            self._expire(key)
+            return True
+        return False
+
+    def _expire(self, key: str) -> None:
+        self.data.pop(key)
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_EXPIRED:
+            notify_keyspace_event(NOTIFY_EXPIRED, "expired", key, self.index)
+
+    def flush(self, asynchronous: bool = False) -> None:
+        if asynchronous:
+            previous, self.data = self.data, Keyspace()
+            lazyfree.free(previous)
         else:
-            # This branch is for partial id generation
-            time_versioned = rec_id.split("-")
-            if time_versioned[1] == "*" and key not in self.data:
-                # The version is autogenerated for a new record
-                value.item["id"] = f"{time_versioned[0]}-1"
-
-                self.data[key] = deque([value])
-                return value.item["id"]
-            elif time_versioned[1] == "*" and key in self.data:
-                # some records already exist, define the id based on the last timestamp and the version
-                cur_timestmp = int(time_versioned[0])
-                last_timestmp, last_version = [
-                    int(x) for x in self.data[key][-1].item["id"].split("-")
-                ]
-                if cur_timestmp == last_timestmp:
-                    # same timestamps in the ids
-                    value.item["id"] = f"{time_versioned[0]}-{last_version + 1}"
-                    self.data[key].append(value)
-                    return value.item["id"]
-                elif cur_timestmp < last_timestmp:
-                    raise ValueError(
-                        "The ID specified in XADD is equal or smaller than the target stream top item"
-                    )
-                else:
-                    # different timestamps
-                    value.item["id"] = f"{cur_timestmp}-0"
-                    self.data[key].append(value)
-                    return value.item["id"]
+            self.data.clear()
+        tracking.invalidate_all()
+
+    def set_stream(
+        self,
+        key: str,
+        value: Value,
+        nomkstream: bool = False,
+        trim: Optional[dict[str, Any]] = None,
+    ) -> Optional[str]:
+        """XADD, returns the id given to the entry.
+
+        With nomkstream nothing is added to a missing key and None is
+        returned. trim holds the keyword arguments of Stream.trim, applied
+        once the entry is in.
+        """
+        stream = self.get_stream(key)
+        if stream is None and nomkstream:
             return None
+        last_id = (
+            stream.last_id if stream is not None and stream.entries_added else None
+        )
+        stream_id = self._next_stream_id(value.item["id"], last_id)
+        value.item["id"] = format_stream_id(stream_id)
+        if stream is None:
+            stream = self.data[key] = Stream()
+        stream.add(value, stream_id)
+        trimmed = stream.trim(**trim) if trim else 0
+        tracking.invalidate(key)
+        self.wake_stream_waiters(key)
+        if config.notify_keyspace_events & NOTIFY_STREAM:
+            notify_keyspace_event(NOTIFY_STREAM, "xadd", key, self.index)
+            if trimmed:
+                notify_keyspace_event(NOTIFY_STREAM, "xtrim", key, self.index)
+        return value.item["id"]
 
-    def _set_stream_id(self, key: str, value: Value) -> str:
-        time_versioned = value.item["id"].split("-")
-        timestmp, version = [int(x) for x in time_versioned]
-        if timestmp < 0 or version < 1:
-            raise ValueError("The ID specified in XADD must be greater than 0-0")
+    def add_stream_entries(self, key: str, values: list[Value]) -> list[Any]:
+        """XADD for a run of pipelined entries to one stream.
 
-        if key not in self.data:
-            self.data[key] = deque([value])
-            return value.item["id"]
+        Ids are assigned one after the other from the cached last id, the
+        accepted entries are then appended together and blocked readers
+        are woken up once. Returns, per value, its id or the error to reply.
+        """
+        stream = self.get_stream(key)
+        last_id = (
+            stream.last_id if stream is not None and stream.entries_added else None
+        )
+        results: list[Any] = []
+        added = []
+        for value in values:
+            try:
+                last_id = self._next_stream_id(value.item["id"], last_id)
+            except ValueError as err:
+                results.append(err)
+                continue
+            value.item["id"] = format_stream_id(last_id)
+            results.append(value.item["id"])
+            added.append(value)
+        if added:
+            assert last_id is not None
+            if stream is None:
+                stream = self.data[key] = Stream()
+            stream.add_many(added, last_id)
+            tracking.invalidate(key)
+            self.wake_stream_waiters(key)
+            if config.notify_keyspace_events & NOTIFY_STREAM:
+                for _ in added:
+                    notify_keyspace_event(NOTIFY_STREAM, "xadd", key, self.index)
+        return results
 
-        last_timestmp, last_version = [
-            int(x) for x in self.data[key][-1].item["id"].split("-")
-        ]
-        if timestmp < last_timestmp or (
-            timestmp == last_timestmp and version <= last_version
-        ):
+    def stream_clock(self) -> int:
+        """Milliseconds for XADD *, read once per pass of the event loop.
+
+        The commands parsed from one read all run within a single pass, so a
+        pipeline of XADDs shares one clock reading.
+        """
+        if self._clock_ms is None:
+            clock = int(datetime.datetime.now(datetime.UTC).timestamp() * 1000)
+            try:
+                asyncio.get_running_loop().call_soon(self._reset_clock)
+            except RuntimeError:
+                # Without a loop there is no pass to share the reading with
+                return clock
+            self._clock_ms = clock
+        return self._clock_ms
+
+    def _reset_clock(self) -> None:
+        self._clock_ms = None
+
+    def _next_stream_id(self, rec_id: str, last_id: Optional[StreamId]) -> StreamId:
+        """The id an XADD entry gets, rec_id being *, ms-* or ms-seq.
+
+        last_id is the last one the stream generated, None for a stream
+        nothing was ever added to. It outlives the entry itself when that
+        is deleted or trimmed.
+        """
+        if rec_id == "*":
+            auto_timestmp = self.stream_clock()
+            if last_id is not None and auto_timestmp <= last_id[0]:
+                # Same millisecond, or the clock went backwards
+                return last_id[0], last_id[1] + 1
+            return auto_timestmp, 0
+
+        # When the format "*", "0-*" or "3-1" is violated we throw and exception
+        timestmp, separator, version = rec_id.partition("-")
+        if not separator or "-" in version:
+            raise ValueError("Invalid stream id")
+        if version == "*":
+            stream_id = int(timestmp), 1 if last_id is None else 0
+            if last_id is not None and stream_id[0] == last_id[0]:
+                stream_id = last_id[0], last_id[1] + 1
+        else:
+            stream_id = int(timestmp), int(version)
+            if stream_id <= (0, 0) or stream_id[0] < 0:
+                raise ValueError("The ID specified in XADD must be greater than 0-0")
+        if last_id is not None and stream_id <= last_id:
             raise ValueError(
                 "The ID specified in XADD is equal or smaller than the target stream top item"
             )
-        self.data[key].append(value)
-        return value.item["id"]
+        return stream_id
 
-    def set_stream(self, key: str, value: Value) -> str:
-        # TODO keep content not in dict, but in dataclass
-        rec_id = value.item["id"]
-        # When the format "*", "0-*" or "3-1" is violated we throw and exception
-        if rec_id != "*" and len(rec_id.split("-")) != 2:
-            raise ValueError("Invalid stream id")
+    def get_stream(self, key: str) -> Optional[Stream]:
+        value = self.data.get(key)
+        if value is None:
+            return None
+        if not isinstance(value, Stream):
+            raise WrongTypeError()
+        return value
+
+    def trim_stream(self, key: str, **options: Any) -> int:
+        """XTRIM, options are those of Stream.trim"""
+        stream = self.get_stream(key)
+        if stream is None:
+            return 0
+        trimmed = stream.trim(**options)
+        if trimmed:
+            tracking.invalidate(key)
+            if config.notify_keyspace_events & NOTIFY_STREAM:
+                notify_keyspace_event(NOTIFY_STREAM, "xtrim", key, self.index)
+        return trimmed
+
+    def delete_stream_entries(self, key: str, ids: list[StreamId]) -> int:
+        stream = self.get_stream(key)
+        if stream is None:
+            return 0
+        deleted = stream.delete(ids)
+        if deleted:
+            tracking.invalidate(key)
+            if config.notify_keyspace_events & NOTIFY_STREAM:
+                notify_keyspace_event(NOTIFY_STREAM, "xdel", key, self.index)
+        return deleted
+
+    def set_stream_id(
+        self,
+        key: str,
+        last_id: StreamId,
+        entries_added: Optional[int] = None,
+        max_deleted_id: Optional[StreamId] = None,
+    ) -> None:
+        """XSETID, the last id can not go below that of the last entry"""
+        stream = self.get_stream(key)
+        if stream is None:
+            raise ValueError("no such key")
+        last = stream.last()
+        if last is not None and last_id < last[0]:
+            raise ValueError(
+                "The ID specified in XSETID is smaller than the target stream top item"
+            )
+        if entries_added is not None and entries_added < len(stream):
+            raise ValueError(
+                "The entries_added specified in XSETID is smaller than the target "
+                "stream length"
+            )
+        if max_deleted_id is not None and last_id < max_deleted_id:
+            raise ValueError(
+                "The ID specified in XSETID is smaller than the provided "
+                "max_deleted_entry_id"
+            )
+        stream.last_id = last_id
+        if entries_added is not None:
+            stream.entries_added = entries_added
+        if max_deleted_id is not None:
+            stream.max_deleted_id = max_deleted_id
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_STREAM:
+            notify_keyspace_event(NOTIFY_STREAM, "xsetid", key, self.index)
+
+    def create_group(
+        self, key: str, name: str, last_id: str, mkstream: bool = False
+    ) -> None:
+        start = None if last_id == "$" else parse_stream_id(last_id)
+        stream = self.get_stream(key)
+        if stream is None:
+            if not mkstream:
+                raise ValueError(
+                    "The XGROUP subcommand requires the key to exist. Note that "
+                    "for CREATE you may want to use the MKSTREAM option to "
+                    "create an empty stream automatically."
+                )
+            stream = self.data[key] = Stream()
+        if name in stream.groups:
+            raise BusyGroupError()
+        stream.groups[name] = ConsumerGroup(stream.last_id if start is None else start)
 
-        stream_id = self._autogenerate_and_set_stream_id(key, value)
-        if stream_id is not None:
-            return stream_id
+    def get_group(self, key: str, name: str) -> tuple[Stream, ConsumerGroup]:
+        stream = self.get_stream(key)
+        group = stream.groups.get(name) if stream is not None else None
+        if stream is None or group is None:
+            raise NoGroupError(key, name)
+        return stream, group
 
-        return self._set_stream_id(key, value)
+    async def wait_for_stream(self, keys: list[str], timeout: Optional[float]) -> bool:
+        """Block until an entry is added to one of the streams, False on timeout"""
+        waiter = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self.stream_waiters.setdefault(key, set()).add(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            for key in keys:
+                waiters = self.stream_waiters.get(key)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self.stream_waiters[key]
+
+    def wake_stream_waiters(self, key: str) -> None:
+        for waiter in self.stream_waiters.pop(key, ()):
+            if not waiter.done():
+                waiter.set_result(None)
 
     async def rpush(self, key: str, values: list[Value]) -> list[Value]:
         if key in self.data and isinstance(self.data[key], list):
@@ -156,6 +1069,9 @@ class Storage:
             self.data[key] = values
         else:
             raise RuntimeError(f"Key {key} already exists and it's not a list")
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_LIST:
+            notify_keyspace_event(NOTIFY_LIST, "rpush", key, self.index)
         if key in self.conditions:
             async with self.conditions[key]:
                 self.conditions[key].notify_all()
@@ -168,22 +1084,43 @@ class Storage:
             self.data[key] = values
         else:
             raise RuntimeError(f"Key {key} already exists and it's not a list")
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_LIST:
+            notify_keyspace_event(NOTIFY_LIST, "lpush", key, self.index)
         if key in self.conditions:
             async with self.conditions[key]:
                 self.conditions[key].notify_all()
         return self.data[key]
 
+    def lpop(self, key: str, count: int = 1) -> list[Value]:
+        """Pop from the head of a list, a list left empty is deleted"""
+        values = self.data.get(key)
+        if count < 1 or not values or not isinstance(values, list):
+            return []
+        popped = values[:count]
+        del values[:count]
+        tracking.invalidate(key)
+        if config.notify_keyspace_events & NOTIFY_LIST:
+            notify_keyspace_event(NOTIFY_LIST, "lpop", key, self.index)
+        if not values:
+            del self.data[key]
+            if config.notify_keyspace_events & NOTIFY_GENERIC:
+                notify_keyspace_event(NOTIFY_GENERIC, "del", key, self.index)
+        return popped
+
     def get_type(self, key: str) -> ValueType:
         if key not in self.data:
             return ValueType.NONE
         match self.data[key]:
+            case Value(item=HyperLogLog()):
+                return ValueType.HYPERLOGLOG
             case Value():
                 return ValueType.STRING
             case list():
                 return ValueType.LIST
             case set():
                 return ValueType.SET
-            case deque():
+            case Stream():
                 return ValueType.STREAM
             case _:
                 return ValueType.NONE
@@ -216,4 +1153,68 @@ class Storage:
         return res
 
 
+class Databases:
+    """The logical databases, SELECT picks one per connection.
+
+    Each database is a Storage, created on first use. SWAPDB exchanges
+    their keyspaces, the Storage objects stay where they are, so every
+    connection that selected one of the two sees the other dataset from
+    its next command on.
+    """
+
+    def __init__(self, first: Optional[Storage] = None):
+        first = first or Storage()
+        first.databases = self
+        self.storages: dict[int, Storage] = {0: first}
+        self._expire_task: Optional[asyncio.Task] = None
+
+    def get(self, index: int) -> Storage:
+        if not 0 <= index < config.databases:
+            raise ValueError("DB index is out of range")
+        db = self.storages.get(index)
+        if db is None:
+            db = self.storages[index] = Storage(index)
+            db.databases = self
+            if config.access_tracking:
+                db.enable_access_tracking()
+        return db
+
+    async def swap(self, first: int, second: int) -> None:
+        first_db, second_db = self.get(first), self.get(second)
+        first_db.data, second_db.data = second_db.data, first_db.data
+        # Frequencies belong to the keys, they move with them
+        first_db.tracker, second_db.tracker = second_db.tracker, first_db.tracker
+        tracking.invalidate_all()
+        # Blocked clients look at their keys again, in the data now in place
+        for db in (first_db, second_db):
+            for key in list(db.stream_waiters):
+                db.wake_stream_waiters(key)
+            for condition in list(db.conditions.values()):
+                async with condition:
+                    condition.notify_all()
+
+    def flush(self, asynchronous: bool = False) -> None:
+        for db in self.storages.values():
+            db.flush(asynchronous)
+
+    def start(self) -> None:
+        self._expire_task = asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        """The active expire cycle, keys nobody reads again still go away"""
+        while True:
+            await asyncio.sleep(config.active_expire_interval)
+            for db in list(self.storages.values()):
+                db.expire_keys(config.active_expire_keys)
+
+    def keyspace_info(self) -> str:
+        lines = [
+            f"db{index}:keys={len(db.data)},expires={len(db.data.volatile)},avg_ttl=0"
+            for index, db in sorted(self.storages.items())
+            if db.data
+        ]
+        return "# Keyspace\r\n" + "".join(line + "\r\n" for line in lines)
+
+
 storage = Storage()
+databases = Databases(storage)
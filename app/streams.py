@@ -0,0 +1,477 @@
+"""Streams and their consumer groups.
+
+A group remembers what it handed out in a pending entries list (PEL), kept
+as a dict from id to PendingEntry plus sorted id lists, one for the whole
+group and one per consumer. Acks, claims and the start of an XPENDING range
+are binary searches, a range then only walks the entries it returns.
+
+A stream keeps its entries in fixed-size nodes, each with the parsed ids of
+its entries. A lookup by id bisects the nodes and then the ids of one node,
+instead of parsing an id string at every probe.
+"""
+
+import bisect
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Iterator, Optional
+
+from app.config import config
+
+StreamId = tuple[int, int]
+
+MAX_STREAM_ID: StreamId = (2**64 - 1, 2**64 - 1)
+
+
+class NoGroupError(RuntimeError):
+    prefix = "NOGROUP"
+
+    def __init__(self, key: str, group: str):
+        super().__init__(f"No such key '{key}' or consumer group '{group}'")
+
+
+class BusyGroupError(RuntimeError):
+    prefix = "BUSYGROUP"
+
+    def __init__(self):
+        super().__init__("Consumer Group name already exists")
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def parse_stream_id(text: str, missing_sequence: int = 0) -> StreamId:
+    """Parse ms-seq, a bare ms gets missing_sequence, - and + are the bounds"""
+    if text == "-":
+        return 0, 0
+    if text == "+":
+        return MAX_STREAM_ID
+    ms, _, sequence = text.partition("-")
+    try:
+        stream_id = int(ms), int(sequence) if sequence else missing_sequence
+    except ValueError:
+        stream_id = -1, -1
+    if stream_id[0] < 0 or stream_id[1] < 0:
+        raise ValueError("Invalid stream ID specified as stream command argument")
+    return stream_id
+
+
+def format_stream_id(stream_id: StreamId) -> str:
+    return f"{stream_id[0]}-{stream_id[1]}"
+
+
+def entry_id(entry: Any) -> StreamId:
+    ms, _, sequence = entry.item["id"].partition("-")
+    return int(ms), int(sequence)
+
+
+def entry_fields(entry: Any) -> list[str]:
+    """The field / value pairs of an entry, flattened as XRANGE replies them"""
+    return [part for k, v in entry.item.items() if k != "id" for part in (k, v)]
+
+
+def _insert(ids: list[StreamId], stream_id: StreamId) -> None:
+    # New deliveries carry the highest id so far, appending is the usual case
+    if not ids or ids[-1] < stream_id:
+        ids.append(stream_id)
+    else:
+        bisect.insort(ids, stream_id)
+
+
+def _remove(ids: list[StreamId], stream_id: StreamId) -> None:
+    idx = bisect.bisect_left(ids, stream_id)
+    if idx < len(ids) and ids[idx] == stream_id:
+        del ids[idx]
+
+
+@dataclass(slots=True)
+class PendingEntry:
+    consumer: str
+    # Milliseconds timestamp of the last delivery
+    delivery_time: int
+    delivery_count: int = 0
+
+
+@dataclass
+class Consumer:
+    name: str
+    seen_time: int
+    # Ids delivered to this consumer and not acknowledged yet, sorted
+    pending: list[StreamId] = field(default_factory=list)
+
+
+class ConsumerGroup:
+    def __init__(self, last_delivered: StreamId):
+        self.last_delivered = last_delivered
+        self.pending: dict[StreamId, PendingEntry] = {}
+        self.pending_ids: list[StreamId] = []
+        self.consumers: dict[str, Consumer] = {}
+
+    def consumer(self, name: str, now: int) -> Consumer:
+        """The named consumer, created on first use like XREADGROUP does"""
+        consumer = self.consumers.get(name)
+        if consumer is None:
+            consumer = self.consumers[name] = Consumer(name, now)
+        consumer.seen_time = now
+        return consumer
+
+    def delete_consumer(self, name: str) -> int:
+        """Drop a consumer with its pending entries, returns how many it had"""
+        consumer = self.consumers.pop(name, None)
+        if consumer is None:
+            return 0
+        for stream_id in consumer.pending:
+            del self.pending[stream_id]
+            _remove(self.pending_ids, stream_id)
+        return len(consumer.pending)
+
+    def assign(self, stream_id: StreamId, consumer: Consumer) -> PendingEntry:
+        """Make the consumer the owner of an entry, adding it to the PEL if needed"""
+        entry = self.pending.get(stream_id)
+        if entry is None:
+            entry = self.pending[stream_id] = PendingEntry(consumer.name, 0)
+            _insert(self.pending_ids, stream_id)
+            _insert(consumer.pending, stream_id)
+        elif entry.consumer != consumer.name:
+            _remove(self.consumers[entry.consumer].pending, stream_id)
+            _insert(consumer.pending, stream_id)
+            entry.consumer = consumer.name
+        return entry
+
+    def deliver(self, stream_id: StreamId, consumer: Consumer, now: int) -> None:
+        entry = self.assign(stream_id, consumer)
+        entry.delivery_time = now
+        entry.delivery_count += 1
+
+    def ack(self, stream_id: StreamId) -> bool:
+        entry = self.pending.pop(stream_id, None)
+        if entry is None:
+            return False
+        _remove(self.pending_ids, stream_id)
+        _remove(self.consumers[entry.consumer].pending, stream_id)
+        return True
+
+    def pending_range(
+        self,
+        start: StreamId,
+        end: StreamId,
+        count: int,
+        consumer: Optional[Consumer] = None,
+        min_idle: int = 0,
+        now: int = 0,
+    ) -> list[tuple[StreamId, PendingEntry]]:
+        """The extended form of XPENDING, at most count entries from start"""
+        ids = self.pending_ids if consumer is None else consumer.pending
+        result: list[tuple[StreamId, PendingEntry]] = []
+        idx = bisect.bisect_left(ids, start)
+        while idx < len(ids) and len(result) < count and ids[idx] <= end:
+            entry = self.pending[ids[idx]]
+            if not min_idle or now - entry.delivery_time >= min_idle:
+                result.append((ids[idx], entry))
+            idx += 1
+        return result
+
+    def summary(
+        self,
+    ) -> tuple[int, Optional[StreamId], Optional[StreamId], list[tuple[str, int]]]:
+        """The short form of XPENDING: count, lowest and highest id, per consumer"""
+        if not self.pending_ids:
+            return 0, None, None, []
+        counts = [
+            (consumer.name, len(consumer.pending))
+            for consumer in self.consumers.values()
+            if consumer.pending
+        ]
+        return len(self.pending_ids), self.pending_ids[0], self.pending_ids[-1], counts
+
+
+@dataclass(slots=True)
+class StreamNode:
+    """A run of consecutive entries, with their parsed ids in the same order"""
+
+    ids: list[StreamId] = field(default_factory=list)
+    entries: list[Any] = field(default_factory=list)
+
+
+def _first_id(node: StreamNode) -> StreamId:
+    return node.ids[0]
+
+
+class Stream:
+    """Entries in id order, together with the consumer groups reading them.
+
+    Like the listpacks of a Redis stream, entries are kept in nodes of at
+    most stream_node_max_entries. Trimming drops whole nodes from the front
+    and cuts into at most one, XDEL only shifts the entries of one node, so
+    neither walks the stream.
+    """
+
+    def __init__(self, entries: Iterable[Any] = ()):
+        self.nodes: list[StreamNode] = []
+        self.length = 0
+        self.groups: dict[str, ConsumerGroup] = {}
+        # Kept apart from the entries, XDEL and trimming do not lower them
+        self.last_id: StreamId = (0, 0)
+        self.max_deleted_id: StreamId = (0, 0)
+        self.entries_added = 0
+        for entry in entries:
+            self.add(entry, entry_id(entry))
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self) -> Iterator[Any]:
+        for node in self.nodes:
+            yield from node.entries
+
+    def __getitem__(self, idx: int) -> Any:
+        """The entry at a position, the nodes before it are walked"""
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError("stream index out of range")
+        for node in self.nodes:
+            if idx < len(node.entries):
+                return node.entries[idx]
+            idx -= len(node.entries)
+
+    def __eq__(self, other: object) -> bool:
+        # Compares like the deque streams used to be, entry by entry
+        if not isinstance(other, (Stream, deque, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            mine == theirs for mine, theirs in zip(self, other)
+        )
+
+    __hash__ = None  # type: ignore[assignment]
+
+    @property
+    def first_id(self) -> StreamId:
+        return self.nodes[0].ids[0] if self.nodes else (0, 0)
+
+    def first(self) -> Optional[tuple[StreamId, Any]]:
+        if not self.nodes:
+            return None
+        return self.nodes[0].ids[0], self.nodes[0].entries[0]
+
+    def last(self) -> Optional[tuple[StreamId, Any]]:
+        if not self.nodes:
+            return None
+        return self.nodes[-1].ids[-1], self.nodes[-1].entries[-1]
+
+    def add(self, entry: Any, stream_id: StreamId) -> None:
+        if not self.nodes or len(self.nodes[-1].ids) >= config.stream_node_max_entries:
+            self.nodes.append(StreamNode())
+        node = self.nodes[-1]
+        node.ids.append(stream_id)
+        node.entries.append(entry)
+        self.length += 1
+        self.last_id = stream_id
+        self.entries_added += 1
+
+    def add_many(self, entries: list[Any], last_id: StreamId) -> None:
+        for entry in entries:
+            self.add(entry, entry_id(entry))
+        self.last_id = last_id
+
+    def delete(self, ids: Iterable[StreamId]) -> int:
+        """XDEL, returns how many of the ids were found"""
+        deleted = 0
+        for stream_id in ids:
+            position = self._locate(stream_id)
+            if position is None:
+                continue
+            node_idx, idx = position
+            node = self.nodes[node_idx]
+            del node.ids[idx]
+            del node.entries[idx]
+            if not node.ids:
+                del self.nodes[node_idx]
+            self.length -= 1
+            deleted += 1
+            self.max_deleted_id = max(self.max_deleted_id, stream_id)
+        return deleted
+
+    def trim(
+        self,
+        maxlen: Optional[int] = None,
+        minid: Optional[StreamId] = None,
+        approximate: bool = False,
+        limit: Optional[int] = None,
+    ) -> int:
+        """Drop the oldest entries past MAXLEN or below MINID, returns how many.
+
+        An approximate trim only drops whole nodes, so with XADD ... MAXLEN ~
+        an append pays for trimming once per node rather than every time.
+        """
+        if approximate and limit is None:
+            # Redis bounds the work of one call the same way, LIMIT 0 lifts it
+            limit = config.stream_node_max_entries * 100
+        budget = limit if approximate and limit else None
+        trimmed = whole = 0
+        for node in self.nodes:
+            size = len(node.ids)
+            if maxlen is not None:
+                fits = self.length - trimmed - size >= maxlen
+            else:
+                assert minid is not None
+                fits = node.ids[-1] < minid
+            if not fits or (budget is not None and trimmed + size > budget):
+                break
+            trimmed += size
+            whole += 1
+        del self.nodes[:whole]
+        if self.nodes and not approximate:
+            node = self.nodes[0]
+            if maxlen is not None:
+                cut = max(self.length - trimmed - maxlen, 0)
+            else:
+                assert minid is not None
+                cut = bisect.bisect_left(node.ids, minid)
+            del node.ids[:cut]
+            del node.entries[:cut]
+            trimmed += cut
+        self.length -= trimmed
+        return trimmed
+
+    def find(self, stream_id: StreamId) -> Optional[Any]:
+        position = self._locate(stream_id)
+        if position is None:
+            return None
+        return self.nodes[position[0]].entries[position[1]]
+
+    def _locate(self, stream_id: StreamId) -> Optional[tuple[int, int]]:
+        """The node and the index in it of an id, None when it is not there"""
+        node_idx = bisect.bisect_right(self.nodes, stream_id, key=_first_id) - 1
+        if node_idx < 0:
+            return None
+        ids = self.nodes[node_idx].ids
+        idx = bisect.bisect_left(ids, stream_id)
+        if idx < len(ids) and ids[idx] == stream_id:
+            return node_idx, idx
+        return None
+
+    def entries_after(self, stream_id: StreamId, count: Optional[int] = None) -> list:
+        node_idx = max(bisect.bisect_right(self.nodes, stream_id, key=_first_id) - 1, 0)
+        result: list[Any] = []
+        for node in itertools.islice(self.nodes, node_idx, None):
+            start = bisect.bisect_right(node.ids, stream_id)
+            stop = len(node.ids) if count is None else start + count - len(result)
+            result += node.entries[start:stop]
+            if count is not None and len(result) >= count:
+                break
+        return result
+
+    def read_group(
+        self,
+        group: ConsumerGroup,
+        consumer: Consumer,
+        start: Optional[StreamId],
+        count: Optional[int],
+        noack: bool,
+        now: int,
+    ) -> list[tuple[StreamId, Optional[Any]]]:
+        """XREADGROUP on this stream, a start of None stands for >.
+
+        New entries move the last delivered id forward and, unless noack,
+        go to the PEL. Otherwise the consumer's own pending entries after
+        start are delivered again, those deleted meanwhile come back as None.
+        """
+        if start is None:
+            result = [
+                (entry_id(entry), entry)
+                for entry in self.entries_after(group.last_delivered, count)
+            ]
+            if result:
+                group.last_delivered = result[-1][0]
+            if not noack:
+                for stream_id, _ in result:
+                    group.deliver(stream_id, consumer, now)
+            return result
+
+        idx = bisect.bisect_right(consumer.pending, start)
+        stop = len(consumer.pending) if count is None else idx + count
+        result = []
+        for stream_id in consumer.pending[idx:stop]:
+            group.deliver(stream_id, consumer, now)
+            result.append((stream_id, self.find(stream_id)))
+        return result
+
+    def claim(
+        self,
+        group: ConsumerGroup,
+        consumer: Consumer,
+        ids: list[StreamId],
+        min_idle: int,
+        now: int,
+        delivery_time: Optional[int] = None,
+        retry_count: Optional[int] = None,
+        force: bool = False,
+        justid: bool = False,
+    ) -> list[tuple[StreamId, Any]]:
+        """XCLAIM, the entries idle for at least min_idle change owner"""
+        claimed = []
+        for stream_id in ids:
+            entry = self.find(stream_id)
+            pending = group.pending.get(stream_id)
+            if pending is None:
+                if not force or entry is None:
+                    continue
+            elif entry is None:
+                # Deleted from the stream, there is nothing left to process
+                group.ack(stream_id)
+                continue
+            elif now - pending.delivery_time < min_idle:
+                continue
+            pending = group.assign(stream_id, consumer)
+            pending.delivery_time = now if delivery_time is None else delivery_time
+            if retry_count is not None:
+                pending.delivery_count = retry_count
+            elif not justid:
+                pending.delivery_count += 1
+            claimed.append((stream_id, entry))
+        return claimed
+
+    def autoclaim(
+        self,
+        group: ConsumerGroup,
+        consumer: Consumer,
+        min_idle: int,
+        start: StreamId,
+        count: int,
+        now: int,
+        justid: bool = False,
+    ) -> tuple[StreamId, list[tuple[StreamId, Any]], list[StreamId]]:
+        """XAUTOCLAIM, returns the next cursor, the claimed and the deleted ids.
+
+        Like Redis it looks at no more than ten times count pending entries,
+        so a call costs the same however long the PEL is.
+        """
+        claimed: list[tuple[StreamId, Any]] = []
+        deleted: list[StreamId] = []
+        ids = group.pending_ids
+        idx = bisect.bisect_left(ids, start)
+        attempts = count * 10
+        while idx < len(ids) and len(claimed) < count and attempts:
+            attempts -= 1
+            stream_id = ids[idx]
+            pending = group.pending[stream_id]
+            if now - pending.delivery_time < min_idle:
+                idx += 1
+                continue
+            entry = self.find(stream_id)
+            if entry is None:
+                # Acking shrinks ids, idx already points at the next one
+                group.ack(stream_id)
+                deleted.append(stream_id)
+                continue
+            group.assign(stream_id, consumer)
+            pending.delivery_time = now
+            if not justid:
+                pending.delivery_count += 1
+            claimed.append((stream_id, entry))
+            idx += 1
+        cursor = ids[idx] if idx < len(ids) else (0, 0)
+        return cursor, claimed, deleted
@@ -0,0 +1,167 @@
+import asyncio
+import mmap
+import os
+import threading
+import weakref
+from typing import Any, Optional
+
+from app.config import config
+
+
+class Segment:
+    """A preallocated, memory-mapped file values are appended to"""
+
+    def __init__(self, segment_id: int, path: str, size: int):
+        self.id = segment_id
+        self.path = path
+        self.size = size
+        self.file = open(path, "w+b")
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.end = 0  # append position
+        self.live = 0  # bytes still referenced by a ColdValue
+        self.values: weakref.WeakSet = weakref.WeakSet()
+
+    def append(self, data: Any) -> int:
+        offset = self.end
+        self.map[offset : offset + len(data)] = data
+        self.end += len(data)
+        return offset
+
+    def close(self) -> bool:
+        """Unmap and remove the file, False while a reply still reads from it"""
+        try:
+            self.map.close()
+        except BufferError:
+            return False
+        self.file.close()
+        os.remove(self.path)
+        return True
+
+
+class ColdValue:
+    """A string value held in a segment, the entry keeps only its location"""
+
+    __slots__ = ("tier", "segment", "offset", "length", "__weakref__")
+
+    def __init__(self, tier: "ColdTier", segment: Segment, offset: int, length: int):
+        self.tier = tier
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+
+    def view(self) -> memoryview:
+        """The bytes of the value, read through the mapping without a copy"""
+        return memoryview(self.segment.map)[self.offset : self.offset + self.length]
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __del__(self):
+        # Runs wherever the last reference goes, the lazyfree thread included
+        try:
+            self.tier.release(self)
+        except Exception:
+            pass
+
+
+class ColdTier:
+    """Append-only segment files for large values that are rarely read.
+
+    Values are written once and never updated in place: overwriting or
+    deleting a key drops its ColdValue, which marks the bytes dead. Sealed
+    segments with no live bytes are removed, mostly dead ones have their
+    remaining values moved to the active segment first.
+    """
+
+    def __init__(self, directory: str, segment_size: int):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segments: dict[int, Segment] = {}
+        self.active: Optional[Segment] = None
+        self.next_id = 1
+        self.closing: list[Segment] = []
+        # Reentrant, a collection inside a locked section may release values
+        self._lock = threading.RLock()
+        self._task: Optional[asyncio.Task] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def store(self, data: Any) -> ColdValue:
+        length = len(data)
+        with self._lock:
+            segment = self.active
+            if segment is None or segment.end + length > segment.size:
+                segment = self._new_segment(max(self.segment_size, length))
+            offset = segment.append(data)
+            segment.live += length
+            value = ColdValue(self, segment, offset, length)
+            segment.values.add(value)
+        return value
+
+    def release(self, value: ColdValue) -> None:
+        with self._lock:
+            value.segment.live -= value.length
+
+    def compact(self, ratio: float) -> int:
+        """Reclaim sealed segments whose live share dropped below ratio.
+
+        Returns the number of bytes given back to the filesystem.
+        """
+        reclaimed = 0
+        for segment in list(self.segments.values()):
+            if segment is self.active or segment.live > segment.end * ratio:
+                continue
+            for value in list(segment.values):
+                self._relocate(value)
+            with self._lock:
+                del self.segments[segment.id]
+            self.closing.append(segment)
+            reclaimed += segment.size
+
+        # Replies still being sent hold views of a mapping, retry those later
+        self.closing = [segment for segment in self.closing if not segment.close()]
+        return reclaimed
+
+    def info(self) -> list[str]:
+        with self._lock:
+            segments = list(self.segments.values())
+        return [
+            f"tiered_segments:{len(segments)}",
+            f"tiered_used_bytes:{sum(segment.end for segment in segments)}",
+            f"tiered_live_bytes:{sum(segment.live for segment in segments)}",
+        ]
+
+    def start(self, storage: Any) -> None:
+        self._task = asyncio.create_task(self.run(storage))
+
+    async def run(self, storage: Any) -> None:
+        """Demote idle values and compact segments, a step per interval"""
+        while True:
+            await asyncio.sleep(config.tiered_sweep_interval)
+            try:
+                storage.demote_cold(config.tiered_sweep_count)
+                self.compact(config.tiered_compact_ratio)
+            except OSError as err:
+                print(f"Tiered storage error: {err}")
+
+    def _relocate(self, value: ColdValue) -> None:
+        data = bytes(value.view())
+        with self._lock:
+            segment = self.active
+            if segment is None or segment.end + value.length > segment.size:
+                segment = self._new_segment(max(self.segment_size, value.length))
+            value.segment.live -= value.length
+            value.segment.values.discard(value)
+            value.offset = segment.append(data)
+            value.segment = segment
+            segment.live += value.length
+            segment.values.add(value)
+
+    def _new_segment(self, size: int) -> Segment:
+        segment_id = self.next_id
+        self.next_id += 1
+        path = os.path.join(self.directory, f"segment-{segment_id:08d}.dat")
+        segment = Segment(segment_id, path, size)
+        self.segments[segment_id] = segment
+        self.active = segment
+        return segment
@@ -0,0 +1,98 @@
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from app.config import config
+
+
+@dataclass
+class TrackingClient:
+    bcast: bool = False
+    prefixes: list[str] = field(default_factory=list)
+
+
+def invalidate_message(keys: Optional[list[str]]) -> bytes:
+    """RESP3 push telling a client to drop keys, None means every key"""
+    if keys is None:
+        return b">2\r\n$10\r\ninvalidate\r\n_\r\n"
+    parts = [b">2\r\n$10\r\ninvalidate\r\n*%d\r\n" % len(keys)]
+    for key in keys:
+        encoded = key.encode("utf-8", "surrogateescape")
+        parts.append(b"$%d\r\n%s\r\n" % (len(encoded), encoded))
+    return b"".join(parts)
+
+
+class Tracking:
+    """Which connections cache which keys, for CLIENT TRACKING.
+
+    In the default mode the keys a client reads are remembered and each one
+    is invalidated at most once, the client has to read it again to hear
+    about the next change. In BCAST mode nothing is remembered, every change
+    of a key under one of the client's prefixes is announced.
+    """
+
+    def __init__(self):
+        self.clients: dict[Any, TrackingClient] = {}
+        # Insertion ordered, the oldest keys are evicted first
+        self.table: dict[str, set[Any]] = {}
+        self.prefixes: dict[str, set[Any]] = {}
+
+    def enable(self, writer: Any, bcast: bool, prefixes: list[str]) -> None:
+        self.disable(writer)
+        if bcast and not prefixes:
+            prefixes = [""]
+        client = TrackingClient(bcast, prefixes if bcast else [])
+        self.clients[writer] = client
+        for prefix in client.prefixes:
+            self.prefixes.setdefault(prefix, set()).add(writer)
+
+    def disable(self, writer: Any) -> None:
+        """Stop tracking, stale table entries are dropped when they fire"""
+        client = self.clients.pop(writer, None)
+        if client is None:
+            return
+        for prefix in client.prefixes:
+            subscribers = self.prefixes[prefix]
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.prefixes[prefix]
+        if not self.clients:
+            self.table.clear()
+
+    def is_tracking(self, writer: Any) -> bool:
+        return writer in self.clients
+
+    def remember(self, writer: Any, keys: list[str]) -> None:
+        """Record keys read by a client, evicting the oldest beyond the limit"""
+        client = self.clients.get(writer)
+        if client is None or client.bcast:
+            return
+        for key in keys:
+            readers = self.table.pop(key, None) or set()
+            readers.add(writer)
+            self.table[key] = readers
+        while len(self.table) > config.tracking_table_max_keys:
+            self.invalidate(next(iter(self.table)))
+
+    def invalidate(self, key: str) -> None:
+        if not self.clients:
+            return
+        writers = self.table.pop(key, None) or set()
+        for prefix, subscribers in self.prefixes.items():
+            if key.startswith(prefix):
+                writers = writers | subscribers
+        if not writers:
+            return
+        message = invalidate_message([key])
+        for writer in writers:
+            if writer in self.clients:
+                writer.write(message)
+
+    def invalidate_all(self) -> None:
+        """The whole dataset changed, e.g. FLUSHALL"""
+        self.table.clear()
+        message = invalidate_message(None)
+        for writer in self.clients:
+            writer.write(message)
+
+
+tracking = Tracking()
@@ -0,0 +1,36 @@
+"""Helpers for tests that run the server as separate local processes"""
+
+import asyncio
+import socket
+import subprocess
+import sys
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(*args: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "app.main", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def request(port: int, *args: str) -> bytes:
+    for _ in range(50):
+        try:
+            reader, writer = await asyncio.open_connection("localhost", port)
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+    writer.write(
+        b"*%d\r\n" % len(args)
+        + b"".join(b"$%d\r\n%s\r\n" % (len(a), a.encode()) for a in args)
+    )
+    reply = await reader.read(65536)
+    writer.close()
+    return reply
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from app.bench import main, mix_workload, parse_args, percentile, run, workloads
+from app.storage import storage
+
+
+@pytest.fixture()
+def clean_storage():
+    yield
+    storage.flush()
+
+
+def test_percentile():
+    ordered = [float(i) for i in range(1000)]
+    assert percentile(ordered, 0.5) == 500
+    assert percentile(ordered, 0.999) == 999
+    assert percentile([], 0.5) == 0.0
+
+
+def test_mix_workload():
+    available = workloads(10, "x")
+    mix = mix_workload("get=1,lpop=1,set=0", available, requests=5)
+    # GET keys and LPOP elements are created before the mix runs
+    assert mix.setup_count == 10
+    assert [mix.setup(n)[0] for n in range(10)] == ["SET"] * 5 + ["RPUSH"] * 5
+    assert {mix.commands(n)[0] for n in range(50)} == {"GET", "LPOP"}
+    with pytest.raises(ValueError):
+        mix_workload("nope=1", available, requests=5)
+
+
+@pytest.mark.asyncio
+async def test_run_in_process(clean_storage):
+    report = await run(
+        parse_args(["-n", "200", "-c", "3", "-P", "8", "-t", "set,get,lpop,blpop"])
+    )
+    assert report["config"]["server"] == "in-process"
+    assert report["config"]["gil"] in (True, False)
+    assert [result["test"] for result in report["results"]] == [
+        "set",
+        "get",
+        "lpop",
+        "blpop",
+    ]
+    for result in report["results"]:
+        assert result["requests"] == 200
+        assert result["ops_per_sec"] > 0
+        latency = result["latency_ms"]
+        assert latency["p50"] <= latency["p99"] <= latency["p999"] <= latency["max"]
+
+
+def test_main_writes_json(tmp_path, clean_storage):
+    output = tmp_path / "bench.json"
+    main(["-n", "50", "-c", "2", "--mix", "get=3,set=1", "-o", str(output)])
+    report = json.loads(output.read_text())
+    assert report["results"][0]["test"] == "mix(get=3,set=1)"
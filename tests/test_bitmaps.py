@@ -0,0 +1,89 @@
+import pytest
+
+from app.bitmaps import (
+    CHUNK_SIZE,
+    BitfieldOperation,
+    bit_count,
+    bit_operation,
+    bit_position,
+    get_bits,
+    parse_bitfield_type,
+    run_bitfield,
+    set_bits,
+)
+
+
+def naive_bits(data: bytes) -> str:
+    return "".join(f"{byte:08b}" for byte in data)
+
+
+class TestBitmaps:
+    def test_bit_count(self):
+        data = bytes(range(256)) * 3
+        bits = naive_bits(data)
+        for start, stop in [(0, len(bits)), (3, 21), (5, 6), (9, 1000), (7, 7)]:
+            assert bit_count(data, start, stop) == bits[start:stop].count("1")
+
+    def test_bit_count_chunks(self, monkeypatch):
+        monkeypatch.setattr("app.bitmaps.CHUNK_SIZE", 4)
+        data = bytes(range(1, 40))
+        assert bit_count(data, 1, 300) == naive_bits(data)[1:300].count("1")
+
+    def test_bit_position(self):
+        data = b"\x00\x00\x10\xff"
+        assert bit_position(data, 1, 0, 32) == 19
+        assert bit_position(data, 1, 20, 24) == -1
+        assert bit_position(data, 0, 0, 32) == 0
+        assert bit_position(data, 0, 24, 32) == -1
+        assert bit_position(b"\xff" * (CHUNK_SIZE + 1) + b"\xfe", 0, 3, 10**8) == (
+            (CHUNK_SIZE + 2) * 8 - 1
+        )
+
+    def test_bit_operation(self):
+        assert bit_operation("AND", [b"\xff\x0f", b"\x3c"]) == b"\x3c\x00"
+        assert bit_operation("OR", [b"\xf0", b"\x0f\x01"]) == b"\xff\x01"
+        assert bit_operation("XOR", [b"\xff", b"\x0f", b"\x01"]) == b"\xf1"
+        assert bit_operation("NOT", [b"\x0f\x00"]) == b"\xf0\xff"
+        assert bit_operation("OR", [b"", b""]) == b""
+
+    def test_bit_operation_chunks(self, monkeypatch):
+        monkeypatch.setattr("app.bitmaps.CHUNK_SIZE", 4)
+        first, second = bytes(range(1, 12)), bytes(range(100, 106))
+        padded = second + bytes(len(first) - len(second))
+        assert bit_operation("AND", [first, second]) == bytes(
+            a & b for a, b in zip(first, padded)
+        )
+        assert bit_operation("XOR", [second, first]) == bytes(
+            a ^ b for a, b in zip(padded, first)
+        )
+        assert bit_operation("NOT", [first]) == bytes(255 - a for a in first)
+
+    def test_get_and_set_bits(self):
+        data = bytearray(3)
+        set_bits(data, 5, 7, 0b1011011)
+        assert naive_bits(data) == "000001011011000000000000"
+        assert get_bits(data, 5, 7) == 0b1011011
+        assert get_bits(data, 20, 8) == 0
+        set_bits(data, 0, 24, 0)
+        assert data == bytes(3)
+
+    def test_parse_bitfield_type(self):
+        assert parse_bitfield_type("i64") == (True, 64)
+        assert parse_bitfield_type("u8") == (False, 8)
+        for text in ("u64", "i0", "x8", "i", "u-1"):
+            with pytest.raises(ValueError):
+                parse_bitfield_type(text)
+
+    def test_run_bitfield(self):
+        data = bytearray(2)
+        operations = [
+            BitfieldOperation("SET", True, 8, 0, -100),
+            BitfieldOperation("GET", True, 8, 0),
+            BitfieldOperation("GET", False, 8, 0),
+            BitfieldOperation("INCRBY", True, 8, 0, -100, "WRAP"),
+            BitfieldOperation("INCRBY", True, 8, 0, -200, "SAT"),
+            BitfieldOperation("INCRBY", False, 4, 8, 20, "FAIL"),
+            BitfieldOperation("INCRBY", False, 4, 8, 15, "SAT"),
+            BitfieldOperation("INCRBY", False, 4, 8, 2),
+        ]
+        assert run_bitfield(data, operations) == [0, -100, 156, 56, -128, None, 15, 1]
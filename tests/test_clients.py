@@ -0,0 +1,220 @@
+import asyncio
+import os
+import socket
+import sys
+
+import pytest
+
+from app.clients import Clients, tune_socket
+from app.config import config
+from app.parser import Command
+from app.processor import Processor
+from app.protocol import Resume
+from app.storage import Storage
+from tests.servers import free_port, request, start_server
+
+
+class Transport:
+    def __init__(self):
+        self.size = 0
+
+    def get_write_buffer_size(self) -> int:
+        return self.size
+
+
+class Writer:
+    def __init__(self, port: int):
+        self.transport = Transport()
+        self.port = port
+        self.closed = False
+        self.response = []
+
+    def get_extra_info(self, name: str):
+        return ("127.0.0.1", self.port) if name == "peername" else None
+
+    def write(self, data: bytes) -> None:
+        self.response.append(data)
+
+    def close(self) -> None:
+        self.closed = True
+
+    async def drain(self):
+        pass
+
+
+class StuckWriter(Writer):
+    """A client that never reads its replies"""
+
+    async def drain(self):
+        await asyncio.get_running_loop().create_future()
+
+
+@pytest.fixture()
+def registry(monkeypatch):
+    registry = Clients()
+    monkeypatch.setattr("app.processor.clients", registry)
+    return registry
+
+
+class TestClients:
+    def test_admit(self, registry, monkeypatch):
+        monkeypatch.setattr(config, "maxclients", 1)
+        assert registry.admit()
+        writer = Writer(5000)
+        info = registry.register(Processor(writer, Storage()), writer)
+        assert not registry.admit()
+        registry.unregister(info)
+        assert registry.admit()
+
+    def test_output_buffer_limits(self, registry, monkeypatch):
+        monkeypatch.setattr(config, "client_output_buffer_limit", (100, 10, 0))
+        writer = Writer(5000)
+        registry.register(Processor(writer, Storage()), writer)
+        writer.transport.size = 10
+        assert not registry.output_limit_exceeded(writer)
+        writer.transport.size = 50
+        assert registry.output_limit_exceeded(writer)
+        writer.transport.size = 101
+        monkeypatch.setattr(config, "client_output_buffer_limit", (100, 0, 0))
+        assert registry.output_limit_exceeded(writer)
+
+    def test_soft_limit_window(self, registry, monkeypatch):
+        monkeypatch.setattr(config, "client_output_buffer_limit", (0, 10, 60))
+        writer = Writer(5000)
+        info = registry.register(Processor(writer, Storage()), writer)
+        writer.transport.size = 50
+        assert not registry.output_limit_exceeded(writer)
+        assert info.soft_limit_since is not None
+        writer.transport.size = 5
+        assert not registry.output_limit_exceeded(writer)
+        assert info.soft_limit_since is None
+
+
+@pytest.mark.asyncio
+class TestClientCommands:
+    async def test_soft_limit_outside_a_task(self, registry, monkeypatch):
+        # The protocol layer starts commands with send(None), outside any task
+        monkeypatch.setattr(config, "client_output_buffer_limit", (0, 10, 0.05))
+        writer = StuckWriter(5000)
+        processor = Processor(writer, Storage())
+        registry.register(processor, writer)
+        writer.transport.size = 50
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+
+        def start():
+            coroutine = processor.process_command((Command.PING,))
+            try:
+                resumed = Resume(coroutine, coroutine.send(None))
+            except Exception as err:
+                started.set_exception(err)
+                return
+            started.set_result(asyncio.ensure_future(resumed))
+
+        loop.call_soon(start)
+        await asyncio.wait_for(await asyncio.wait_for(started, 1), 1)
+        assert writer.closed
+
+    async def test_setname_list_kill(self, registry):
+        storage = Storage()
+        first, second = Writer(5001), Writer(5002)
+        processor = Processor(first, storage)
+        other = Processor(second, storage)
+        registry.register(processor, first)
+        registry.register(other, second)
+
+        await processor.process_command((Command.CLIENT, "SETNAME", "worker"))
+        assert first.response[0] == b"+OK\r\n"
+        await processor.process_command((Command.CLIENT, "SETNAME", "bad name"))
+        assert first.response[1].startswith(b"-ERR Client names")
+        await processor.process_command((Command.CLIENT, "GETNAME"))
+        assert first.response[2] == b"$6\r\nworker\r\n"
+
+        await processor.process_command((Command.CLIENT, "LIST"))
+        lines = first.response[3].split(b"\r\n")[1].decode().splitlines()
+        assert len(lines) == 2
+        assert lines[0].startswith(f"id={processor.id} addr=127.0.0.1:5001 name=worker")
+        assert "omem=0" in lines[0]
+        await processor.process_command((Command.CLIENT, "LIST", "ID", str(other.id)))
+        assert f"id={other.id} ".encode() in first.response[4]
+        assert b"name=worker" not in first.response[4]
+
+        await processor.process_command((Command.CLIENT, "KILL", "ID", str(other.id)))
+        assert first.response[5] == b":1\r\n"
+        assert second.closed
+        await processor.process_command((Command.CLIENT, "KILL", "127.0.0.1:1"))
+        assert first.response[6] == b"-ERR No such client\r\n"
+        await processor.process_command((Command.CLIENT, "LIST", "ID", "abc"))
+        assert first.response[7] == b"-ERR Invalid client ID\r\n"
+
+    async def test_output_limit_closes_connection(self, registry, monkeypatch):
+        monkeypatch.setattr(config, "client_output_buffer_limit", (10, 0, 0))
+        writer = Writer(5000)
+        processor = Processor(writer, Storage())
+        registry.register(processor, writer)
+        writer.transport.size = 100
+        await processor.process_command((Command.PING,))
+        assert writer.closed
+
+
+@pytest.mark.asyncio
+async def test_maxclients_and_timeout_processes():
+    port = free_port()
+    process = start_server("--port", str(port), "--maxclients", "1", "--timeout", "1")
+    try:
+        assert await request(port, "PING") == b"+PONG\r\n"
+        reader, writer = await asyncio.open_connection("localhost", port)
+        writer.write(b"PING\r\n")
+        assert await reader.read(100) == b"+PONG\r\n"
+        assert await request(port, "PING") == b"-ERR max number of clients reached\r\n"
+        # The idle connection is closed after the timeout, freeing its slot
+        assert await asyncio.wait_for(reader.read(100), 5) == b""
+        writer.close()
+        assert await request(port, "PING") == b"+PONG\r\n"
+    finally:
+        process.kill()
+
+
+def test_tune_socket(monkeypatch):
+    monkeypatch.setattr(config, "tcp_keepalive", 60)
+    with socket.socket() as sock:
+        tune_socket(sock)
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 60
+    with socket.socket(socket.AF_UNIX) as sock:
+        tune_socket(sock)
+
+
+@pytest.mark.skipif(sys.platform != "linux", reason="127.0.0.2 is not routed")
+@pytest.mark.asyncio
+async def test_unix_socket_and_bind_processes(tmp_path):
+    port, path = free_port(), str(tmp_path / "redis.sock")
+    process = start_server(
+        "--port",
+        str(port),
+        "--bind",
+        "127.0.0.1",
+        "127.0.0.2",
+        "--tcp-backlog",
+        "128",
+        "--unixsocket",
+        path,
+        "--unixsocketperm",
+        "700",
+    )
+    try:
+        assert await request(port, "PING") == b"+PONG\r\n"
+        reader, writer = await asyncio.open_connection("127.0.0.2", port)
+        writer.write(b"PING\r\n")
+        assert await asyncio.wait_for(reader.read(100), 5) == b"+PONG\r\n"
+        writer.close()
+        assert os.stat(path).st_mode & 0o777 == 0o700
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b"*2\r\n$6\r\nCLIENT\r\n$4\r\nLIST\r\n")
+        reply = await asyncio.wait_for(reader.read(1000), 5)
+        assert f"addr={path}:0".encode() in reply
+        writer.close()
+    finally:
+        process.kill()
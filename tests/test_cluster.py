@@ -0,0 +1,241 @@
+import asyncio
+
+import pytest
+
+from app.cluster import (
+    Cluster,
+    ClusterNode,
+    cluster,
+    command_keys,
+    crc16,
+    key_hash_slot,
+)
+from app.formatter import formatter
+from app.parser import Command, parser
+from app.processor import Processor
+from app.storage import Storage, Value
+from tests.servers import free_port, request, start_server
+
+
+class Writer:
+    def __init__(self):
+        self.response = []
+
+    def write(self, current_response: bytes) -> None:
+        self.response.append(current_response)
+
+    async def drain(self):
+        pass
+
+
+@pytest.fixture(scope="function")
+def node():
+    node = Cluster()
+    node.enable("127.0.0.1", 7000)
+    return node
+
+
+@pytest.fixture(scope="function")
+def cluster_node():
+    cluster.enable("127.0.0.1", 7000)
+    other = ClusterNode("other", "127.0.0.1", 7001)
+    cluster.nodes[other.id] = other
+    yield cluster, other
+    cluster.enabled = False
+    cluster.nodes = {cluster.myself.id: cluster.myself}
+    cluster.slots = [None] * len(cluster.slots)
+    cluster.migrating.clear()
+    cluster.importing.clear()
+
+
+class TestHashSlot:
+    def test_crc16(self):
+        assert crc16(b"123456789") == 0x31C3
+
+    def test_key_hash_slot(self):
+        assert key_hash_slot("foo") == 12182
+        assert key_hash_slot("bar") == 5061
+        assert key_hash_slot("{user1000}.following") == key_hash_slot(
+            "{user1000}.followers"
+        )
+        assert key_hash_slot("foo{}{bar}") == crc16(b"foo{}{bar}") % 16384
+        assert key_hash_slot("foo{{bar}}zap") == key_hash_slot("{bar")
+        assert key_hash_slot("foo{bar}{zap}") == key_hash_slot("bar")
+
+    def test_command_keys(self):
+        assert command_keys(Command.GET, ["foo"]) == ["foo"]
+        assert command_keys(Command.PING, []) == []
+        assert command_keys(Command.XREAD, ["STREAMS", "a", "b", "0", "0"]) == [
+            "a",
+            "b",
+        ]
+        assert command_keys(Command.FCALL, ["f", "2", "a", "b", "arg"]) == ["a", "b"]
+        assert command_keys(Command.FCALL, ["f", "x", "a"]) == []
+        assert command_keys(Command.FCALL, ["f", "3", "a"]) == []
+        assert command_keys(Command.XREAD, ["COUNT", "1", "a"]) == []
+
+
+class TestCluster:
+    def test_route_owned(self, node):
+        node.add_slots([key_hash_slot("foo")])
+        assert node.route(Command.GET, ["foo"], Storage(), False) is None
+
+    def test_route_moved(self, node):
+        other = ClusterNode("other", "127.0.0.1", 7001)
+        node.nodes[other.id] = other
+        node.set_slot(12182, "NODE", "other")
+        redirect = node.route(Command.GET, ["foo"], Storage(), False)
+        assert str(redirect) == "MOVED 12182 127.0.0.1:7001"
+        assert str(node.route(Command.GET, ["bar"], Storage(), False)) == (
+            "CLUSTERDOWN Hash slot not served"
+        )
+
+    def test_route_crossslot(self, node):
+        redirect = node.route(
+            Command.XREAD, ["STREAMS", "a", "b", "0", "0"], None, False
+        )
+        assert str(redirect).startswith("CROSSSLOT")
+
+    def test_route_migrating(self, node):
+        other = ClusterNode("other", "127.0.0.1", 7001)
+        node.nodes[other.id] = other
+        node.add_slots([12182])
+        node.set_slot(12182, "MIGRATING", "other")
+        storage = Storage()
+        assert str(node.route(Command.GET, ["foo"], storage, False)) == (
+            "ASK 12182 127.0.0.1:7001"
+        )
+        storage.data["foo"] = Value("bar")
+        assert node.route(Command.GET, ["foo"], storage, False) is None
+
+    def test_route_importing(self, node):
+        other = ClusterNode("other", "127.0.0.1", 7001)
+        node.nodes[other.id] = other
+        node.set_slot(12182, "NODE", "other")
+        node.set_slot(12182, "IMPORTING", "other")
+        assert str(node.route(Command.GET, ["foo"], Storage(), False)).startswith(
+            "MOVED"
+        )
+        assert node.route(Command.GET, ["foo"], Storage(), True) is None
+
+    def test_slots_response(self, node):
+        node.add_slots([0, 1, 2, 5])
+        assert node.slots_response() == [
+            [0, 2, ["127.0.0.1", 7000, node.myself.id]],
+            [5, 5, ["127.0.0.1", 7000, node.myself.id]],
+        ]
+
+    def test_add_busy_slot(self, node):
+        node.add_slots([1])
+        with pytest.raises(RuntimeError, match="Slot 1 is already busy"):
+            node.add_slots([2, 1])
+        assert node.slots[2] is None
+
+
+@pytest.mark.asyncio
+class TestClusterCommands:
+    async def test_keyslot(self, cluster_node):
+        processor = Processor(Writer(), Storage())
+        await processor.process_command((Command.CLUSTER, "KEYSLOT", "foo"))
+        assert processor.writer.response[0] == b":12182\r\n"
+
+    async def test_keys_in_slot(self, cluster_node):
+        processor = Processor(Writer(), Storage())
+        response = processor.writer.response
+        slot = str(key_hash_slot("a"))
+        await processor.process_command(
+            (Command.CLUSTER, "ADDSLOTS", slot, str(key_hash_slot("b")))
+        )
+        await processor.process_command((Command.SET, "{a}1", "x"))
+        await processor.process_command((Command.SET, "b", "x"))
+        await processor.process_command((Command.CLUSTER, "COUNTKEYSINSLOT", slot))
+        assert response[-1] == b":1\r\n"
+        # Keys set or deleted after the index was built are kept in it
+        await processor.process_command((Command.SET, "{a}2", "x"))
+        await processor.process_command((Command.SET, "{a}3", "x"))
+        await processor.process_command((Command.DEL, "{a}1"))
+        await processor.process_command((Command.CLUSTER, "GETKEYSINSLOT", slot, "10"))
+        assert response[-1] == b"*2\r\n$4\r\n{a}2\r\n$4\r\n{a}3\r\n"
+        await processor.process_command((Command.CLUSTER, "GETKEYSINSLOT", slot, "1"))
+        assert response[-1] == b"*1\r\n$4\r\n{a}2\r\n"
+        await processor.process_command((Command.FLUSHDB,))
+        await processor.process_command((Command.CLUSTER, "COUNTKEYSINSLOT", slot))
+        assert response[-1] == b":0\r\n"
+        assert not processor.storage.data.slot_keys
+
+    async def test_moved_and_asking(self, cluster_node):
+        node, other = cluster_node
+        processor = Processor(Writer(), Storage())
+        await processor.process_command(
+            (Command.CLUSTER, "SETSLOT", "12182", "NODE", "other")
+        )
+        await processor.process_command((Command.GET, "foo"))
+        assert processor.writer.response[1] == b"-MOVED 12182 127.0.0.1:7001\r\n"
+
+        await processor.process_command(
+            (Command.CLUSTER, "SETSLOT", "12182", "IMPORTING", "other")
+        )
+        await processor.process_command((Command.ASKING,))
+        await processor.process_command((Command.SET, "foo", "bar"))
+        assert processor.writer.response[4] == b"+OK\r\n"
+        # ASKING only applies to the next command
+        await processor.process_command((Command.GET, "foo"))
+        assert processor.writer.response[5] == b"-MOVED 12182 127.0.0.1:7001\r\n"
+
+
+async def send(port: int, *commands: list[str]) -> list:
+    reader, writer = await asyncio.open_connection("localhost", port)
+    writer.write(b"".join(formatter.format_command(command) for command in commands))
+    buffer, replies = b"", []
+    while len(replies) < len(commands):
+        buffer += await reader.read(65536)
+        replies, _ = parser.parse_replies(buffer)
+    writer.close()
+    return replies
+
+
+@pytest.mark.asyncio
+async def test_slot_migration_between_processes():
+    source_port, target_port = free_port(), free_port()
+    processes = [
+        start_server("--port", str(port), "--cluster-enabled")
+        for port in (source_port, target_port)
+    ]
+    try:
+        await request(source_port, "PING")
+        await request(target_port, "PING")
+        [source_id] = await send(source_port, ["CLUSTER", "MYID"])
+        [target_id] = await send(target_port, ["CLUSTER", "MYID"])
+        assert await send(
+            source_port,
+            ["CLUSTER", "MEET", "127.0.0.1", str(target_port)],
+            ["CLUSTER", "ADDSLOTSRANGE", "0", "16383"],
+            ["SET", "foo", "bar"],
+        ) == ["OK", "OK", "OK"]
+        assert await send(
+            target_port,
+            ["CLUSTER", "MEET", "127.0.0.1", str(source_port)],
+            ["CLUSTER", "SETSLOT", "12182", "NODE", source_id],
+            ["CLUSTER", "SETSLOT", "12182", "IMPORTING", source_id],
+        ) == ["OK", "OK", "OK"]
+
+        [moved] = await send(target_port, ["GET", "foo"])
+        assert str(moved) == f"MOVED 12182 127.0.0.1:{source_port}"
+
+        assert await send(
+            source_port,
+            ["CLUSTER", "SETSLOT", "12182", "MIGRATING", target_id],
+            ["MIGRATE", "127.0.0.1", str(target_port), "foo", "0", "5000"],
+        ) == ["OK", "OK"]
+        [ask] = await send(source_port, ["GET", "foo"])
+        assert str(ask) == f"ASK 12182 127.0.0.1:{target_port}"
+        assert await send(target_port, ["ASKING"], ["GET", "foo"]) == ["OK", "bar"]
+
+        for port in (source_port, target_port):
+            await send(port, ["CLUSTER", "SETSLOT", "12182", "NODE", target_id])
+        [moved] = await send(source_port, ["GET", "foo"])
+        assert str(moved) == f"MOVED 12182 127.0.0.1:{target_port}"
+        assert await send(target_port, ["GET", "foo"]) == ["bar"]
+    finally:
+        for process in processes:
+            process.kill()
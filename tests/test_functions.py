@@ -0,0 +1,85 @@
+import pytest
+
+from app.functions import FunctionError, FunctionRegistry
+
+LIBRARY = """#!python name=counters
+def incr_pair(keys, args):
+    return [redis.call("SET", keys[0], args[0]), redis.call("GET", keys[0])]
+
+redis.register_function("incr_pair", incr_pair)
+redis.register_function("peek", lambda keys, args: keys, flags=("no-writes",))
+"""
+
+
+@pytest.fixture(scope="function")
+def registry():
+    return FunctionRegistry()
+
+
+class TestFunctionRegistry:
+    def test_load(self, registry):
+        assert registry.load(LIBRARY) == "counters"
+        assert set(registry.functions) == {"incr_pair", "peek"}
+        assert registry.functions["peek"].read_only
+        assert not registry.functions["incr_pair"].read_only
+
+    def test_load_existing(self, registry):
+        registry.load(LIBRARY)
+        with pytest.raises(FunctionError, match="Library 'counters' already exists"):
+            registry.load(LIBRARY)
+        assert registry.load(LIBRARY, replace=True) == "counters"
+
+    def test_load_without_header(self, registry):
+        with pytest.raises(FunctionError, match="Missing library metadata"):
+            registry.load("redis.register_function('f', lambda k, a: 1)")
+
+    def test_load_without_functions(self, registry):
+        with pytest.raises(FunctionError, match="No functions registered"):
+            registry.load("#!python name=empty\nx = 1\n")
+
+    @pytest.mark.parametrize(
+        "code",
+        [
+            "import os",
+            "from os import path",
+            "x = ().__class__",
+            "x = __builtins__",
+            "open('/etc/passwd')",
+        ],
+    )
+    def test_load_restricted(self, registry, code):
+        with pytest.raises(FunctionError):
+            registry.load(f"#!python name=evil\n{code}\n")
+
+    def test_call(self, registry):
+        registry.load(LIBRARY)
+        calls = []
+
+        def dispatcher(args, read_only):
+            calls.append((args, read_only))
+            return "OK" if args[0] == "SET" else args[2:]
+
+        assert registry.call("incr_pair", ["foo"], ["10"], dispatcher) == ["OK", []]
+        assert calls == [(["SET", "foo", "10"], False), (["GET", "foo"], False)]
+
+    def test_call_read_only(self, registry):
+        registry.load(LIBRARY)
+        assert registry.call("peek", ["a"], [], None, read_only=True) == ["a"]
+        with pytest.raises(FunctionError, match="write flag"):
+            registry.call("incr_pair", ["a"], ["1"], None, read_only=True)
+
+    def test_call_unknown(self, registry):
+        with pytest.raises(FunctionError, match="Function not found"):
+            registry.call("missing", [], [], None)
+
+    def test_delete(self, registry):
+        registry.load(LIBRARY)
+        registry.delete("counters")
+        assert registry.functions == {}
+        with pytest.raises(FunctionError, match="Library not found"):
+            registry.delete("counters")
+
+    def test_load_directory(self, registry, tmp_path):
+        (tmp_path / "counters.py").write_text(LIBRARY)
+        (tmp_path / "README.txt").write_text("not a library")
+        assert registry.load_directory(str(tmp_path)) == ["counters"]
@@ -0,0 +1,35 @@
+from app.hotkeys import AccessTracker, CountMinSketch
+
+
+class TestCountMinSketch:
+    def test_estimates(self):
+        sketch = CountMinSketch(width_bits=8)
+        for _ in range(50):
+            sketch.add("hot")
+        for idx in range(200):
+            sketch.add(f"cold:{idx}")
+        assert sketch.estimate("hot") >= 50
+        assert sketch.estimate("hot") < 60
+        assert sketch.estimate("never") < 10
+
+    def test_decay(self):
+        sketch = CountMinSketch(width_bits=4)
+        for _ in range(sketch.reset_at - 1):
+            sketch.add("hot")
+        assert sketch.estimate("hot") == sketch.reset_at - 1
+        sketch.add("hot")
+        assert sketch.additions == 0
+        assert sketch.estimate("hot") == sketch.reset_at // 2
+
+
+class TestAccessTracker:
+    def test_hottest(self):
+        tracker = AccessTracker(top_keys=3)
+        for idx in range(10):
+            for _ in range(idx + 1):
+                tracker.touch(f"key:{idx}")
+        hottest = tracker.hottest(2)
+        assert [key for key, _ in hottest] == ["key:9", "key:8"]
+        assert hottest[0][1] >= 10
+        assert len(tracker.top) == 3
+        assert tracker.frequency("key:9") == hottest[0][1]
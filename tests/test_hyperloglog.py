@@ -0,0 +1,56 @@
+from app.hyperloglog import (
+    SPARSE_MAX_REGISTERS,
+    HyperLogLog,
+    union_count,
+)
+
+
+class TestHyperLogLog:
+    def test_sparse_to_dense(self):
+        hll = HyperLogLog()
+        assert hll.count() == 0
+        assert hll.add(["a", "b", "c"])
+        assert not hll.add(["a"])
+        assert hll.count() == 3
+        assert hll.encoding == "sparse"
+        hll.add(f"member:{idx}" for idx in range(SPARSE_MAX_REGISTERS * 2))
+        assert hll.encoding == "dense"
+        assert len(hll.dense) == 16384
+        assert abs(hll.count() - SPARSE_MAX_REGISTERS * 2) < SPARSE_MAX_REGISTERS / 20
+
+    def test_cached_count(self):
+        hll = HyperLogLog()
+        hll.add(["a"])
+        assert hll.count() == 1
+        assert hll.cached_count == 1
+        hll.add(["a"])
+        assert hll.cached_count == 1
+        hll.add(["b"])
+        assert hll.cached_count is None
+
+    def test_merge(self):
+        sparse, dense = HyperLogLog(), HyperLogLog()
+        sparse.add(f"a:{idx}" for idx in range(100))
+        dense.add(f"b:{idx}" for idx in range(10_000))
+        assert abs(union_count([sparse, dense]) - 10_100) < 300
+        other = HyperLogLog()
+        other.add(f"a:{idx}" for idx in range(50, 150))
+        sparse.merge([other])
+        assert sparse.encoding == "sparse"
+        assert abs(sparse.count() - 150) <= 3
+        sparse.merge([dense])
+        assert sparse.encoding == "dense"
+
+    def test_dump_and_load(self):
+        for count in (10, 10_000):
+            hll = HyperLogLog()
+            hll.add(f"member:{idx}" for idx in range(count))
+            loaded = HyperLogLog.load(hll.dump())
+            assert loaded.encoding == hll.encoding
+            assert loaded.count() == hll.count()
+        for data in (b"hello", b"HYLLD" + b"AAAA", b"HYLLS!!"):
+            try:
+                HyperLogLog.load(data)
+            except ValueError:
+                continue
+            raise AssertionError(f"{data!r} was loaded")
@@ -0,0 +1,40 @@
+from collections import deque
+
+from app.lazyfree import LAZYFREE_THRESHOLD, LazyFree
+from app.storage import Keyspace, Value
+
+
+class TestLazyFree:
+    def test_small_values_are_not_taken(self):
+        lazyfree = LazyFree()
+        assert not lazyfree.free(Value("small"))
+        assert not lazyfree.free([Value(i) for i in range(LAZYFREE_THRESHOLD)])
+        assert lazyfree.pending() == 0
+
+    def test_free_list(self):
+        lazyfree = LazyFree()
+        values = [Value(i) for i in range(10_000)]
+        assert lazyfree.free(values)
+        lazyfree.wait()
+        assert values == []
+        assert lazyfree.pending() == 0
+
+    def test_free_stream(self):
+        lazyfree = LazyFree()
+        entries = deque(Value({"id": f"0-{i}"}) for i in range(5000))
+        assert lazyfree.free(entries)
+        lazyfree.wait()
+        assert len(entries) == 0
+
+    def test_free_keyspace(self):
+        lazyfree = LazyFree()
+        keyspace = Keyspace()
+        big_list = [Value(i) for i in range(1000)]
+        keyspace["big"] = big_list
+        for i in range(100):
+            keyspace[f"key{i}"] = Value(i)
+        assert lazyfree.free(keyspace)
+        lazyfree.wait()
+        assert len(keyspace) == 0
+        assert big_list == []
+        assert keyspace.sequences == {}
@@ -0,0 +1,196 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+from app.clients import clients
+from app.config import config
+from app.protocol import RedisProtocol
+from app.storage import Storage, Value
+from tests.servers import free_port, start_server
+
+NETWORKS = [
+    ["--network", "streams"],
+    ["--network", "protocol"],
+    # Falls back to the asyncio loop when uvloop is not installed
+    ["--network", "protocol", "--uvloop"],
+]
+
+
+class Transport(asyncio.Transport):
+    """Just enough of asyncio.Transport to drive RedisProtocol by hand"""
+
+    def __init__(self):
+        self.written = bytearray()
+        self.reading = True
+        self.closed = False
+
+    def write(self, data: bytes) -> None:
+        self.written += data
+
+    def is_reading(self) -> bool:
+        return self.reading
+
+    def pause_reading(self) -> None:
+        self.reading = False
+
+    def resume_reading(self) -> None:
+        self.reading = True
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+    def close(self) -> None:
+        self.closed = True
+
+    def get_extra_info(self, name: str, default=None):
+        return default
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+
+@pytest.fixture(params=NETWORKS, ids=lambda args: " ".join(args))
+def server_port(request):
+    port = free_port()
+    process = start_server("--port", str(port), *request.param)
+    try:
+        for _ in range(50):
+            try:
+                socket.create_connection(("localhost", port)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield port
+    finally:
+        process.kill()
+        process.wait()
+
+
+async def read_exactly(reader: asyncio.StreamReader, expected: bytes) -> bytes:
+    data = await asyncio.wait_for(reader.readexactly(len(expected)), 5)
+    assert data == expected
+    return data
+
+
+@pytest.mark.asyncio
+class TestNetwork:
+    async def test_pipeline_split_across_reads(self, server_port):
+        reader, writer = await asyncio.open_connection("localhost", server_port)
+        payload = (
+            b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$5\r\nvalue\r\n"
+            b"*2\r\n$3\r\nGET\r\n$3\r\nkey\r\nPING\r\n"
+        )
+        for idx in range(0, len(payload), 7):
+            writer.write(payload[idx : idx + 7])
+            await writer.drain()
+            await asyncio.sleep(0.001)
+        await read_exactly(reader, b"+OK\r\n$5\r\nvalue\r\n+PONG\r\n")
+        writer.close()
+
+    async def test_blocked_command_keeps_order(self, server_port):
+        reader, writer = await asyncio.open_connection("localhost", server_port)
+        # The PING pipelined after BLPOP is answered only once BLPOP returns
+        writer.write(b"*3\r\n$5\r\nBLPOP\r\n$4\r\njobs\r\n$1\r\n0\r\nPING\r\n")
+        await asyncio.sleep(0.1)
+        other_reader, other_writer = await asyncio.open_connection(
+            "localhost", server_port
+        )
+        other_writer.write(b"*3\r\n$5\r\nRPUSH\r\n$4\r\njobs\r\n$1\r\na\r\n")
+        await read_exactly(other_reader, b":1\r\n")
+        await read_exactly(reader, b"*2\r\n$4\r\njobs\r\n$1\r\na\r\n+PONG\r\n")
+        writer.close()
+        other_writer.close()
+
+    async def test_blocking_timeouts(self, server_port):
+        reader, writer = await asyncio.open_connection("localhost", server_port)
+        writer.write(b"*3\r\n$5\r\nBLPOP\r\n$4\r\njobs\r\n$4\r\n0.05\r\n")
+        await read_exactly(reader, b"*-1\r\n")
+        writer.write(
+            b"*6\r\n$6\r\nXGROUP\r\n$6\r\nCREATE\r\n$1\r\ns\r\n$1\r\ng\r\n"
+            b"$1\r\n$\r\n$8\r\nMKSTREAM\r\n"
+        )
+        await read_exactly(reader, b"+OK\r\n")
+        writer.write(
+            b"*9\r\n$10\r\nXREADGROUP\r\n$5\r\nGROUP\r\n$1\r\ng\r\n$1\r\nc\r\n"
+            b"$5\r\nBLOCK\r\n$2\r\n50\r\n$7\r\nSTREAMS\r\n$1\r\ns\r\n$1\r\n>\r\n"
+        )
+        writer.write(b"PING\r\n")
+        await read_exactly(reader, b"*-1\r\n+PONG\r\n")
+        writer.close()
+
+    async def test_large_reply(self, server_port):
+        reader, writer = await asyncio.open_connection("localhost", server_port)
+        value = b"v" * 1_000_000
+        writer.write(
+            b"*3\r\n$3\r\nSET\r\n$3\r\nbig\r\n$%d\r\n%s\r\n" % (len(value), value)
+        )
+        await read_exactly(reader, b"+OK\r\n")
+        for _ in range(3):
+            writer.write(b"*2\r\n$3\r\nGET\r\n$3\r\nbig\r\n")
+        await read_exactly(reader, (b"$1000000\r\n" + value + b"\r\n") * 3)
+        writer.close()
+
+    async def test_protocol_error_closes_connection(self, server_port):
+        reader, writer = await asyncio.open_connection("localhost", server_port)
+        writer.write(b"*1\r\n$4\r\nNOPE\r\n")
+        assert await asyncio.wait_for(reader.read(100), 5) == b""
+        writer.close()
+
+    async def test_pipelined_xadds(self, server_port):
+        reader, writer = await asyncio.open_connection("localhost", server_port)
+        xadd = (
+            b"*5\r\n$4\r\nXADD\r\n$6\r\nevents\r\n$3\r\n5-*\r\n$1\r\nn\r\n$1\r\nv\r\n"
+        )
+        writer.write(xadd * 3 + b"*2\r\n$4\r\nXLEN\r\n$6\r\nevents\r\n")
+        await read_exactly(reader, b"$3\r\n5-1\r\n$3\r\n5-2\r\n$3\r\n5-3\r\n:3\r\n")
+        writer.close()
+
+
+@pytest.mark.asyncio
+class TestProtocolBackPressure:
+    async def test_reading_pauses_while_a_command_waits(self):
+        storage = Storage()
+        protocol, transport = RedisProtocol(storage), Transport()
+        protocol.connection_made(transport)
+        pipeline = b"*3\r\n$5\r\nBLPOP\r\n$4\r\njobs\r\n$1\r\n0\r\nPING\r\nPING\r\n"
+        protocol.data_received(pipeline)
+        assert not transport.reading
+        # The queued PINGs count towards the query buffer, as read and not run
+        assert protocol.query_buffer_size() == len(pipeline)
+        assert protocol.info.query_buffer == len(pipeline)
+        assert f"qbuf={len(pipeline)} " in clients.describe(protocol.info)
+
+        await storage.rpush("jobs", [Value("a")])
+        await asyncio.sleep(0.01)
+        assert transport.written == b"*2\r\n$4\r\njobs\r\n$1\r\na\r\n+PONG\r\n+PONG\r\n"
+        assert transport.reading
+        assert protocol.query_buffer_size() == 0
+        protocol.connection_lost(None)
+
+    async def test_queued_commands_count_towards_the_limit(self, monkeypatch):
+        monkeypatch.setattr(config, "client_query_buffer_limit", 35)
+        protocol, transport = RedisProtocol(Storage()), Transport()
+        protocol.connection_made(transport)
+        protocol.data_received(b"*3\r\n$5\r\nBLPOP\r\n$4\r\njobs\r\n$1\r\n0\r\n")
+        protocol.data_received(b"PING\r\n" * 3)
+        assert not transport.closed
+        # Data already on its way when reading paused still counts
+        protocol.data_received(b"PING\r\n" * 3)
+        assert transport.closed
+        protocol.connection_lost(None)
+
+    async def test_large_value_is_parsed_once_it_arrived(self):
+        protocol, transport = RedisProtocol(Storage()), Transport()
+        protocol.connection_made(transport)
+        value = b"v" * 100_000
+        request = b"*3\r\n$3\r\nSET\r\n$3\r\nbig\r\n$%d\r\n%s\r\n" % (len(value), value)
+        for idx in range(0, len(request), 1000):
+            protocol.data_received(request[idx : idx + 1000])
+            if idx + 1000 < len(request):
+                assert protocol.wanted == len(request)
+        assert transport.written == b"+OK\r\n"
+        assert protocol.storage.data["big"].item == value.decode()
+        assert protocol.wanted == 0 and not protocol.buffer
+        protocol.connection_lost(None)
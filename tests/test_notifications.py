@@ -0,0 +1,121 @@
+import datetime
+
+import pytest
+
+from app.config import config
+from app.parser import Command
+from app.notifications import (
+    NOTIFY_ALL,
+    NOTIFY_EXPIRED,
+    NOTIFY_KEYEVENT,
+    NOTIFY_KEYSPACE,
+    parse_event_flags,
+)
+from app.processor import Processor
+from app.pubsub import pubsub
+from app.storage import Storage, Value
+
+
+class Writer:
+    def __init__(self):
+        self.response = []
+
+    def write(self, data: bytes) -> None:
+        self.response.append(data)
+
+    async def drain(self):
+        pass
+
+
+@pytest.fixture()
+def subscriber():
+    writer = Writer()
+    pubsub.psubscribe(writer, "__key*__:*")
+    yield writer
+    pubsub.remove_subscriber(writer)
+
+
+def test_parse_event_flags():
+    assert parse_event_flags("") == 0
+    assert parse_event_flags("K") == 0
+    assert parse_event_flags("x") == 0
+    assert parse_event_flags("Ex") == NOTIFY_KEYEVENT | NOTIFY_EXPIRED
+    assert parse_event_flags("KA") == NOTIFY_KEYSPACE | NOTIFY_ALL
+    with pytest.raises(ValueError):
+        parse_event_flags("Kq")
+
+
+@pytest.mark.asyncio
+class TestNotifications:
+    async def test_disabled(self, subscriber, monkeypatch):
+        monkeypatch.setattr(config, "notify_keyspace_events", 0)
+        storage = Storage()
+        await storage.set("key", Value("1"))
+        assert subscriber.response == []
+
+    async def test_set_and_list_events(self, subscriber, monkeypatch):
+        monkeypatch.setattr(config, "notify_keyspace_events", parse_event_flags("KE$"))
+        storage = Storage(3)
+        await storage.set("key", Value("1"))
+        await storage.rpush("list", [Value("a")])
+        assert subscriber.response == [
+            b"*4\r\n$8\r\npmessage\r\n$10\r\n__key*__:*\r\n"
+            b"$18\r\n__keyspace@3__:key\r\n$3\r\nset\r\n",
+            b"*4\r\n$8\r\npmessage\r\n$10\r\n__key*__:*\r\n"
+            b"$18\r\n__keyevent@3__:set\r\n$3\r\nkey\r\n",
+        ]
+
+    async def test_expired_events(self, subscriber, monkeypatch):
+        monkeypatch.setattr(config, "notify_keyspace_events", parse_event_flags("Ex"))
+        storage = Storage()
+        past = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        future = datetime.datetime.now() + datetime.timedelta(hours=1)
+        await storage.set("old", Value("1", expire=past))
+        await storage.set("new", Value("1", expire=future))
+        await storage.set("moved", Value("1", expire=past))
+        await storage.set("moved", Value("2", expire=future))
+        assert storage.expire_keys(10) == 1
+        assert "old" not in storage.data
+        assert "new" in storage.data and "moved" in storage.data
+        assert subscriber.response == [
+            b"*4\r\n$8\r\npmessage\r\n$10\r\n__key*__:*\r\n"
+            b"$22\r\n__keyevent@0__:expired\r\n$3\r\nold\r\n"
+        ]
+
+        await storage.set("lazy", Value("1", expire=past))
+        assert storage.get_string("lazy") is None
+        assert "lazy" not in storage.data
+        assert len(subscriber.response) == 2
+
+    async def test_string_and_pop_events(self, monkeypatch):
+        monkeypatch.setattr(config, "notify_keyspace_events", parse_event_flags("EA"))
+        subscriber = Writer()
+        pubsub.psubscribe(subscriber, "__keyevent@0__:*")
+        try:
+            processor = Processor(Writer(), Storage())
+            for command in [
+                (Command.INCRBY, "n", "2"),
+                (Command.INCRBYFLOAT, "n", "0.5"),
+                (Command.APPEND, "s", "ab"),
+                (Command.SETRANGE, "s", "1", "c"),
+                (Command.RPUSH, "list", "a", "b", "c"),
+                (Command.LPOP, "list"),
+                (Command.BLPOP, "list", "0"),
+                (Command.LPOP, "list", "5"),
+            ]:
+                await processor.process_command(command)
+        finally:
+            pubsub.remove_subscriber(subscriber)
+        events = [message.split(b"\r\n")[6:9:2] for message in subscriber.response]
+        assert events == [
+            [b"__keyevent@0__:incrby", b"n"],
+            [b"__keyevent@0__:incrbyfloat", b"n"],
+            [b"__keyevent@0__:append", b"s"],
+            [b"__keyevent@0__:setrange", b"s"],
+            [b"__keyevent@0__:rpush", b"list"],
+            [b"__keyevent@0__:lpop", b"list"],
+            [b"__keyevent@0__:lpop", b"list"],
+            [b"__keyevent@0__:lpop", b"list"],
+            [b"__keyevent@0__:del", b"list"],
+        ]
+        assert "list" not in processor.storage.data
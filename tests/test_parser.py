@@ -1,6 +1,6 @@
 import pytest
 
-from app.parser import parser, Command
+from app.parser import ReplyError, parser, Command
 
 
 class TestParser:
@@ -118,3 +118,28 @@ class TestParser:
             b"*4\r\n$5\r\nXREAD\r\n$7\r\nSTREAMS\r\n$6\r\norange\r\n$3\r\n0-2\r\n"
         )
         assert cmd == (Command.XREAD, "STREAMS", "orange", "0-2")
+
+    def test_fcall(self):
+        cmd = parser.parse_command(
+            b"*5\r\n$5\r\nFCALL\r\n$4\r\nincr\r\n$1\r\n1\r\n$3\r\nfoo\r\n$1\r\n5\r\n"
+        )
+        assert cmd == (Command.FCALL, "incr", "1", "foo", "5")
+
+    def test_parse_reply(self):
+        assert parser.parse_reply(b"+OK\r\n") == "OK"
+        assert parser.parse_reply(b":5\r\n") == 5
+        assert parser.parse_reply(b"$-1\r\n") is None
+        assert parser.parse_reply(b"*2\r\n$3\r\nfoo\r\n:1\r\n") == ["foo", 1]
+        error = parser.parse_reply(b"-ERR wrong\r\n")
+        assert isinstance(error, ReplyError)
+        assert str(error) == "ERR wrong"
+
+    def test_wanted_size(self):
+        request = b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$10\r\n0123456789\r\n"
+        assert parser.wanted_size(bytearray(request[:28])) == len(request)
+        assert parser.wanted_size(bytearray(request[:5])) == 0
+        assert parser.wanted_size(bytearray(b"PI")) == 0
+        assert parser.parse_commands(bytearray(request)) == (
+            [(Command.SET, "k", "0123456789")],
+            len(request),
+        )
@@ -0,0 +1,28 @@
+import pytest
+
+from app.patterns import compile_glob, literal_prefix
+
+
+class TestPatterns:
+    @pytest.mark.parametrize(
+        "pattern, matching, not_matching",
+        [
+            ("news.*", ["news.", "news.sport"], ["news", "old.news.x"]),
+            ("h?llo", ["hello", "hallo"], ["hllo", "heello"]),
+            ("h[ae]llo", ["hello", "hallo"], ["hillo"]),
+            ("h[^e]llo", ["hallo"], ["hello"]),
+            ("h[a-c]llo", ["hbllo"], ["hdllo"]),
+            ("a\\*b", ["a*b"], ["axb"]),
+            ("a.b", ["a.b"], ["axb"]),
+        ],
+    )
+    def test_compile_glob(self, pattern, matching, not_matching):
+        regex = compile_glob(pattern)
+        assert all(regex.fullmatch(value) for value in matching)
+        assert not any(regex.fullmatch(value) for value in not_matching)
+
+    def test_literal_prefix(self):
+        assert literal_prefix("news.*") == "news."
+        assert literal_prefix("*") == ""
+        assert literal_prefix("plain") == "plain"
+        assert literal_prefix("h[ae]llo") == "h"
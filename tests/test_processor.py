@@ -1,12 +1,16 @@
 import asyncio
 import datetime
+import time
 from unittest.mock import MagicMock
 
 import pytest
 
+from app.functions import functions
 from app.parser import Command
 from app.processor import Processor
-from app.storage import Storage, Value
+from app.pubsub import pubsub
+from app.storage import Storage, Value, ValueType
+from app.tiering import ColdTier
 
 
 @pytest.fixture(scope="function")
@@ -34,6 +38,36 @@ def processor_stub(writer, storage_stub):
     return Processor(writer, storage_stub)
 
 
+@pytest.fixture(scope="function")
+def function_library():
+    functions.load(
+        """#!python name=lib
+def swap(keys, args):
+    first, second = redis.call("GET", keys[0]), redis.call("GET", keys[1])
+    redis.call("SET", keys[0], second)
+    redis.call("SET", keys[1], first)
+    return [first, second]
+
+def push_len(keys, args):
+    return redis.call("RPUSH", keys[0], *args)
+
+def blocking(keys, args):
+    return redis.pcall("BLPOP", keys[0])
+
+def write_from_ro(keys, args):
+    return redis.call("SET", keys[0], "x")
+
+redis.register_function("swap", swap)
+redis.register_function("push_len", push_len)
+redis.register_function("blocking", blocking)
+redis.register_function("write_from_ro", write_from_ro, flags=("no-writes",))
+""",
+        replace=True,
+    )
+    yield
+    functions.flush()
+
+
 @pytest.fixture()
 def mock_datetime_now(monkeypatch):
     datetime_mock = MagicMock(wraps=datetime.datetime)
@@ -83,10 +117,12 @@ class TestProcessor:
         assert processor_stub.writer.response[3].decode() == "+OK\r\n"
         await processor_stub.process_command((Command.GET, "foo"))
         assert processor_stub.writer.response[4].decode() == "$3\r\nbar\r\n"
-        await processor_stub.process_command((Command.SET, "foo", "bar", "ex", -5))
-        assert processor_stub.writer.response[5].decode() == "+OK\r\n"
+        await processor_stub.process_command((Command.SET, "foo", "baz", "ex", -5))
+        assert processor_stub.writer.response[5].decode() == (
+            "-ERR invalid expire time in 'set' command\r\n"
+        )
         await processor_stub.process_command((Command.GET, "foo"))
-        assert processor_stub.writer.response[6].decode() == "$-1\r\n"
+        assert processor_stub.writer.response[6].decode() == "$3\r\nbar\r\n"
 
     async def test_ping(self, processor_stub):
         await processor_stub.process_command((Command.PING,))
@@ -190,7 +226,7 @@ class TestProcessor:
         ]
         await processor_stub.process_command((Command.LPOP, "key", "2"))
         assert processor_stub.writer.response[2].decode() == "*1\r\n$6\r\nvalue3\r\n"
-        assert processor_stub.storage.data["key"] == []
+        assert "key" not in processor_stub.storage.data
 
     async def test_blpop_one_value(self, processor_stub):
         await processor_stub.process_command((Command.SET, "foo", "bar"))
@@ -444,3 +480,542 @@ class TestProcessor:
             processor_stub.writer.response[6].decode()
             == "*2\r\n*2\r\n$6\r\nbanana\r\n*2\r\n*2\r\n$3\r\n0-3\r\n*2\r\n$6\r\norange\r\n$9\r\nraspberry\r\n*2\r\n$3\r\n0-4\r\n*2\r\n$6\r\norange\r\n$9\r\nraspberry\r\n*2\r\n$6\r\ntomato\r\n*1\r\n*2\r\n$3\r\n0-4\r\n*2\r\n$5\r\nredis\r\n$7\r\ncabbage\r\n"
         )
+
+    async def test_function_load_and_list(self, processor_stub):
+        code = "#!python name=mylib\nredis.register_function('f', lambda k, a: 1)\n"
+        await processor_stub.process_command((Command.FUNCTION, "LOAD", code))
+        assert processor_stub.writer.response[0].decode() == "$5\r\nmylib\r\n"
+        await processor_stub.process_command((Command.FUNCTION, "LOAD", code))
+        assert (
+            processor_stub.writer.response[1].decode()
+            == "-ERR Library 'mylib' already exists\r\n"
+        )
+        await processor_stub.process_command((Command.FUNCTION, "LIST"))
+        assert (
+            processor_stub.writer.response[2].decode()
+            == "*1\r\n*4\r\n$12\r\nlibrary_name\r\n$5\r\nmylib\r\n$9\r\nfunctions\r\n*1\r\n$1\r\nf\r\n"
+        )
+        await processor_stub.process_command((Command.FUNCTION, "FLUSH"))
+        assert processor_stub.writer.response[3].decode() == "+OK\r\n"
+        assert functions.libraries == {}
+
+    async def test_fcall(self, function_library, processor_stub):
+        await processor_stub.process_command((Command.SET, "a", "1"))
+        await processor_stub.process_command((Command.SET, "b", "2"))
+        await processor_stub.process_command((Command.FCALL, "swap", "2", "a", "b"))
+        assert (
+            processor_stub.writer.response[2].decode() == "*2\r\n$1\r\n1\r\n$1\r\n2\r\n"
+        )
+        assert processor_stub.storage.get("a").item == 2
+        assert processor_stub.storage.get("b").item == 1
+        await processor_stub.process_command(
+            (Command.FCALL, "push_len", "1", "list", "x", "y")
+        )
+        assert processor_stub.writer.response[3].decode() == ":2\r\n"
+
+    async def test_fcall_errors(self, function_library, processor_stub):
+        await processor_stub.process_command((Command.FCALL, "missing", "0"))
+        assert (
+            processor_stub.writer.response[0].decode() == "-ERR Function not found\r\n"
+        )
+        await processor_stub.process_command((Command.FCALL, "blocking", "1", "k"))
+        assert (
+            processor_stub.writer.response[1].decode()
+            == "-ERR This command is not allowed from functions\r\n"
+        )
+        await processor_stub.process_command((Command.FCALL_RO, "swap", "2", "a", "b"))
+        assert processor_stub.writer.response[2].startswith(b"-ERR Can not execute")
+        await processor_stub.process_command(
+            (Command.FCALL_RO, "write_from_ro", "1", "a")
+        )
+        assert processor_stub.writer.response[3].startswith(
+            b"-ERR Error running function 'write_from_ro': ERR Write commands"
+        )
+        assert processor_stub.storage.data == {}
+        for num_keys in ("x", "-1", "3"):
+            await processor_stub.process_command((Command.FCALL, "swap", num_keys, "a"))
+        assert (
+            processor_stub.writer.response[4:]
+            == [b"-ERR Bad number of keys provided\r\n"] * 3
+        )
+
+    async def test_subscribe_and_publish(self, processor_stub, writer):
+        publisher = Processor(writer.__class__(), processor_stub.storage)
+        try:
+            await processor_stub.process_command((Command.SUBSCRIBE, "news", "sport"))
+            assert processor_stub.writer.response == [
+                b"*3\r\n$9\r\nsubscribe\r\n$4\r\nnews\r\n:1\r\n",
+                b"*3\r\n$9\r\nsubscribe\r\n$5\r\nsport\r\n:2\r\n",
+            ]
+            await publisher.process_command((Command.PUBLISH, "news", "hello"))
+            assert publisher.writer.response[0] == b":1\r\n"
+            assert (
+                processor_stub.writer.response[2]
+                == b"*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$5\r\nhello\r\n"
+            )
+            await publisher.process_command((Command.PUBSUB, "NUMSUB", "news", "x"))
+            assert (
+                publisher.writer.response[1]
+                == b"*4\r\n$4\r\nnews\r\n:1\r\n$1\r\nx\r\n:0\r\n"
+            )
+        finally:
+            pubsub.remove_subscriber(processor_stub.writer)
+
+    async def test_subscribed_mode(self, processor_stub):
+        try:
+            await processor_stub.process_command((Command.PSUBSCRIBE, "news.*"))
+            await processor_stub.process_command((Command.GET, "foo"))
+            assert processor_stub.writer.response[1].startswith(
+                b"-ERR Can't execute 'get'"
+            )
+            await processor_stub.process_command((Command.PING,))
+            assert (
+                processor_stub.writer.response[2] == b"*2\r\n$4\r\npong\r\n$0\r\n\r\n"
+            )
+            await processor_stub.process_command((Command.PUNSUBSCRIBE,))
+            assert (
+                processor_stub.writer.response[3]
+                == b"*3\r\n$12\r\npunsubscribe\r\n$6\r\nnews.*\r\n:0\r\n"
+            )
+            await processor_stub.process_command((Command.PING,))
+            assert processor_stub.writer.response[4] == b"+PONG\r\n"
+        finally:
+            pubsub.remove_subscriber(processor_stub.writer)
+
+    async def test_scan(self, processor_stub):
+        await processor_stub.process_command((Command.SET, "a", "1"))
+        await processor_stub.process_command((Command.RPUSH, "b", "1"))
+        await processor_stub.process_command((Command.SET, "c", "1"))
+        await processor_stub.process_command((Command.SCAN, "0", "COUNT", "2"))
+        assert (
+            processor_stub.writer.response[3]
+            == b"*2\r\n$1\r\n2\r\n*2\r\n$1\r\na\r\n$1\r\nb\r\n"
+        )
+        await processor_stub.process_command((Command.SCAN, "2", "COUNT", "2"))
+        assert (
+            processor_stub.writer.response[4] == b"*2\r\n$1\r\n0\r\n*1\r\n$1\r\nc\r\n"
+        )
+        await processor_stub.process_command((Command.SCAN, "0", "TYPE", "list"))
+        assert (
+            processor_stub.writer.response[5] == b"*2\r\n$1\r\n0\r\n*1\r\n$1\r\nb\r\n"
+        )
+        await processor_stub.process_command((Command.SCAN, "0", "COUNT"))
+        assert processor_stub.writer.response[6] == b"-ERR syntax error\r\n"
+        for command, error in [
+            ((Command.SCAN, "x"), b"-ERR invalid cursor\r\n"),
+            ((Command.SCAN, "-1"), b"-ERR invalid cursor\r\n"),
+            (
+                (Command.SCAN, "0", "COUNT", "x"),
+                b"-ERR value is not an integer or out of range\r\n",
+            ),
+            ((Command.SCAN, "0", "COUNT", "0"), b"-ERR syntax error\r\n"),
+        ]:
+            await processor_stub.process_command(command)
+            assert processor_stub.writer.response[-1] == error
+
+    async def test_del_and_unlink(self, processor_stub):
+        await processor_stub.process_command((Command.SET, "a", "1"))
+        await processor_stub.process_command(
+            (Command.RPUSH, "big", *[str(i) for i in range(1000)])
+        )
+        await processor_stub.process_command((Command.SET, "c", "1"))
+        await processor_stub.process_command((Command.DEL, "a", "missing"))
+        assert processor_stub.writer.response[3] == b":1\r\n"
+        await processor_stub.process_command((Command.UNLINK, "big", "c", "a"))
+        assert processor_stub.writer.response[4] == b":2\r\n"
+        assert processor_stub.storage.data == {}
+
+        # Keys whose time passed are not counted, even before active expiry
+        past = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        processor_stub.storage.data["old"] = Value("1", past)
+        processor_stub.storage.data["older"] = Value("1", past)
+        await processor_stub.process_command((Command.DEL, "old"))
+        await processor_stub.process_command((Command.UNLINK, "older"))
+        assert processor_stub.writer.response[5:] == [b":0\r\n", b":0\r\n"]
+        assert processor_stub.storage.data == {}
+
+    async def test_flushall(self, processor_stub):
+        await processor_stub.process_command((Command.SET, "a", "1"))
+        await processor_stub.process_command((Command.FLUSHALL,))
+        assert processor_stub.writer.response[1] == b"+OK\r\n"
+        assert processor_stub.storage.data == {}
+        await processor_stub.process_command((Command.SET, "a", "1"))
+        await processor_stub.process_command((Command.FLUSHALL, "ASYNC"))
+        assert processor_stub.writer.response[3] == b"+OK\r\n"
+        assert processor_stub.storage.data == {}
+        await processor_stub.process_command((Command.GET, "a"))
+        assert processor_stub.writer.response[4] == b"$-1\r\n"
+
+    async def test_mset_mget(self, processor_stub):
+        await processor_stub.process_command((Command.MSET, "a", "1", "b", "22"))
+        assert processor_stub.writer.response[0] == b"+OK\r\n"
+        await processor_stub.process_command((Command.RPUSH, "list", "x"))
+        await processor_stub.process_command(
+            (Command.MGET, "a", "missing", "b", "list")
+        )
+        assert (
+            processor_stub.writer.response[2]
+            == b"*4\r\n$1\r\n1\r\n$-1\r\n$2\r\n22\r\n$-1\r\n"
+        )
+        await processor_stub.process_command((Command.MSET, "a"))
+        assert processor_stub.writer.response[3].startswith(b"-ERR wrong number")
+
+    async def test_msetnx(self, processor_stub):
+        await processor_stub.process_command((Command.MSETNX, "a", "1", "b", "2"))
+        assert processor_stub.writer.response[0] == b":1\r\n"
+        await processor_stub.process_command((Command.MSETNX, "b", "3", "c", "4"))
+        assert processor_stub.writer.response[1] == b":0\r\n"
+        assert processor_stub.storage.get("c") is None
+        await processor_stub.process_command((Command.MSETNX, "a", "1", "b"))
+        assert processor_stub.writer.response[2] == (
+            b"-ERR wrong number of arguments for 'msetnx' command\r\n"
+        )
+
+    async def test_incr_family(self, processor_stub):
+        await processor_stub.process_command((Command.SET, "counter", "10"))
+        assert processor_stub.storage.get("counter").item == 10
+        await processor_stub.process_command((Command.INCR, "counter"))
+        assert processor_stub.writer.response[1] == b":11\r\n"
+        await processor_stub.process_command((Command.DECRBY, "counter", "20"))
+        assert processor_stub.writer.response[2] == b":-9\r\n"
+        await processor_stub.process_command((Command.GET, "counter"))
+        assert processor_stub.writer.response[3] == b"$2\r\n-9\r\n"
+        await processor_stub.process_command((Command.INCRBYFLOAT, "counter", "1.5"))
+        assert processor_stub.writer.response[4] == b"$4\r\n-7.5\r\n"
+        await processor_stub.process_command((Command.INCRBY, "counter", "x"))
+        assert processor_stub.writer.response[5] == (
+            b"-ERR value is not an integer or out of range\r\n"
+        )
+        await processor_stub.process_command((Command.RPUSH, "list", "x"))
+        await processor_stub.process_command((Command.INCR, "list"))
+        assert processor_stub.writer.response[7].startswith(b"-WRONGTYPE")
+
+    async def test_incrbyfloat_formatting(self, processor_stub):
+        response = processor_stub.writer.response
+        await processor_stub.process_command((Command.INCRBYFLOAT, "f", "0.1"))
+        await processor_stub.process_command((Command.INCRBYFLOAT, "f", "0.2"))
+        assert response[1] == b"$3\r\n0.3\r\n"
+        await processor_stub.process_command((Command.INCRBYFLOAT, "f", "2.70"))
+        assert response[2] == b"$1\r\n3\r\n"
+        assert processor_stub.storage.get("f").item == 3
+        await processor_stub.process_command((Command.INCRBYFLOAT, "f", "1e-20"))
+        assert response[3] == b"$1\r\n3\r\n"
+        await processor_stub.process_command((Command.INCRBYFLOAT, "f", "5e3"))
+        assert response[4] == b"$4\r\n5003\r\n"
+        await processor_stub.process_command(
+            (Command.INCRBYFLOAT, "f", "0.123456789012345678")
+        )
+        assert response[5] == b"$18\r\n5003.1234567890123\r\n"
+        await processor_stub.process_command((Command.INCRBYFLOAT, "f", "nan"))
+        assert response[6] == b"-ERR value is not a valid float\r\n"
+        await processor_stub.process_command((Command.INCRBYFLOAT, "f", "inf"))
+        assert response[7] == b"-ERR increment would produce NaN or Infinity\r\n"
+
+    async def test_append_getrange_setrange_strlen(self, processor_stub):
+        await processor_stub.process_command((Command.APPEND, "key", "Hello"))
+        assert processor_stub.writer.response[0] == b":5\r\n"
+        await processor_stub.process_command((Command.SETRANGE, "key", "5", " World"))
+        assert processor_stub.writer.response[1] == b":11\r\n"
+        await processor_stub.process_command((Command.GETRANGE, "key", "-5", "-1"))
+        assert processor_stub.writer.response[2] == b"$5\r\nWorld\r\n"
+        await processor_stub.process_command((Command.STRLEN, "key"))
+        assert processor_stub.writer.response[3] == b":11\r\n"
+        await processor_stub.process_command((Command.GET, "key"))
+        assert processor_stub.writer.response[4] == b"$11\r\nHello World\r\n"
+
+    async def test_set_options(self, processor_stub):
+        await processor_stub.process_command(
+            (Command.SET, "lock", "a", "NX", "PX", 500)
+        )
+        assert processor_stub.writer.response[0] == b"+OK\r\n"
+        await processor_stub.process_command(
+            (Command.SET, "lock", "b", "NX", "PX", 500)
+        )
+        assert processor_stub.writer.response[1] == b"$-1\r\n"
+        await processor_stub.process_command(
+            (Command.SET, "lock", "c", "KEEPTTL", "GET")
+        )
+        assert processor_stub.writer.response[2] == b"$1\r\na\r\n"
+        assert processor_stub.storage.get("lock").item == "c"
+        assert processor_stub.storage.get("lock").expire is not None
+        await processor_stub.process_command((Command.SET, "missing", "x", "XX"))
+        assert processor_stub.writer.response[3] == b"$-1\r\n"
+        assert processor_stub.storage.get("missing") is None
+        await processor_stub.process_command(
+            (Command.SET, "lock", "d", "EXAT", int(time.time()) + 100)
+        )
+        remaining = processor_stub.storage.get("lock").expire - datetime.datetime.now()
+        assert 90 < remaining.total_seconds() <= 100
+        await processor_stub.process_command((Command.SET, "lock", "e"))
+        assert processor_stub.storage.get("lock").expire is None
+
+    async def test_set_option_errors(self, processor_stub):
+        await processor_stub.process_command((Command.SET, "k", "v", "NX", "XX"))
+        assert processor_stub.writer.response[0] == b"-ERR syntax error\r\n"
+        await processor_stub.process_command(
+            (Command.SET, "k", "v", "EX", 10, "KEEPTTL")
+        )
+        assert processor_stub.writer.response[1] == b"-ERR syntax error\r\n"
+        await processor_stub.process_command((Command.SET, "k", "v", "PX", "soon"))
+        assert processor_stub.writer.response[2] == (
+            b"-ERR value is not an integer or out of range\r\n"
+        )
+        await processor_stub.process_command((Command.RPUSH, "list", "x"))
+        await processor_stub.process_command((Command.SET, "list", "v", "GET"))
+        assert processor_stub.writer.response[4].startswith(b"-WRONGTYPE")
+        assert processor_stub.storage.get_type("list") == ValueType.LIST
+        for option, amount in (("EX", 0), ("PX", -5), ("EXAT", "0"), ("PXAT", -1)):
+            await processor_stub.process_command(
+                (Command.SET, "k", "v", option, amount)
+            )
+        assert (
+            processor_stub.writer.response[5:]
+            == [b"-ERR invalid expire time in 'set' command\r\n"] * 4
+        )
+        assert processor_stub.storage.get("k") is None
+
+    async def test_set_get_old_encodings(self, processor_stub, tmp_path):
+        response = processor_stub.writer.response
+        await processor_stub.process_command((Command.SET, "n", "12"))
+        await processor_stub.process_command((Command.SET, "n", "x", "GET"))
+        assert response[1] == b"$2\r\n12\r\n"
+        await processor_stub.process_command((Command.APPEND, "log", "ab"))
+        await processor_stub.process_command((Command.SET, "log", "x", "GET"))
+        assert response[3] == b"$2\r\nab\r\n"
+        tier = ColdTier(str(tmp_path), 1024)
+        processor_stub.storage.data["cold"] = Value(tier.store(b"frozen"))
+        await processor_stub.process_command((Command.SET, "cold", "x", "GET"))
+        assert response[4] == b"$6\r\nfrozen\r\n"
+        await processor_stub.process_command((Command.PFADD, "hll", "a"))
+        dump = processor_stub.storage.get("hll").item.dump()
+        await processor_stub.process_command((Command.SET, "hll", "x", "GET"))
+        assert response[6] == b"$%d\r\n%s\r\n" % (len(dump), dump)
+        await processor_stub.process_command((Command.SET, "new", "x", "GET"))
+        assert response[7] == b"$-1\r\n"
+
+    async def test_hello(self, processor_stub):
+        await processor_stub.process_command((Command.HELLO, "3", "SETNAME", "app"))
+        reply = processor_stub.writer.response[0]
+        assert reply.startswith(b"%7\r\n$6\r\nserver\r\n$5\r\nredis\r\n")
+        assert b"$5\r\nproto\r\n:3\r\n" in reply
+        assert processor_stub.protocol == 3
+        assert processor_stub.name == "app"
+        await processor_stub.process_command((Command.HELLO, "4"))
+        assert processor_stub.writer.response[1].startswith(b"-NOPROTO")
+
+    async def test_client_tracking(self, processor_stub):
+        await processor_stub.process_command((Command.CLIENT, "TRACKING", "ON"))
+        assert processor_stub.writer.response[0].startswith(b"-ERR client tracking")
+        await processor_stub.process_command((Command.HELLO, "3"))
+        await processor_stub.process_command((Command.CLIENT, "TRACKING", "ON"))
+        assert processor_stub.writer.response[2] == b"+OK\r\n"
+        try:
+            await processor_stub.process_command((Command.SET, "foo", "1"))
+            await processor_stub.process_command((Command.GET, "foo"))
+            other = Processor(type(processor_stub.writer)(), processor_stub.storage)
+            await other.process_command((Command.INCR, "foo"))
+            assert processor_stub.writer.response[5] == (
+                b">2\r\n$10\r\ninvalidate\r\n*1\r\n$3\r\nfoo\r\n"
+            )
+            # Not read again, so not invalidated again
+            await other.process_command((Command.INCR, "foo"))
+            assert len(processor_stub.writer.response) == 6
+        finally:
+            await processor_stub.process_command((Command.CLIENT, "TRACKING", "OFF"))
+
+    async def test_databases(self, processor_stub):
+        processor = Processor(processor_stub.writer, Storage())
+        response = processor.writer.response
+        await processor.process_command((Command.SET, "a", "1"))
+        await processor.process_command((Command.SELECT, "1"))
+        await processor.process_command((Command.GET, "a"))
+        assert response[2] == b"$-1\r\n"
+        await processor.process_command((Command.SET, "b", "2"))
+        await processor.process_command((Command.DBSIZE,))
+        assert response[4] == b":1\r\n"
+        await processor.process_command((Command.SWAPDB, "0", "1"))
+        await processor.process_command((Command.GET, "a"))
+        assert response[6] == b"$1\r\n1\r\n"
+        await processor.process_command((Command.INFO, "keyspace"))
+        assert b"db0:keys=1,expires=0" in response[7]
+        assert b"db1:keys=1,expires=0" in response[7]
+        await processor.process_command((Command.FLUSHDB,))
+        await processor.process_command((Command.DBSIZE,))
+        assert response[9] == b":0\r\n"
+        await processor.process_command((Command.SELECT, "0"))
+        await processor.process_command((Command.DBSIZE,))
+        assert response[11] == b":1\r\n"
+        await processor.process_command((Command.FLUSHALL,))
+        await processor.process_command((Command.SELECT, "99"))
+        assert response[13] == b"-ERR DB index is out of range\r\n"
+
+    async def test_debug_profile(self, processor_stub, monkeypatch, tmp_path):
+        monkeypatch.setattr("app.processor.config.profile_dir", str(tmp_path))
+        response = processor_stub.writer.response
+        await processor_stub.process_command((Command.DEBUG, "PROFILE", "STOP"))
+        assert response[0] == b"-ERR profiler is not running\r\n"
+        await processor_stub.process_command((Command.DEBUG, "PROFILE", "START", "x"))
+        assert response[1].startswith(b"-ERR value is not an integer")
+        await processor_stub.process_command((Command.DEBUG, "PROFILE", "START"))
+        assert response[2] == b"+OK\r\n"
+        await processor_stub.process_command((Command.PING,))
+        await processor_stub.process_command((Command.DEBUG, "PROFILE", "STOP"))
+        path = response[4].split(b"\r\n")[1].decode()
+        assert path.startswith(str(tmp_path)) and path.endswith(".folded")
+        await processor_stub.process_command((Command.DEBUG, "SLEEP", "0"))
+        assert response[5] == b"-ERR unknown subcommand 'sleep 0'\r\n"
+
+        # A profile that cannot be written is an error, profiling still stops
+        monkeypatch.setattr("app.processor.config.profile_dir", str(tmp_path / "no"))
+        await processor_stub.process_command((Command.DEBUG, "PROFILE", "START"))
+        await processor_stub.process_command((Command.DEBUG, "PROFILE", "STOP"))
+        assert response[7].startswith(b"-ERR [Errno 2] No such file or directory")
+        await processor_stub.process_command((Command.DEBUG, "PROFILE", "START"))
+        assert response[8] == b"+OK\r\n"
+        monkeypatch.setattr("app.processor.config.profile_dir", str(tmp_path))
+        await processor_stub.process_command((Command.DEBUG, "PROFILE", "STOP"))
+        assert response[9].endswith(b".folded\r\n")
+
+    async def test_object_and_hotkeys(self, processor_stub):
+        processor = Processor(processor_stub.writer, Storage())
+        response = processor.writer.response
+        await processor.process_command((Command.SET, "n", "12"))
+        await processor.process_command((Command.RPUSH, "list", "a"))
+        await processor.process_command((Command.OBJECT, "ENCODING", "n"))
+        assert response[2] == b"$3\r\nint\r\n"
+        await processor.process_command((Command.OBJECT, "ENCODING", "list"))
+        assert response[3] == b"$8\r\nlistpack\r\n"
+        await processor.process_command((Command.OBJECT, "FREQ", "n"))
+        assert response[4].startswith(b"-ERR access tracking is disabled")
+
+        processor.storage.enable_access_tracking()
+        for _ in range(3):
+            await processor.process_command((Command.GET, "n"))
+        await processor.process_command((Command.LRANGE, "list", "0", "-1"))
+        await processor.process_command((Command.OBJECT, "FREQ", "n"))
+        assert response[9] == b":3\r\n"
+        await processor.process_command((Command.OBJECT, "IDLETIME", "n"))
+        assert response[10] == b":0\r\n"
+        await processor.process_command((Command.OBJECT, "FREQ", "missing"))
+        assert response[11] == b"$-1\r\n"
+        await processor.process_command((Command.HOTKEYS, "1"))
+        assert response[12] == b"*1\r\n*2\r\n$1\r\nn\r\n:3\r\n"
+
+    async def test_hyperloglog(self, processor_stub):
+        response = processor_stub.writer.response
+        members = [f"user:{idx}" for idx in range(1000)]
+        await processor_stub.process_command((Command.PFADD, "day1", *members))
+        assert response[0] == b":1\r\n"
+        await processor_stub.process_command((Command.PFADD, "day1", "user:1"))
+        assert response[1] == b":0\r\n"
+        await processor_stub.process_command((Command.PFCOUNT, "day1"))
+        assert abs(int(response[2][1:-2]) - 1000) < 20
+        await processor_stub.process_command(
+            (Command.PFADD, "day2", *[f"user:{idx}" for idx in range(500, 1500)])
+        )
+        await processor_stub.process_command((Command.PFMERGE, "week", "day1", "day2"))
+        assert response[4] == b"+OK\r\n"
+        await processor_stub.process_command((Command.PFCOUNT, "week"))
+        await processor_stub.process_command((Command.PFCOUNT, "day1", "day2"))
+        assert response[5] == response[6]
+        assert abs(int(response[5][1:-2]) - 1500) < 30
+        await processor_stub.process_command((Command.TYPE, "week"))
+        assert response[7] == b"+hyperloglog\r\n"
+
+        # The string form restores the registers, as a replica snapshot does
+        await processor_stub.process_command((Command.GET, "week"))
+        dump = response[8].split(b"\r\n")[1].decode()
+        await processor_stub.process_command((Command.SET, "copy", dump))
+        await processor_stub.process_command((Command.PFCOUNT, "copy"))
+        assert response[10] == response[5]
+        await processor_stub.process_command((Command.SET, "text", "hello"))
+        await processor_stub.process_command((Command.PFADD, "text", "a"))
+        assert response[12] == (
+            b"-WRONGTYPE Key is not a valid HyperLogLog string value.\r\n"
+        )
+
+    async def test_bitmaps(self, processor_stub):
+        response = processor_stub.writer.response
+        await processor_stub.process_command((Command.SETBIT, "flags", "7", "1"))
+        assert response[0] == b":0\r\n"
+        await processor_stub.process_command((Command.SETBIT, "flags", "7", "1"))
+        assert response[1] == b":1\r\n"
+        await processor_stub.process_command((Command.GET, "flags"))
+        assert response[2] == b"$1\r\n\x01\r\n"
+        await processor_stub.process_command((Command.GETBIT, "flags", "100"))
+        assert response[3] == b":0\r\n"
+
+        await processor_stub.process_command((Command.SET, "text", "foobar"))
+        await processor_stub.process_command((Command.BITCOUNT, "text"))
+        assert response[5] == b":26\r\n"
+        await processor_stub.process_command((Command.BITCOUNT, "text", "1", "1"))
+        assert response[6] == b":6\r\n"
+        await processor_stub.process_command(
+            (Command.BITCOUNT, "text", "5", "30", "BIT")
+        )
+        assert response[7] == b":17\r\n"
+        await processor_stub.process_command((Command.BITPOS, "text", "0"))
+        assert response[8] == b":0\r\n"
+        await processor_stub.process_command(
+            (Command.BITPOS, "text", "1", "2", "-1", "BYTE")
+        )
+        assert response[9] == b":17\r\n"
+        await processor_stub.process_command(
+            (Command.BITFIELD, "ones", "SET", "u8", "0", "255")
+        )
+        # No clear bit and no end given, the first one past the string
+        await processor_stub.process_command((Command.BITPOS, "ones", "0"))
+        assert response[11] == b":8\r\n"
+        await processor_stub.process_command((Command.BITPOS, "missing", "0"))
+        assert response[12] == b":0\r\n"
+
+        await processor_stub.process_command(
+            (Command.BITOP, "AND", "both", "text", "flags")
+        )
+        assert response[13] == b":6\r\n"
+        await processor_stub.process_command((Command.BITCOUNT, "both"))
+        assert response[14] == b":0\r\n"
+        await processor_stub.process_command((Command.BITOP, "NOT", "x", "a", "b"))
+        assert response[15] == (
+            b"-ERR BITOP NOT must be called with a single source key.\r\n"
+        )
+
+        await processor_stub.process_command(
+            (
+                Command.BITFIELD,
+                "counters",
+                "INCRBY",
+                "u8",
+                "#1",
+                "200",
+                "GET",
+                "u8",
+                "8",
+            )
+        )
+        assert response[16] == b"*2\r\n:200\r\n:200\r\n"
+        await processor_stub.process_command(
+            (
+                Command.BITFIELD,
+                "counters",
+                "OVERFLOW",
+                "FAIL",
+                "INCRBY",
+                "u8",
+                "8",
+                "100",
+            )
+        )
+        assert response[17] == b"*1\r\n$-1\r\n"
+        await processor_stub.process_command((Command.STRLEN, "counters"))
+        assert response[18] == b":2\r\n"
+        await processor_stub.process_command(
+            (Command.BITFIELD, "counters", "OVERFLOW", "BAD", "GET", "u8", "0")
+        )
+        assert response[19] == b"-ERR Invalid OVERFLOW type specified\r\n"
+        await processor_stub.process_command((Command.SETBIT, "flags", "-1", "1"))
+        assert response[20] == b"-ERR bit offset is not an integer or out of range\r\n"
+        await processor_stub.process_command((Command.SETBIT, "flags", "1", "2"))
+        assert response[21] == b"-ERR bit is not an integer or out of range\r\n"
+        await processor_stub.process_command((Command.BITPOS, "flags", "2"))
+        assert response[22] == b"-ERR The bit argument must be 1 or 0.\r\n"
@@ -0,0 +1,54 @@
+import pstats
+import sys
+import time
+
+import pytest
+
+from app.profiler import Profiler, collapse_stack
+
+
+def busy_loop(seconds: float) -> int:
+    total, deadline = 0, time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        total += 1
+    return total
+
+
+class TestProfiler:
+    def test_sampling(self, tmp_path):
+        profiler = Profiler()
+        profiler.start_sampling(500)
+        with pytest.raises(RuntimeError):
+            profiler.start_cprofile()
+        busy_loop(0.2)
+        path = profiler.stop(str(tmp_path))
+        assert not profiler.running
+        assert path.endswith(".folded")
+        lines = open(path).read().splitlines()
+        assert lines
+        stack, count = lines[0].rsplit(" ", 1)
+        assert int(count) > 0
+        assert any("busy_loop" in line for line in lines)
+
+    def test_cprofile(self, tmp_path):
+        profiler = Profiler()
+        profiler.start_cprofile()
+        busy_loop(0.01)
+        path = profiler.stop(str(tmp_path))
+        assert path.endswith(".pstats")
+        functions = {name for _, _, name in pstats.Stats(path).stats}
+        assert "busy_loop" in functions
+        with pytest.raises(RuntimeError):
+            profiler.stop(str(tmp_path))
+
+    def test_invalid_rate(self):
+        with pytest.raises(ValueError):
+            Profiler().start_sampling(0)
+
+    def test_collapse_stack(self):
+        def inner():
+            return collapse_stack(sys._getframe())
+
+        names = inner().split(";")
+        assert names[-1].startswith("TestProfiler.test_collapse_stack.<locals>.inner (")
+        assert names[-2].startswith("TestProfiler.test_collapse_stack (")
@@ -0,0 +1,100 @@
+import pytest
+
+from app.config import config
+from app.pubsub import PatternIndex, PubSub
+
+
+class Subscriber:
+    def __init__(self, buffered: int = 0):
+        self.response = []
+        self.closed = False
+        self.transport = self
+        self.buffered = buffered
+
+    def write(self, data: bytes) -> None:
+        self.response.append(data)
+
+    def close(self) -> None:
+        self.closed = True
+
+    def get_write_buffer_size(self) -> int:
+        return self.buffered
+
+
+@pytest.fixture(scope="function")
+def pubsub():
+    return PubSub()
+
+
+class TestPatternIndex:
+    def test_match(self):
+        index = PatternIndex()
+        index.add("news.*", "a")
+        index.add("news.sp?rt", "b")
+        index.add("*", "c")
+        index.add("orders.*", "d")
+        matched = {pattern: subs for pattern, subs in index.match("news.sport")}
+        assert matched == {"news.*": {"a"}, "news.sp?rt": {"b"}, "*": {"c"}}
+        assert index.patterns() == 4
+
+    def test_remove(self):
+        index = PatternIndex()
+        index.add("news.*", "a")
+        index.add("*", "b")
+        index.remove("news.*", "a")
+        assert index.buckets.keys() == {""}
+        assert index.prefix_lengths == [0]
+        index.remove("*", "b")
+        assert index.buckets == {}
+        assert index.prefix_lengths == []
+
+
+class TestPubSub:
+    def test_publish_channel(self, pubsub):
+        first, second = Subscriber(), Subscriber()
+        assert pubsub.subscribe(first, "news") == 1
+        assert pubsub.subscribe(second, "news") == 1
+        assert pubsub.publish("news", "hi") == 2
+        assert first.response == [b"*3\r\n$7\r\nmessage\r\n$4\r\nnews\r\n$2\r\nhi\r\n"]
+        # The same encoded bytes are shared by all subscribers
+        assert first.response[0] is second.response[0]
+        assert pubsub.publish("other", "hi") == 0
+
+    def test_publish_pattern(self, pubsub):
+        subscriber = Subscriber()
+        assert pubsub.psubscribe(subscriber, "news.*") == 1
+        assert pubsub.subscribe(subscriber, "news.sport") == 2
+        assert pubsub.publish("news.sport", "goal") == 2
+        assert subscriber.response == [
+            b"*3\r\n$7\r\nmessage\r\n$10\r\nnews.sport\r\n$4\r\ngoal\r\n",
+            b"*4\r\n$8\r\npmessage\r\n$6\r\nnews.*\r\n$10\r\nnews.sport\r\n$4\r\ngoal\r\n",
+        ]
+
+    def test_unsubscribe(self, pubsub):
+        subscriber = Subscriber()
+        pubsub.subscribe(subscriber, "news")
+        pubsub.psubscribe(subscriber, "news.*")
+        assert pubsub.unsubscribe(subscriber, "news") == 1
+        assert pubsub.punsubscribe(subscriber, "news.*") == 0
+        assert not pubsub.is_subscribed(subscriber)
+        assert pubsub.channels == {}
+
+    def test_remove_subscriber(self, pubsub):
+        subscriber = Subscriber()
+        pubsub.subscribe(subscriber, "a")
+        pubsub.subscribe(subscriber, "b")
+        pubsub.psubscribe(subscriber, "c*")
+        pubsub.remove_subscriber(subscriber)
+        assert not pubsub.is_subscribed(subscriber)
+        assert pubsub.publish("a", "x") == 0
+        assert pubsub.publish("cc", "x") == 0
+
+    def test_slow_subscriber_disconnected(self, pubsub):
+        fast = Subscriber()
+        slow = Subscriber(buffered=config.pubsub_output_buffer_limit + 1)
+        pubsub.subscribe(fast, "news")
+        pubsub.subscribe(slow, "news")
+        assert pubsub.publish("news", "hi") == 1
+        assert slow.closed
+        assert slow.response == []
+        assert not pubsub.is_subscribed(slow)
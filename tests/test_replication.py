@@ -0,0 +1,242 @@
+import asyncio
+import time
+
+import pytest
+
+from app.parser import Command, parser
+from app.processor import Processor
+from app.replication import ReplicationBacklog, replication, snapshot
+from app.storage import Storage, string_bytes
+from tests.servers import free_port, request, start_server
+
+
+class Writer:
+    def __init__(self):
+        self.response = []
+
+    def write(self, current_response: bytes) -> None:
+        self.response.append(current_response)
+
+    async def drain(self):
+        pass
+
+
+@pytest.fixture(scope="function")
+def master():
+    yield replication
+    replication.replicas.clear()
+    replication.backlog = None
+    replication.offset = 0
+    replication.selected_db = 0
+
+
+class TestReplicationBacklog:
+    def test_read_from(self):
+        backlog = ReplicationBacklog(8)
+        backlog.append(b"abc")
+        backlog.append(b"def")
+        assert backlog.offset == 6
+        assert backlog.read_from(0) == b"abcdef"
+        assert backlog.read_from(4) == b"ef"
+        assert backlog.read_from(6) == b""
+        assert backlog.read_from(7) is None
+
+    def test_wrap_around(self):
+        backlog = ReplicationBacklog(8, offset=100)
+        backlog.append(b"abcdef")
+        backlog.append(b"ghij")
+        assert backlog.read_from(102) == b"cdefghij"
+        assert backlog.read_from(101) is None
+        backlog.append(b"0123456789")
+        assert backlog.read_from(112) == b"23456789"
+        assert backlog.read_from(111) is None
+
+
+@pytest.mark.asyncio
+class TestReplication:
+    async def test_snapshot_round_trip(self):
+        source = Processor(Writer(), Storage())
+        await source.process_command((Command.SET, "foo", "bar"))
+        await source.process_command((Command.SET, "tmp", "x", "PX", "100000"))
+        await source.process_command((Command.RPUSH, "list", "a", "b"))
+        await source.process_command((Command.XADD, "stream", "1-1", "f", "v"))
+
+        target = Processor(Writer(), Storage())
+        commands, _ = parser.parse_commands(snapshot(source.storage))
+        for command in commands:
+            await target.process_command(command)
+
+        assert target.storage.data["foo"] == source.storage.data["foo"]
+        assert target.storage.data["list"] == source.storage.data["list"]
+        assert target.storage.data["stream"] == source.storage.data["stream"]
+        assert target.storage.data["tmp"].expire is not None
+
+    async def test_snapshot_round_trip_of_stream_groups(self):
+        source = Processor(Writer(), Storage())
+        for seq in range(1, 5):
+            await source.process_command((Command.XADD, "jobs", f"1-{seq}", "n", "v"))
+        await source.process_command((Command.XDEL, "jobs", "1-4"))
+        await source.process_command((Command.XGROUP, "CREATE", "jobs", "workers", "0"))
+        await source.process_command(
+            (Command.XGROUP, "CREATECONSUMER", "jobs", "workers", "idle")
+        )
+        await source.process_command(
+            (Command.XREADGROUP, "GROUP", "workers", "bob", "COUNT", "2")
+            + ("STREAMS", "jobs", ">")
+        )
+        await source.process_command(
+            (Command.XCLAIM, "jobs", "workers", "alice", "0", "1-2", "RETRYCOUNT", "5")
+        )
+        await source.process_command(
+            (Command.XGROUP, "CREATE", "empty", "g", "$", "MKSTREAM")
+        )
+
+        target = Processor(Writer(), Storage())
+        commands, _ = parser.parse_commands(snapshot(source.storage))
+        for command in commands:
+            await target.process_command(command)
+
+        for key in ("jobs", "empty"):
+            mine, theirs = source.storage.data[key], target.storage.data[key]
+            assert theirs == mine
+            assert (theirs.last_id, theirs.entries_added, theirs.max_deleted_id) == (
+                mine.last_id,
+                mine.entries_added,
+                mine.max_deleted_id,
+            )
+            assert theirs.groups.keys() == mine.groups.keys()
+        group, copy = (
+            storage.data["jobs"].groups["workers"]
+            for storage in (source.storage, target.storage)
+        )
+        assert copy.last_delivered == group.last_delivered == (1, 2)
+        assert copy.consumers.keys() == group.consumers.keys()
+        assert copy.pending == group.pending
+        assert copy.consumers["alice"].pending == [(1, 2)]
+
+    async def test_psync_with_an_invalid_offset_gets_a_full_resync(self, master):
+        replica = Writer()
+        await Processor(replica, Storage()).process_command((Command.PSYNC, "?", "abc"))
+        assert replica.response[0].startswith(b"+FULLRESYNC")
+
+    async def test_snapshot_round_trip_of_a_bitmap(self):
+        source = Processor(Writer(), Storage())
+        await source.process_command((Command.SETBIT, "dau", "0", "1"))
+        await source.process_command((Command.SETBIT, "dau", "17", "1"))
+
+        target = Processor(Writer(), Storage())
+        commands, _ = parser.parse_commands(snapshot(source.storage))
+        for command in commands:
+            await target.process_command(command)
+
+        assert bytes(string_bytes(target.storage.data["dau"].item)) == b"\x80\x00\x40"
+        target.writer = Writer()
+        await target.process_command((Command.GET, "dau"))
+        await target.process_command((Command.GETBIT, "dau", "17"))
+        await target.process_command((Command.BITCOUNT, "dau"))
+        assert target.writer.response == [
+            b"$3\r\n\x80\x00\x40\r\n",
+            b":1\r\n",
+            b":2\r\n",
+        ]
+
+    async def test_full_then_partial_resync(self, master):
+        client = Processor(Writer(), Storage())
+        await client.process_command((Command.SET, "before", "1"))
+
+        replica = Writer()
+        await Processor(replica, client.storage).process_command(
+            (Command.PSYNC, "?", "-1")
+        )
+        header = replica.response[0].decode()
+        assert header == f"+FULLRESYNC {master.replid} 0\r\n"
+        assert replica.response[1].endswith(b"$6\r\nbefore\r\n$1\r\n1\r\n")
+
+        await client.process_command((Command.SET, "after", "2"))
+        await client.process_command((Command.XADD, "s", "*", "f", "v"))
+        stream_id = client.storage.data["s"][0].item["id"]
+        streamed = b"".join(replica.response[2:])
+        assert streamed == (
+            b"*3\r\n$3\r\nSET\r\n$5\r\nafter\r\n$1\r\n2\r\n"
+            + b"*5\r\n$4\r\nXADD\r\n$1\r\ns\r\n$%d\r\n%s\r\n$1\r\nf\r\n$1\r\nv\r\n"
+            % (len(stream_id), stream_id.encode())
+        )
+
+        master.remove_replica(replica)
+        reconnected = Writer()
+        await Processor(reconnected, client.storage).process_command(
+            (Command.PSYNC, master.replid, "0")
+        )
+        assert reconnected.response == [
+            f"+CONTINUE {master.replid}\r\n".encode(),
+            streamed,
+        ]
+
+    async def test_select_is_replicated(self, master):
+        client = Processor(Writer(), Storage())
+        await client.process_command((Command.SELECT, "2"))
+        await client.process_command((Command.SET, "k", "v"))
+
+        target = Processor(Writer(), Storage())
+        commands, _ = parser.parse_commands(snapshot(client.storage))
+        for command in commands:
+            await target.process_command(command)
+        assert "k" not in target.databases.get(0).data
+        assert target.databases.get(2).data["k"].item == "v"
+
+        replica = Writer()
+        await Processor(replica, client.storage).process_command(
+            (Command.PSYNC, "?", "-1")
+        )
+        await client.process_command((Command.SET, "a", "1"))
+        await client.process_command((Command.SET, "b", "2"))
+        assert b"".join(replica.response[2:]) == (
+            b"*2\r\n$6\r\nSELECT\r\n$1\r\n2\r\n"
+            + b"*3\r\n$3\r\nSET\r\n$1\r\na\r\n$1\r\n1\r\n"
+            + b"*3\r\n$3\r\nSET\r\n$1\r\nb\r\n$1\r\n2\r\n"
+        )
+
+    async def test_incrbyfloat_replicates_its_result(self, master):
+        client = Processor(Writer(), Storage())
+        replica = Writer()
+        await Processor(replica, client.storage).process_command(
+            (Command.PSYNC, "?", "-1")
+        )
+        await client.process_command((Command.SET, "f", "0.1", "EX", "100"))
+        await client.process_command((Command.INCRBYFLOAT, "f", "0.2"))
+        assert replica.response[-1] == (
+            b"*4\r\n$3\r\nSET\r\n$1\r\nf\r\n$3\r\n0.3\r\n$7\r\nKEEPTTL\r\n"
+        )
+
+    async def test_reads_only_are_not_replicated(self, master):
+        client = Processor(Writer(), Storage())
+        await Processor(Writer(), client.storage).process_command(
+            (Command.PSYNC, "?", "-1")
+        )
+        await client.process_command((Command.GET, "foo"))
+        await client.process_command((Command.XADD, "s", "0-0", "f", "v"))
+        assert master.offset == 0
+
+
+@pytest.mark.asyncio
+async def test_master_and_replica_processes():
+    master_port, replica_port = free_port(), free_port()
+    master_process = start_server("--port", str(master_port))
+    replica_process = None
+    try:
+        assert await request(master_port, "SET", "foo", "bar") == b"+OK\r\n"
+        replica_process = start_server(
+            "--port", str(replica_port), "--replicaof", f"localhost {master_port}"
+        )
+        assert await request(master_port, "RPUSH", "list", "a") == b":1\r\n"
+
+        deadline = time.monotonic() + 5
+        while await request(replica_port, "LLEN", "list") != b":1\r\n":
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.1)
+        assert await request(replica_port, "GET", "foo") == b"$3\r\nbar\r\n"
+        assert (await request(replica_port, "SET", "x", "y")).startswith(b"-READONLY")
+    finally:
+        master_process.kill()
+        if replica_process is not None:
+            replica_process.kill()
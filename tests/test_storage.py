@@ -1,11 +1,21 @@
 import asyncio
 from collections import deque
+from decimal import Decimal
 from unittest.mock import MagicMock
 import datetime
 
 import pytest
 
-from app.storage import Storage, Value, ValueType
+from app.patterns import compile_glob
+from app.storage import (
+    SHARED_INTEGERS,
+    Databases,
+    Storage,
+    Value,
+    ValueType,
+    WrongTypeError,
+    encode_string,
+)
 
 
 @pytest.fixture(scope="function")
@@ -182,3 +192,180 @@ class TestStorage:
             Value({"id": "1-1", "foo": "bar", "baz": "qux"}),
             Value({"id": "1-3", "foo": "bar", "baz": "qux"}),
         ]
+
+    @pytest.mark.asyncio
+    async def test_scan(self, storage):
+        for idx in range(25):
+            await storage.set(f"key{idx}", Value(idx))
+        cursor, keys = storage.scan(0, 10)
+        assert keys == [f"key{idx}" for idx in range(10)]
+        seen = list(keys)
+        while cursor:
+            cursor, keys = storage.scan(cursor, 10)
+            seen += keys
+        assert seen == [f"key{idx}" for idx in range(25)]
+
+    @pytest.mark.asyncio
+    async def test_scan_with_changes(self, storage):
+        for idx in range(20):
+            await storage.set(f"key{idx}", Value(idx))
+        cursor, seen = storage.scan(0, 5)
+        # Deleting and re-adding keys mid-scan must not hide the stable ones
+        storage.delete("key2")
+        storage.delete("key12")
+        await storage.set("key2", Value("again"))
+        await storage.set("key7", Value("overwritten"))
+        while cursor:
+            cursor, keys = storage.scan(cursor, 5)
+            seen += keys
+        stable = {f"key{idx}" for idx in range(20)} - {"key2", "key12"}
+        assert stable <= set(seen)
+        assert len(seen) == len(set(seen)) + 1  # key2 was reported twice
+
+    @pytest.mark.asyncio
+    async def test_scan_filters(self, storage):
+        await storage.set("user:1", Value("a"))
+        await storage.rpush("user:list", [Value("a")])
+        await storage.set("order:1", Value("b"))
+        expired = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        await storage.set("user:2", Value("c", expire=expired))
+        assert storage.scan(0, 10, compile_glob("user:*")) == (
+            0,
+            ["user:1", "user:list"],
+        )
+        assert storage.scan(0, 10, value_type=ValueType.LIST) == (0, ["user:list"])
+
+    def test_keyspace_compaction(self, storage):
+        for idx in range(3000):
+            storage.data[idx] = Value(idx)
+        for idx in range(2990):
+            del storage.data[idx]
+        assert len(storage.data.order) < 2 * 10 + 1024 + 1
+        assert storage.scan(0, 100)[1] == list(range(2990, 3000))
+
+    @pytest.mark.asyncio
+    async def test_mget(self, storage):
+        past_expiration = datetime.datetime.now() - datetime.timedelta(seconds=2)
+        await storage.set("key1", Value("value1"))
+        await storage.set("key2", Value("value2", expire=past_expiration))
+        await storage.rpush("list", [Value("value1")])
+        assert storage.mget(["key1", "key2", "list", "missing"]) == [
+            Value("value1"),
+            None,
+            None,
+            None,
+        ]
+
+    @pytest.mark.asyncio
+    async def test_mset(self, storage):
+        assert await storage.mset([("key1", Value("a")), ("key2", Value("b"))])
+        assert storage.get("key2") == Value("b")
+        assert not await storage.mset(
+            [("key3", Value("c")), ("key1", Value("d"))], only_new=True
+        )
+        assert storage.get("key3") is None
+        assert storage.get("key1") == Value("a")
+        assert await storage.mset([("key3", Value("c"))], only_new=True)
+
+    def test_encode_string(self):
+        assert encode_string("42") is SHARED_INTEGERS[42]
+        assert encode_string("-17") == -17
+        assert encode_string("9223372036854775807") == 2**63 - 1
+        assert encode_string("9223372036854775808") == "9223372036854775808"
+        for text in ["007", "+1", "1.5", " 1", "", "-0", "١"]:
+            assert encode_string(text) == text
+
+    @pytest.mark.asyncio
+    async def test_incr_by(self, storage):
+        assert storage.incr_by("counter", 5) == 5
+        assert storage.incr_by("counter", -2) == 3
+        assert storage.get("counter").item is SHARED_INTEGERS[3]
+        await storage.set("text", Value("10"))
+        assert storage.incr_by("text", 1) == 11
+        await storage.set("text", Value("abc"))
+        with pytest.raises(ValueError, match="not an integer"):
+            storage.incr_by("text", 1)
+        await storage.set("max", Value(2**63 - 1))
+        with pytest.raises(ValueError, match="overflow"):
+            storage.incr_by("max", 1)
+        await storage.rpush("list", [Value("x")])
+        with pytest.raises(WrongTypeError):
+            storage.incr_by("list", 1)
+
+    def test_incr_by_float(self, storage):
+        assert storage.incr_by_float("price", Decimal("10.5")) == "10.5"
+        assert storage.incr_by_float("price", Decimal("0.5")) == "11"
+        assert isinstance(storage.get("price").item, int)
+        with pytest.raises(ValueError, match="NaN or Infinity"):
+            storage.incr_by_float("price", Decimal("inf"))
+
+    @pytest.mark.asyncio
+    async def test_append_and_ranges(self, storage):
+        assert storage.append("log", "Hello") == 5
+        assert storage.append("log", " World") == 11
+        assert isinstance(storage.get("log").item, bytearray)
+        assert storage.get_range("log", 0, 4) == b"Hello"
+        assert storage.get_range("log", -5, -1) == b"World"
+        assert storage.get_range("log", 5, 1) == b""
+        assert storage.set_range("log", 6, "Redis") == 11
+        assert storage.get("log").item == bytearray(b"Hello Redis")
+        assert storage.set_range("padded", 3, "x") == 4
+        assert storage.get("padded").item == bytearray(b"\x00\x00\x00x")
+        await storage.set("number", Value(12))
+        assert storage.strlen("number") == 2
+        assert storage.append("number", "3") == 3
+        assert storage.incr_by("number", 1) == 124
+        assert storage.strlen("missing") == 0
+
+    @pytest.mark.asyncio
+    async def test_set_options(self, storage):
+        expire = datetime.datetime.now() + datetime.timedelta(seconds=10)
+        assert await storage.set("key", Value("a", expire), only_new=True) == (
+            True,
+            None,
+        )
+        entry = storage.data["key"]
+        assert await storage.set("key", Value("b"), only_new=True) == (False, None)
+        assert await storage.set("key", Value("c"), keep_ttl=True, get=True) == (
+            True,
+            "a",
+        )
+        # The entry is updated in place
+        assert storage.data["key"] is entry
+        assert entry == Value("c", expire)
+        assert await storage.set("other", Value("x"), only_existing=True) == (
+            False,
+            None,
+        )
+        assert "other" not in storage.data
+
+    @pytest.mark.asyncio
+    async def test_access_tracking_ignores_misses(self, storage):
+        storage.enable_access_tracking()
+        await storage.set("x", Value("1"))
+        for idx in range(1000):
+            assert storage.get(f"missing:{idx}") is None
+            assert storage.get_string(f"missing:{idx}") is None
+        assert list(storage.data.access_times) == ["x"]
+        assert [key for key, _ in storage.tracker.hottest(5)] == ["x"]
+
+
+@pytest.mark.asyncio
+class TestDatabases:
+    async def test_get_and_swap(self):
+        databases = Databases()
+        first, second = databases.get(0), databases.get(1)
+        assert databases.get(1) is second
+        with pytest.raises(ValueError):
+            databases.get(-1)
+        await first.set("a", Value("1"))
+        await first.set("tmp", Value("x", expire=datetime.datetime.max))
+        assert len(first.data.volatile) == 1
+        await databases.swap(0, 1)
+        assert "a" not in first.data
+        assert second.data["a"].item == "1"
+        assert databases.keyspace_info() == (
+            "# Keyspace\r\ndb1:keys=2,expires=1,avg_ttl=0\r\n"
+        )
+        second.delete("tmp")
+        assert not second.data.volatile
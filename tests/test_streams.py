@@ -0,0 +1,470 @@
+import asyncio
+
+import pytest
+
+from app.config import config
+from app.parser import Command
+from app.processor import Processor, XaddBatch, coalesce_xadds
+from app.storage import Storage, Value
+from app.streams import ConsumerGroup, Stream, entry_id, parse_stream_id
+
+
+class Writer:
+    def __init__(self):
+        self.response = []
+
+    def write(self, data: bytes) -> None:
+        self.response.append(data)
+
+    async def drain(self):
+        pass
+
+
+def make_stream(count: int) -> Stream:
+    return Stream(
+        Value({"id": f"1-{seq}", "n": str(seq)}) for seq in range(1, count + 1)
+    )
+
+
+class TestConsumerGroup:
+    def test_parse_stream_id(self):
+        assert parse_stream_id("5") == (5, 0)
+        assert parse_stream_id("5", 9) == (5, 9)
+        assert parse_stream_id("5-3") == (5, 3)
+        assert parse_stream_id("-") == (0, 0)
+        with pytest.raises(ValueError):
+            parse_stream_id("x-1")
+
+    def test_read_ack_and_history(self):
+        stream = make_stream(5)
+        group = ConsumerGroup((0, 0))
+        alice = group.consumer("alice", 1000)
+        delivered = stream.read_group(group, alice, None, 3, False, 1000)
+        assert [stream_id for stream_id, _ in delivered] == [(1, 1), (1, 2), (1, 3)]
+        assert group.last_delivered == (1, 3)
+        assert group.pending_ids == alice.pending == [(1, 1), (1, 2), (1, 3)]
+
+        assert group.ack((1, 2))
+        assert not group.ack((1, 2))
+        assert alice.pending == [(1, 1), (1, 3)]
+
+        history = stream.read_group(group, alice, (1, 1), None, False, 2000)
+        assert [stream_id for stream_id, _ in history] == [(1, 3)]
+        assert group.pending[(1, 3)].delivery_count == 2
+        assert group.pending[(1, 3)].delivery_time == 2000
+
+    def test_noack_does_not_fill_the_pel(self):
+        stream = make_stream(2)
+        group = ConsumerGroup((0, 0))
+        delivered = stream.read_group(
+            group, group.consumer("alice", 0), None, None, True, 0
+        )
+        assert len(delivered) == 2
+        assert group.last_delivered == (1, 2) and not group.pending
+
+    def test_pending_range_and_summary(self):
+        stream = make_stream(6)
+        group = ConsumerGroup((0, 0))
+        alice, bob = group.consumer("alice", 0), group.consumer("bob", 0)
+        stream.read_group(group, alice, None, 2, False, 1000)
+        stream.read_group(group, bob, None, 4, False, 5000)
+        assert group.summary() == (6, (1, 1), (1, 6), [("alice", 2), ("bob", 4)])
+
+        assert [i for i, _ in group.pending_range((1, 2), (1, 4), 10)] == [
+            (1, 2),
+            (1, 3),
+            (1, 4),
+        ]
+        assert [i for i, _ in group.pending_range((0, 0), (1, 9), 2, bob)] == [
+            (1, 3),
+            (1, 4),
+        ]
+        idle = group.pending_range((0, 0), (1, 9), 10, min_idle=3000, now=6000)
+        assert [i for i, _ in idle] == [(1, 1), (1, 2)]
+
+    def test_claim_moves_ownership(self):
+        stream = make_stream(3)
+        group = ConsumerGroup((0, 0))
+        alice, bob = group.consumer("alice", 0), group.consumer("bob", 0)
+        stream.read_group(group, alice, None, None, False, 1000)
+
+        assert stream.claim(group, bob, [(1, 1)], 5000, 2000) == []
+        claimed = stream.claim(group, bob, [(1, 1), (1, 2), (1, 9)], 500, 2000)
+        assert [stream_id for stream_id, _ in claimed] == [(1, 1), (1, 2)]
+        assert alice.pending == [(1, 3)] and bob.pending == [(1, 1), (1, 2)]
+        assert group.pending[(1, 1)].delivery_count == 2
+
+        stream.delete([(1, 3)])
+        assert stream.claim(group, bob, [(1, 3)], 0, 3000) == []
+        assert (1, 3) not in group.pending and alice.pending == []
+
+    def test_autoclaim_cursor_and_deleted(self):
+        stream = make_stream(5)
+        group = ConsumerGroup((0, 0))
+        alice, bob = group.consumer("alice", 0), group.consumer("bob", 0)
+        stream.read_group(group, alice, None, None, False, 1000)
+        stream.delete([(1, 2)])
+
+        cursor, claimed, deleted = stream.autoclaim(group, bob, 100, (0, 0), 2, 2000)
+        assert cursor == (1, 4)
+        assert [stream_id for stream_id, _ in claimed] == [(1, 1), (1, 3)]
+        assert deleted == [(1, 2)]
+        cursor, claimed, _ = stream.autoclaim(group, bob, 100, cursor, 10, 2000)
+        assert cursor == (0, 0) and len(claimed) == 2
+        assert alice.pending == []
+
+    def test_delete_consumer(self):
+        stream = make_stream(3)
+        group = ConsumerGroup((0, 0))
+        stream.read_group(group, group.consumer("alice", 0), None, 2, False, 0)
+        stream.read_group(group, group.consumer("bob", 0), None, 1, False, 0)
+        assert group.delete_consumer("alice") == 2
+        assert group.pending_ids == [(1, 3)]
+
+
+class TestStreamTrimming:
+    def test_exact_trim(self):
+        stream = make_stream(10)
+        assert stream.trim(maxlen=4) == 6
+        assert stream.first_id == (1, 7) and len(stream) == 4
+        assert stream.trim(minid=(1, 9)) == 2
+        assert stream.first_id == (1, 9)
+        assert stream.last_id == (1, 10)
+
+    def test_approximate_trim_drops_whole_nodes(self, monkeypatch):
+        monkeypatch.setattr(config, "stream_node_max_entries", 4)
+        stream = make_stream(10)
+        # 7 entries over the cap, only one node of 4 goes
+        assert stream.trim(maxlen=3, approximate=True) == 4
+        assert len(stream) == 6
+        assert stream.trim(maxlen=3, approximate=True) == 0
+        assert stream.trim(maxlen=0, approximate=True, limit=2) == 0
+        # The last node, partly filled, can go as a whole too
+        assert stream.trim(maxlen=0, approximate=True, limit=0) == 6
+        assert len(stream) == 0 and stream.last_id == (1, 10)
+
+    def test_delete_keeps_last_id(self):
+        stream = make_stream(3)
+        assert stream.delete([(1, 3), (1, 1), (1, 7)]) == 2
+        assert [entry.item["id"] for entry in stream] == ["1-2"]
+        assert stream.last_id == (1, 3)
+        assert stream.max_deleted_id == (1, 3)
+
+    def test_nodes(self, monkeypatch):
+        monkeypatch.setattr(config, "stream_node_max_entries", 3)
+        stream = make_stream(10)
+        assert [len(node.ids) for node in stream.nodes] == [3, 3, 3, 1]
+        # An emptied node goes, lookups skip over it
+        assert stream.delete([(1, 4), (1, 5), (1, 6)]) == 3
+        assert [len(node.ids) for node in stream.nodes] == [3, 3, 1]
+        assert stream.find((1, 7)).item["id"] == "1-7"
+        after = stream.entries_after((1, 2), 4)
+        assert [e.item["id"] for e in after] == ["1-3", "1-7", "1-8", "1-9"]
+        # Whole nodes go first, then the front of the next one is cut
+        assert stream.trim(minid=(1, 8)) == 4
+        assert stream.first() == ((1, 8), stream.find((1, 8)))
+        assert stream.last() == ((1, 10), stream.find((1, 10)))
+        assert stream.trim(maxlen=1) == 2 and len(stream) == 1
+
+    def test_ids_follow_the_entries(self):
+        stream = make_stream(10)
+        stream.trim(maxlen=8)
+        stream.delete([(1, 5)])
+        stream.add_many([Value({"id": "2-0"}), Value({"id": "2-1"})], (2, 1))
+        ids = [stream_id for node in stream.nodes for stream_id in node.ids]
+        assert ids == [entry_id(entry) for entry in stream]
+        assert stream.find((1, 4)).item["id"] == "1-4"
+        assert stream.find((1, 5)) is None
+        assert [e.item["id"] for e in stream.entries_after((1, 3), 2)] == ["1-4", "1-6"]
+        assert [e.item["id"] for e in stream.entries_after((1, 9))] == [
+            "1-10",
+            "2-0",
+            "2-1",
+        ]
+
+
+@pytest.mark.asyncio
+class TestStreamCappingCommands:
+    async def test_xadd_maxlen_and_xlen(self):
+        processor = Processor(Writer(), Storage())
+        response = processor.writer.response
+        for seq in range(1, 6):
+            await processor.process_command(
+                (Command.XADD, "events", "MAXLEN", "3", f"1-{seq}", "n", str(seq))
+            )
+        assert response[-1] == b"$3\r\n1-5\r\n"
+        assert processor.replicated == (
+            Command.XADD,
+            ["events", "MAXLEN", "3", "1-5", "n", "5"],
+        )
+        await processor.process_command((Command.XLEN, "events"))
+        assert response[-1] == b":3\r\n"
+        await processor.process_command((Command.XLEN, "missing"))
+        assert response[-1] == b":0\r\n"
+
+        await processor.process_command(
+            (Command.XADD, "missing", "NOMKSTREAM", "*", "n", "1")
+        )
+        assert response[-1] == b"$-1\r\n"
+        await processor.process_command(
+            (Command.XADD, "events", "MAXLEN", "=", "1", "LIMIT", "5", "*", "n", "1")
+        )
+        assert response[-1].startswith(b"-ERR syntax error, LIMIT cannot be used")
+        await processor.process_command((Command.XADD, "events", "*", "n"))
+        assert response[-1] == b"-ERR wrong number of arguments for 'xadd' command\r\n"
+
+    async def test_xtrim_xdel_xinfo(self):
+        processor = Processor(Writer(), Storage())
+        response = processor.writer.response
+        for seq in range(1, 6):
+            await processor.process_command(
+                (Command.XADD, "events", f"1-{seq}", "n", "v")
+            )
+        await processor.process_command((Command.XTRIM, "events", "MINID", "1-3"))
+        assert response[-1] == b":2\r\n"
+        await processor.process_command((Command.XDEL, "events", "1-5", "1-1"))
+        assert response[-1] == b":1\r\n"
+        # The deleted top id cannot be generated again
+        await processor.process_command((Command.XADD, "events", "1-4", "n", "v"))
+        assert response[-1].startswith(b"-ERR The ID specified in XADD is equal")
+
+        await processor.process_command((Command.XINFO, "STREAM", "events"))
+        info = response[-1]
+        assert info.startswith(b"*16\r\n$6\r\nlength\r\n:2\r\n")
+        assert b"$17\r\nlast-generated-id\r\n$3\r\n1-5\r\n" in info
+        assert b"$13\r\nentries-added\r\n:5\r\n" in info
+        assert b"$11\r\nfirst-entry\r\n*2\r\n$3\r\n1-3\r\n" in info
+        assert b"$10\r\nlast-entry\r\n*2\r\n$3\r\n1-4\r\n" in info
+        await processor.process_command((Command.XINFO, "STREAM", "missing"))
+        assert response[-1] == b"-ERR no such key\r\n"
+
+    async def test_xsetid(self):
+        processor = Processor(Writer(), Storage())
+        response = processor.writer.response
+        await processor.process_command((Command.XADD, "events", "1-5", "n", "v"))
+        await processor.process_command((Command.XSETID, "events", "1-4"))
+        assert response[-1].startswith(b"-ERR The ID specified in XSETID is smaller")
+        await processor.process_command(
+            (Command.XSETID, "events", "3-0", "ENTRIESADDED", "0")
+        )
+        assert response[-1].startswith(b"-ERR The entries_added specified")
+        await processor.process_command(
+            (
+                Command.XSETID,
+                "events",
+                "3-0",
+                "ENTRIESADDED",
+                "9",
+                "MAXDELETEDID",
+                "2-0",
+            )
+        )
+        assert response[-1] == b"+OK\r\n"
+        stream = processor.storage.get_stream("events")
+        assert (stream.last_id, stream.entries_added) == ((3, 0), 9)
+        assert stream.max_deleted_id == (2, 0)
+        await processor.process_command((Command.XSETID, "missing", "1-0"))
+        assert response[-1] == b"-ERR no such key\r\n"
+
+
+@pytest.mark.asyncio
+class TestConsumerGroupCommands:
+    async def test_group_workflow(self):
+        storage = Storage()
+        processor = Processor(Writer(), storage)
+        response = processor.writer.response
+        await processor.process_command((Command.XADD, "jobs", "1-1", "task", "a"))
+        await processor.process_command((Command.XADD, "jobs", "1-2", "task", "b"))
+        await processor.process_command(
+            (Command.XGROUP, "CREATE", "jobs", "workers", "0")
+        )
+        assert response[-1] == b"+OK\r\n"
+        await processor.process_command(
+            (Command.XGROUP, "CREATE", "jobs", "workers", "$")
+        )
+        assert response[-1] == b"-BUSYGROUP Consumer Group name already exists\r\n"
+
+        await processor.process_command(
+            (Command.XREADGROUP, "GROUP", "workers", "alice", "COUNT", "1")
+            + ("STREAMS", "jobs", ">")
+        )
+        assert response[-1] == (
+            b"*1\r\n*2\r\n$4\r\njobs\r\n*1\r\n*2\r\n$3\r\n1-1\r\n"
+            b"*2\r\n$4\r\ntask\r\n$1\r\na\r\n"
+        )
+        await processor.process_command((Command.XPENDING, "jobs", "workers"))
+        assert response[-1] == (
+            b":1\r\n".join([b"*4\r\n", b"$3\r\n1-1\r\n$3\r\n1-1\r\n*1\r\n*2\r\n"])
+            + b"$5\r\nalice\r\n$1\r\n1\r\n"
+        )
+        await processor.process_command((Command.XACK, "jobs", "workers", "1-1", "1-9"))
+        assert response[-1] == b":1\r\n"
+        await processor.process_command((Command.XPENDING, "jobs", "workers"))
+        assert response[-1] == b"*4\r\n:0\r\n$-1\r\n$-1\r\n$-1\r\n"
+
+        await processor.process_command(
+            (Command.XREADGROUP, "GROUP", "workers", "bob", "STREAMS", "jobs", ">")
+        )
+        await processor.process_command(
+            (Command.XCLAIM, "jobs", "workers", "alice", "0", "1-2", "JUSTID")
+        )
+        assert response[-1] == b"*1\r\n$3\r\n1-2\r\n"
+        await processor.process_command(
+            (Command.XPENDING, "jobs", "workers", "-", "+", "10", "alice")
+        )
+        assert response[-1].startswith(b"*1\r\n*4\r\n$3\r\n1-2\r\n$5\r\nalice\r\n:")
+        # JUSTID leaves the delivery count alone
+        assert response[-1].endswith(b":1\r\n")
+        await processor.process_command(
+            (Command.XAUTOCLAIM, "jobs", "workers", "bob", "0", "0", "JUSTID")
+        )
+        assert response[-1] == b"*3\r\n$3\r\n0-0\r\n*1\r\n$3\r\n1-2\r\n*0\r\n"
+
+    async def test_errors(self):
+        processor = Processor(Writer(), Storage())
+        response = processor.writer.response
+        await processor.process_command(
+            (Command.XGROUP, "CREATE", "jobs", "workers", "$")
+        )
+        assert response[-1].startswith(b"-ERR The XGROUP subcommand requires")
+        await processor.process_command(
+            (Command.XGROUP, "CREATE", "jobs", "workers", "$", "MKSTREAM")
+        )
+        assert response[-1] == b"+OK\r\n"
+        await processor.process_command(
+            (Command.XREADGROUP, "GROUP", "other", "alice", "STREAMS", "jobs", ">")
+        )
+        assert (
+            response[-1] == b"-NOGROUP No such key 'jobs' or consumer group 'other'\r\n"
+        )
+        await processor.process_command(
+            (Command.XREADGROUP, "GROUP", "workers", "alice", "STREAMS", "jobs")
+        )
+        assert response[-1].startswith(b"-ERR Unbalanced 'xreadgroup'")
+        await processor.process_command(
+            (Command.XREADGROUP, "GROUP", "workers", "alice", "STREAMS", "jobs", ">")
+        )
+        assert response[-1] == b"*-1\r\n"
+        await processor.process_command((Command.XACK, "nothing", "workers", "1-1"))
+        assert response[-1] == b":0\r\n"
+
+    async def test_blocking_read_is_woken_by_xadd(self):
+        storage = Storage()
+        reader = Processor(Writer(), storage)
+        writer = Processor(Writer(), storage)
+        await writer.process_command(
+            (Command.XGROUP, "CREATE", "jobs", "workers", "$", "MKSTREAM")
+        )
+        blocked = asyncio.create_task(
+            reader.process_command(
+                (Command.XREADGROUP, "GROUP", "workers", "alice", "BLOCK", "0")
+                + ("STREAMS", "jobs", ">")
+            )
+        )
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        await writer.process_command((Command.XADD, "jobs", "1-1", "task", "a"))
+        await asyncio.wait_for(blocked, 1)
+        assert b"$3\r\n1-1\r\n" in reader.writer.response[-1]
+        assert not storage.stream_waiters
+
+    async def test_blocking_read_times_out(self):
+        storage = Storage()
+        processor = Processor(Writer(), storage)
+        await processor.process_command(
+            (Command.XGROUP, "CREATE", "jobs", "workers", "$", "MKSTREAM")
+        )
+        await processor.process_command(
+            (Command.XREADGROUP, "GROUP", "workers", "alice", "BLOCK", "10")
+            + ("STREAMS", "jobs", ">")
+        )
+        assert processor.writer.response[-1] == b"*-1\r\n"
+        assert not storage.stream_waiters
+
+
+class TestBulkIngest:
+    def test_coalesce_xadds(self):
+        first = (Command.XADD, "events", "*", "n", "1")
+        second = (Command.XADD, "events", "*", "n", "2")
+        capped = (Command.XADD, "events", "MAXLEN", "5", "*", "n", "3")
+        other = (Command.XADD, "other", "*", "n", "4")
+        ping = (Command.PING,)
+        assert coalesce_xadds([first, second, first, ping, capped, other]) == [
+            XaddBatch("events", [first, second, first]),
+            ping,
+            capped,
+            other,
+        ]
+        assert coalesce_xadds([first, ping, second]) == [first, ping, second]
+
+    def test_clock_is_read_once_per_loop_pass(self):
+        storage = Storage()
+
+        async def readings():
+            first = storage.stream_clock()
+            storage._clock_ms += 5  # a later reading would differ
+            same = storage.stream_clock()
+            await asyncio.sleep(0)
+            return first, same, storage._clock_ms
+
+        first, same, after = asyncio.run(readings())
+        assert same == first + 5
+        assert after is None
+
+    @pytest.mark.asyncio
+    async def test_batch_replies_and_replication(self, monkeypatch):
+        propagated = []
+        monkeypatch.setattr(
+            "app.processor.replication.propagate",
+            lambda command, args, db: propagated.append((command, args)),
+        )
+        storage = Storage()
+        processor = Processor(Writer(), storage)
+        await processor.process_command(
+            XaddBatch(
+                "events",
+                [
+                    (Command.XADD, "events", "1-*", "n", "1"),
+                    (Command.XADD, "events", "1-1", "n", "2"),
+                    (Command.XADD, "events", "*", "n", "3"),
+                    (Command.XADD, "events", "*", "n", "4"),
+                ],
+            )
+        )
+        (reply,) = processor.writer.response
+        replies = reply.split(b"\r\n")
+        assert replies[:2] == [b"$3", b"1-1"]
+        assert replies[2].startswith(b"-ERR The ID specified in XADD is equal")
+        clock = storage.get_stream("events").last_id[0]
+        assert replies[4:7:2] == [f"{clock}-0".encode(), f"{clock}-1".encode()]
+        assert [args[1] for _, args in propagated] == [
+            "1-1",
+            f"{clock}-0",
+            f"{clock}-1",
+        ]
+        assert storage.get_stream("events").entries_added == 3
+
+    @pytest.mark.asyncio
+    async def test_batch_wakes_a_blocked_reader_once(self, monkeypatch):
+        storage = Storage()
+        wakes = []
+        wake = storage.wake_stream_waiters
+        monkeypatch.setattr(
+            storage, "wake_stream_waiters", lambda key: wakes.append(key) or wake(key)
+        )
+        reader = Processor(Writer(), storage)
+        await reader.process_command(
+            (Command.XGROUP, "CREATE", "events", "workers", "$", "MKSTREAM")
+        )
+        blocked = asyncio.create_task(
+            reader.process_command(
+                (Command.XREADGROUP, "GROUP", "workers", "alice", "BLOCK", "0")
+                + ("STREAMS", "events", ">")
+            )
+        )
+        await asyncio.sleep(0.01)
+        batch = [(Command.XADD, "events", f"1-{seq}", "n", "v") for seq in range(1, 4)]
+        await Processor(Writer(), storage).process_command(XaddBatch("events", batch))
+        await asyncio.wait_for(blocked, 1)
+        assert wakes == ["events"]
+        assert reader.writer.response[-1].count(b"$1\r\nn\r\n") == 3
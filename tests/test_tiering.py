@@ -0,0 +1,115 @@
+import gc
+
+import pytest
+
+from app.config import config
+from app.formatter import formatter
+from app.parser import Command
+from app.processor import Processor
+from app.replication import snapshot
+from app.storage import Storage, Value
+from app.tiering import ColdTier, ColdValue
+
+
+@pytest.fixture()
+def tiered_storage(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "tiered_value_min_size", 100)
+    storage = Storage()
+    storage.enable_tiering(str(tmp_path))
+    yield storage
+    storage.data.clear()
+    gc.collect()
+
+
+class Writer:
+    def __init__(self):
+        self.response = []
+
+    def write(self, data) -> None:
+        self.response.append(bytes(data))
+
+    async def drain(self):
+        pass
+
+
+class TestColdTier:
+    def test_store_and_release(self, tmp_path):
+        tier = ColdTier(str(tmp_path), 1024)
+        first = tier.store(b"a" * 600)
+        second = tier.store(b"b" * 600)
+        assert bytes(first.view()) == b"a" * 600
+        assert bytes(second.view()) == b"b" * 600
+        # The second value did not fit and started a new segment
+        assert first.segment is not second.segment
+        assert len(list(tmp_path.iterdir())) == 2
+
+        sealed = first.segment
+        del first
+        gc.collect()
+        assert sealed.live == 0
+        assert tier.compact(0.5) == 1024
+        assert len(list(tmp_path.iterdir())) == 1
+
+    def test_compaction_relocates_live_values(self, tmp_path):
+        tier = ColdTier(str(tmp_path), 1024)
+        dead = tier.store(b"x" * 700)
+        kept = tier.store(b"y" * 200)
+        tier.store(b"z" * 900)  # seals the first segment
+        sealed = kept.segment
+        del dead
+        gc.collect()
+        tier.compact(0.5)
+        assert kept.segment is not sealed
+        assert bytes(kept.view()) == b"y" * 200
+        assert sealed.id not in tier.segments
+
+    def test_segment_kept_while_a_view_is_exported(self, tmp_path):
+        tier = ColdTier(str(tmp_path), 1024)
+        value = tier.store(b"v" * 1000)
+        tier.store(b"w" * 1000)
+        view = value.view()
+        del value
+        gc.collect()
+        tier.compact(0.5)
+        assert len(tier.closing) == 1
+        del view
+        tier.compact(0.5)
+        assert tier.closing == []
+
+
+@pytest.mark.asyncio
+class TestTieredStorage:
+    async def test_demote_cold(self, tiered_storage):
+        await tiered_storage.set("cold", Value("c" * 200))
+        await tiered_storage.set("hot", Value("h" * 200))
+        await tiered_storage.set("small", Value("s"))
+        tiered_storage.get("hot")
+        assert tiered_storage.demote_cold(10) == 1
+        assert isinstance(tiered_storage.data["cold"].item, ColdValue)
+        assert tiered_storage.data["hot"].item == "h" * 200
+        assert tiered_storage.data["small"].item == "s"
+        # The pass finished, hot has to be read again to stay in memory
+        assert tiered_storage.recently_accessed == set()
+        assert tiered_storage.demote_cold(10) == 1
+
+    async def test_get_serves_from_mapping(self, tiered_storage):
+        await tiered_storage.set("cold", Value("c" * 200))
+        tiered_storage.demote_cold(10)
+        processor = Processor(Writer(), tiered_storage)
+        await processor.process_command((Command.GET, "cold"))
+        assert b"".join(processor.writer.response) == b"$200\r\n" + b"c" * 200 + b"\r\n"
+        await processor.process_command((Command.STRLEN, "cold"))
+        assert processor.writer.response[-1] == b":200\r\n"
+        assert formatter.format_mget_response(tiered_storage.mget(["cold"])) == (
+            b"*1\r\n$200\r\n" + b"c" * 200 + b"\r\n"
+        )
+        assert b"c" * 200 in snapshot(tiered_storage)
+
+    async def test_writes_bring_values_back(self, tiered_storage):
+        await tiered_storage.set("cold", Value("c" * 200))
+        tiered_storage.demote_cold(10)
+        segment = tiered_storage.data["cold"].item.segment
+        assert tiered_storage.append("cold", "!") == 201
+        assert tiered_storage.data["cold"].item == bytearray(b"c" * 200 + b"!")
+        gc.collect()
+        assert segment.live == 0
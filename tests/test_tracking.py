@@ -0,0 +1,61 @@
+from app.config import config
+from app.tracking import Tracking, invalidate_message
+
+
+class Writer:
+    def __init__(self):
+        self.response = []
+
+    def write(self, data: bytes) -> None:
+        self.response.append(data)
+
+
+class TestTracking:
+    def test_invalidate_message(self):
+        assert invalidate_message(["foo"]) == (
+            b">2\r\n$10\r\ninvalidate\r\n*1\r\n$3\r\nfoo\r\n"
+        )
+        assert invalidate_message(None) == b">2\r\n$10\r\ninvalidate\r\n_\r\n"
+
+    def test_default_mode_invalidates_once(self):
+        tracking = Tracking()
+        reader, other = Writer(), Writer()
+        tracking.enable(reader, bcast=False, prefixes=[])
+        tracking.enable(other, bcast=False, prefixes=[])
+        tracking.remember(reader, ["foo"])
+        tracking.invalidate("foo")
+        tracking.invalidate("foo")
+        tracking.invalidate("bar")
+        assert reader.response == [invalidate_message(["foo"])]
+        assert other.response == []
+
+    def test_bcast_prefixes(self):
+        tracking = Tracking()
+        users, everything = Writer(), Writer()
+        tracking.enable(users, bcast=True, prefixes=["user:"])
+        tracking.enable(everything, bcast=True, prefixes=[])
+        tracking.invalidate("user:1")
+        tracking.invalidate("order:1")
+        assert users.response == [invalidate_message(["user:1"])]
+        assert len(everything.response) == 2
+        tracking.disable(users)
+        assert tracking.prefixes == {"": {everything}}
+
+    def test_table_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(config, "tracking_table_max_keys", 2)
+        tracking = Tracking()
+        reader = Writer()
+        tracking.enable(reader, bcast=False, prefixes=[])
+        tracking.remember(reader, ["a", "b", "c"])
+        assert list(tracking.table) == ["b", "c"]
+        assert reader.response == [invalidate_message(["a"])]
+
+    def test_disabled_clients_are_skipped(self):
+        tracking = Tracking()
+        reader, other = Writer(), Writer()
+        tracking.enable(reader, bcast=False, prefixes=[])
+        tracking.enable(other, bcast=False, prefixes=[])
+        tracking.remember(reader, ["foo"])
+        tracking.disable(reader)
+        tracking.invalidate("foo")
+        assert reader.response == []